@@ -0,0 +1,414 @@
+"""A local stand-in for the HubSpot endpoints the apps call.
+
+Serves synthetic portals of any size without holding them in memory:
+contact `i` is generated on demand and only created, updated or deleted
+contacts are stored. Every request can be delayed (`latency` plus up to
+`jitter` seconds), a `rate_429` fraction of them is answered with a
+429 and `Retry-After`, like HubSpot's burst limit, and a `rate_503`
+fraction with a 503, to play an outage. Calls are counted per
+endpoint so a benchmark can tell how much upstream traffic each app
+request cost.
+
+Run on its own with `python -m bench.mock_hubspot --contacts 100000` and
+point an app at it with `HUBSPOT_API_BASE=http://127.0.0.1:8765`. Any
+access token works; a token ending in `-<hub id>` selects that portal.
+"""
+from collections import Counter
+from datetime import datetime, timezone
+from fastapi import FastAPI, Request, Depends
+from fastapi.responses import JSONResponse
+import argparse
+import asyncio
+import random
+import threading
+import time
+import uvicorn
+
+# Synthetic contact `i` was created and last modified `i` seconds after this.
+EPOCH_MS = 1704067200000
+SEARCH_WINDOW = 10000
+PROPERTY_NAMES = [
+    "email", "firstname", "lastname", "phone", "company", "jobtitle", "lifecyclestage",
+    "hs_lead_status", "createdate", "lastmodifieddate", "hs_object_id",
+]
+DEFAULT_PROPERTIES = ["email", "firstname", "lastname", "createdate", "lastmodifieddate", "hs_object_id"]
+
+
+def _iso(ms: int) -> str:
+    return datetime.fromtimestamp(ms / 1000, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def _ms(iso: str) -> int:
+    return int(datetime.fromisoformat(iso.replace("Z", "+00:00")).timestamp() * 1000)
+
+
+class UpstreamError(Exception):
+    def __init__(self, status: int, message: str, headers=None, category: str = "VALIDATION_ERROR"):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+        self.category = category
+
+
+class SyntheticPortal:
+    """One portal's contacts: `size` generated ones plus whatever was written since."""
+
+    def __init__(self, hub_id: int, size: int):
+        self.hub_id = hub_id
+        self.size = size
+        self._written = {}
+        self._deleted = set()
+        self._emails = {}
+        self._next_id = size + 1
+
+    def _generated(self, i: int) -> dict:
+        modified = EPOCH_MS + i * 1000
+        return {
+            "email": f"contact{i}@example.com",
+            "firstname": f"First{i}",
+            "lastname": f"Last{i % 997}",
+            "phone": f"+1 555 {i:07d}",
+            "company": f"Company {i % 101}",
+            "jobtitle": None,
+            "lifecyclestage": "lead",
+            "hs_lead_status": None,
+            "createdate": _iso(modified),
+            "lastmodifieddate": _iso(modified),
+            "hs_object_id": str(i),
+        }
+
+    def exists(self, i: int) -> bool:
+        return i not in self._deleted and (1 <= i <= self.size or i in self._written)
+
+    def values(self, i: int) -> dict:
+        return self._written.get(i) or self._generated(i)
+
+    def record(self, i: int, properties=None) -> dict:
+        values = self.values(i)
+        names = properties or DEFAULT_PROPERTIES
+        return {
+            "id": str(i),
+            "properties": {name: values.get(name) for name in names if name in PROPERTY_NAMES},
+            "createdAt": values["createdate"],
+            "updatedAt": values["lastmodifieddate"],
+            "archived": False,
+        }
+
+    def find_email(self, email: str):
+        if not email:
+            return None
+        email = email.lower()
+        if email in self._emails:
+            return self._emails[email]
+        local, _, domain = email.partition("@")
+        if domain == "example.com" and local.startswith("contact") and local[7:].isdigit():
+            i = int(local[7:])
+            if self.exists(i) and i not in self._written:
+                return i
+        return None
+
+    def _store(self, i: int, values: dict):
+        old = self._written.get(i)
+        if old and old.get("email"):
+            self._emails.pop(old["email"].lower(), None)
+        self._written[i] = values
+        if values.get("email"):
+            self._emails[values["email"].lower()] = i
+
+    def create(self, properties: dict) -> int:
+        if self.find_email(properties.get("email")) is not None:
+            raise UpstreamError(409, f"Contact already exists. Existing ID: {self.find_email(properties['email'])}",
+                                category="CONFLICT")
+        i = self._next_id
+        self._next_id += 1
+        now = _iso(int(time.time() * 1000))
+        self._store(i, {**{name: None for name in PROPERTY_NAMES}, **properties,
+                        "createdate": now, "lastmodifieddate": now, "hs_object_id": str(i)})
+        return i
+
+    def update(self, i: int, properties: dict):
+        if not self.exists(i):
+            raise UpstreamError(404, "resource not found", category="OBJECT_NOT_FOUND")
+        self._store(i, {**self.values(i), **properties, "lastmodifieddate": _iso(int(time.time() * 1000))})
+
+    def page(self, after: int, limit: int) -> list:
+        ids = []
+        i = after + 1
+        while len(ids) < limit and i < self._next_id:
+            if self.exists(i):
+                ids.append(i)
+            i += 1
+        return ids
+
+    def modified_since(self, since: int):
+        """Ids modified at or after `since` (epoch ms), oldest first."""
+        first = max(1, -(-(since - EPOCH_MS) // 1000))
+        for i in range(first, self.size + 1):
+            if i not in self._written and i not in self._deleted:
+                yield i
+        written = sorted(
+            (self._written[i]["lastmodifieddate"], i) for i in self._written if i not in self._deleted
+        )
+        for modified, i in written:
+            if _ms(modified) >= since:
+                yield i
+
+
+    def modified_at(self, modified: int):
+        """Ids modified exactly at `modified` (epoch ms)."""
+        return (i for i in self.modified_since(modified) if _ms(self.values(i)["lastmodifieddate"]) == modified)
+
+
+class MockHubSpot:
+    """Portals, fault injection and call counts behind `create_mock_app`."""
+
+    def __init__(self, contacts: int = 10000, portals: int = 1, latency: float = 0.0, jitter: float = 0.0,
+                 rate_429: float = 0.0, retry_after: float = 1.0, rate_503: float = 0.0, seed: int = None):
+        self.portals = {hub_id: SyntheticPortal(hub_id, contacts) for hub_id in range(1, portals + 1)}
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.rate_503 = rate_503
+        self._random = random.Random(seed)
+        self.calls = Counter()
+        self.statuses = Counter()
+
+    def portal(self, access_token: str) -> SyntheticPortal:
+        _, _, suffix = (access_token or "").rpartition("-")
+        return self.portals.get(int(suffix) if suffix.isdigit() else 1) or self.portals[1]
+
+    def reset(self):
+        self.calls.clear()
+        self.statuses.clear()
+
+    def stats(self) -> dict:
+        return {"calls": dict(self.calls), "total": sum(self.calls.values()), "statuses": dict(self.statuses)}
+
+    async def upstream_call(self, request: Request):
+        """Counts, delays and maybe rate-limits every request; runs as an app-wide dependency."""
+        self.calls[f"{request.method} {request.scope['route'].path}"] += 1
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.rate_429 and self._random.random() < self.rate_429:
+            raise UpstreamError(429, "You have reached your secondly limit.",
+                                headers={"Retry-After": str(self.retry_after)}, category="RATE_LIMITS")
+        if self.rate_503 and self._random.random() < self.rate_503:
+            raise UpstreamError(503, "Service unavailable.", category="SERVICE_UNAVAILABLE")
+
+
+def _token(request: Request) -> str:
+    return request.headers.get("authorization", "").removeprefix("Bearer ")
+
+
+def create_mock_app(mock: MockHubSpot) -> FastAPI:
+    app = FastAPI(dependencies=[Depends(mock.upstream_call)])
+    app.state.mock = mock
+
+    @app.middleware("http")
+    async def count_statuses(request: Request, call_next):
+        response = await call_next(request)
+        if not request.url.path.startswith("/__bench"):
+            mock.statuses[response.status_code] += 1
+        return response
+
+    @app.exception_handler(UpstreamError)
+    async def upstream_error(request: Request, e: UpstreamError):
+        return JSONResponse(
+            {"status": "error", "message": e.message, "category": e.category, "correlationId": "bench"},
+            status_code=e.status, headers=e.headers,
+        )
+
+    def properties_param(request: Request):
+        names = [name for value in request.query_params.getlist("properties") for name in value.split(",") if name]
+        return names or None
+
+    @app.get("/oauth/v1/access-tokens/{token}")
+    async def access_token_info(token: str):
+        return {"token": token, "hub_id": mock.portal(token).hub_id, "user_id": 1, "app_id": 1,
+                "expires_in": 1800, "token_type": "access", "scopes": [], "hub_domain": "bench.example.com",
+                "user": "bench@example.com"}
+
+    @app.post("/oauth/v1/token")
+    async def token(request: Request):
+        form = await request.form()
+        refresh = form.get("refresh_token") or f"refresh-{form.get('code', 'bench')}"
+        return {"access_token": f"access-{int(time.time())}-1", "refresh_token": refresh,
+                "expires_in": 1800, "token_type": "bearer"}
+
+    @app.get("/crm/v3/properties/contacts")
+    async def properties():
+        return {"results": [{"name": name, "label": name, "type": "string", "fieldType": "text",
+                             "groupName": "contactinformation", "description": "", "options": []}
+                            for name in PROPERTY_NAMES]}
+
+    @app.get("/crm/v3/objects/contacts")
+    async def list_contacts(request: Request, limit: int = 10, after: int = 0):
+        portal = mock.portal(_token(request))
+        ids = portal.page(after, min(limit, 100))
+        body = {"results": [portal.record(i, properties_param(request)) for i in ids]}
+        if ids and portal.page(ids[-1], 1):
+            body["paging"] = {"next": {"after": str(ids[-1]), "link": ""}}
+        return body
+
+    @app.get("/crm/v3/objects/contacts/{contact_id}")
+    async def get_contact(request: Request, contact_id: int):
+        portal = mock.portal(_token(request))
+        if not portal.exists(contact_id):
+            raise UpstreamError(404, "resource not found", category="OBJECT_NOT_FOUND")
+        return portal.record(contact_id, properties_param(request))
+
+    @app.post("/crm/v3/objects/contacts", status_code=201)
+    async def create_contact(request: Request):
+        portal = mock.portal(_token(request))
+        body = await request.json()
+        return portal.record(portal.create(body.get("properties") or {}), PROPERTY_NAMES)
+
+    @app.patch("/crm/v3/objects/contacts/{contact_id}")
+    async def update_contact(request: Request, contact_id: int):
+        portal = mock.portal(_token(request))
+        body = await request.json()
+        portal.update(contact_id, body.get("properties") or {})
+        return portal.record(contact_id, PROPERTY_NAMES)
+
+    @app.post("/crm/v3/objects/contacts/search")
+    async def search(request: Request):
+        portal = mock.portal(_token(request))
+        body = await request.json()
+        offset = int(body.get("after") or 0)
+        limit = min(int(body.get("limit") or 10), 200)
+        if offset + limit > SEARCH_WINDOW:
+            raise UpstreamError(400, f"The search API can only page through {SEARCH_WINDOW} results")
+        since, instant, after_id = 0, None, 0
+        for group in body.get("filterGroups") or []:
+            for f in group.get("filters") or []:
+                if f.get("propertyName") == "lastmodifieddate" and f.get("operator") in ("GTE", "GT"):
+                    since = int(f["value"]) + (f["operator"] == "GT")
+                elif f.get("propertyName") == "lastmodifieddate" and f.get("operator") == "EQ":
+                    since = instant = int(f["value"])
+                elif f.get("propertyName") == "hs_object_id" and f.get("operator") == "GT":
+                    after_id = int(f["value"])
+        matches = portal.modified_since(since)
+        if instant is not None:
+            matches = sorted(i for i in portal.modified_at(instant) if i > after_id)
+        ids = []
+        for position, i in enumerate(matches):
+            if position >= offset + limit + 1:
+                break
+            if position >= offset:
+                ids.append(i)
+        results = [portal.record(i, body.get("properties")) for i in ids[:limit]]
+        response = {"total": len(ids) + offset, "results": results}
+        if len(ids) > limit:
+            response["paging"] = {"next": {"after": str(offset + limit)}}
+        return response
+
+    @app.post("/crm/v3/objects/contacts/batch/read")
+    async def batch_read(request: Request):
+        portal = mock.portal(_token(request))
+        body = await request.json()
+        results = []
+        for item in body.get("inputs") or []:
+            if body.get("idProperty") == "email":
+                i = portal.find_email(item["id"])
+            else:
+                i = int(item["id"]) if str(item["id"]).isdigit() else None
+            if i is not None and portal.exists(i):
+                results.append(portal.record(i, body.get("properties")))
+        return {"status": "COMPLETE", "results": results}
+
+    @app.post("/crm/v3/objects/contacts/batch/{kind}")
+    async def batch_write(request: Request, kind: str):
+        portal = mock.portal(_token(request))
+        body = await request.json()
+        results, errors = [], []
+        for item in body.get("inputs") or []:
+            try:
+                if kind == "create":
+                    i = portal.create(item.get("properties") or {})
+                elif kind == "update":
+                    i = int(item["id"])
+                    portal.update(i, item.get("properties") or {})
+                else:
+                    raise UpstreamError(404, f"Unknown batch operation {kind}")
+            except UpstreamError as e:
+                if kind not in ("create", "update"):
+                    raise
+                errors.append({"status": "error", "category": e.category, "message": e.message,
+                               "context": {"ids": [str(item.get("id"))]} if kind == "update" else {}})
+                continue
+            results.append(portal.record(i, list((item.get("properties") or {}).keys())))
+        status = 207 if errors else (201 if kind == "create" else 200)
+        return JSONResponse({"status": "COMPLETE", "results": results, "errors": errors}, status_code=status)
+
+    # Outside the counted API: lets a harness in another process read and reset the counts.
+    bench = FastAPI()
+    app.mount("/__bench", bench)
+
+    @bench.get("/stats")
+    async def bench_stats():
+        return mock.stats()
+
+    @bench.post("/reset")
+    async def bench_reset():
+        mock.reset()
+        return mock.stats()
+
+    return app
+
+
+class MockServer:
+    """Runs the mock under uvicorn on a background thread, so blocking SDK clients can reach it too."""
+
+    def __init__(self, mock: MockHubSpot, host: str = "127.0.0.1", port: int = 8765):
+        self.mock = mock
+        self.url = f"http://{host}:{port}"
+        config = uvicorn.Config(create_mock_app(mock), host=host, port=port, log_level="warning",
+                                access_log=False, lifespan="off")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, name="mock-hubspot", daemon=True)
+
+    def start(self) -> "MockServer":
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if not self._thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError(f"Mock HubSpot server did not start on {self.url}")
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--contacts", type=int, default=10000, help="synthetic contacts per portal")
+    parser.add_argument("--portals", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every upstream call")
+    parser.add_argument("--jitter", type=float, default=0.02, help="up to this many extra seconds, uniformly")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of calls answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--rate-503", type=float, default=0.0, help="fraction of calls answered with a 503")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def mock_from_args(args) -> MockHubSpot:
+    return MockHubSpot(contacts=args.contacts, portals=args.portals, latency=args.latency, jitter=args.jitter,
+                       rate_429=args.rate_429, retry_after=args.retry_after, rate_503=args.rate_503,
+                       seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    add_mock_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    uvicorn.run(create_mock_app(mock_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Load-test both apps against the mock HubSpot server and report latency, throughput and upstream calls.
+
+    python -m bench.run --contacts 100000 --concurrency 1 10 50 --requests 500
+    python -m bench.run --json bench.json                       # save results
+    python -m bench.run --baseline bench.json --tolerance 0.25  # exit 1 on a regression
+
+Each (app, scenario, concurrency) run gets a fresh app lifespan, so caches
+start cold; `--warmup` requests are sent first and left out of the numbers.
+Apps are driven in-process through `httpx.ASGITransport`, so latencies are
+the app's own time plus the mock's, without a server in front. Polling the
+contact mirror is off unless `--mirror` is given, in which case each run
+waits for the first sync before measuring.
+"""
+from dataclasses import dataclass, asdict
+from itertools import count
+from os import environ
+import argparse
+import asyncio
+import importlib
+import json
+import random
+import statistics
+import sys
+import time
+import httpx
+from bench.mock_hubspot import MockServer, add_mock_arguments, mock_from_args
+
+APPS = ["endpoint_integration", "lib_integration"]
+SCENARIOS = ["list", "get", "create", "update"]
+
+
+@dataclass
+class Result:
+    app: str
+    scenario: str
+    concurrency: int
+    requests: int
+    errors: int
+    seconds: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    throughput: float
+    upstream_calls: int
+    upstream_per_request: float
+    upstream_429s: int
+
+    @property
+    def key(self) -> tuple:
+        return self.app, self.scenario, self.concurrency
+
+
+class Scenario:
+    """Builds the n-th request of a scenario; ids and pages are spread over the whole portal."""
+
+    def __init__(self, name: str, contacts: int, portals: int, seed: int = None):
+        self.name = name
+        self.contacts = contacts
+        self.portals = portals
+        self._random = random.Random(seed)
+        self._serial = count()
+
+    def token(self) -> str:
+        return f"bench-{self._random.randint(1, self.portals)}"
+
+    def contact_id(self) -> int:
+        return self._random.randint(1, self.contacts)
+
+    async def send(self, client: httpx.AsyncClient) -> httpx.Response:
+        cookies = {"access_token": self.token()}
+        if self.name == "list":
+            after = self._random.randrange(0, max(1, self.contacts - 100), 100)
+            return await client.get(f"/get-all-contacts?format=json&after={after}", cookies=cookies)
+        if self.name == "get":
+            return await client.get(f"/get-contact/{self.contact_id()}?format=json", cookies=cookies)
+        serial = next(self._serial)
+        form = {"first_name": f"Bench{serial}", "last_name": "Load", "phone": f"+1 555 {serial:07d}",
+                "email": f"bench{serial}-{time.monotonic_ns()}@example.net"}
+        if self.name == "create":
+            return await client.post("/create-contact", data=form, cookies=cookies)
+        return await client.post("/update-contact", data={**form, "contact_id": self.contact_id()}, cookies=cookies)
+
+
+def failed(response: httpx.Response) -> bool:
+    # The form routes answer errors with a 200 error page.
+    return response.status_code >= 400 or 'class="error-message"' in response.text
+
+
+def percentile(latencies, p: int) -> float:
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+    return statistics.quantiles(latencies, n=100, method="inclusive")[p - 1]
+
+
+async def wait_for_mirror(app, client: httpx.AsyncClient, portals: int, timeout: float = 600):
+    for portal in range(1, portals + 1):
+        await client.get("/get-contact/1?format=json", cookies={"access_token": f"bench-{portal}"})
+    deadline = time.monotonic() + timeout
+    while not all(app.state.gateway.mirror.ready(str(portal)) for portal in range(1, portals + 1)):
+        if time.monotonic() > deadline:
+            raise RuntimeError("Contact mirror did not finish its first sync")
+        await asyncio.sleep(0.1)
+
+
+async def run_one(module: str, scenario: Scenario, concurrency: int, requests: int, warmup: int,
+                  server: MockServer, mirror: bool) -> Result:
+    app = importlib.import_module(module).app
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                     timeout=120) as client:
+            if mirror:
+                await wait_for_mirror(app, client, scenario.portals)
+            for _ in range(warmup):
+                await scenario.send(client)
+            server.mock.reset()
+
+            latencies = []
+            errors = 0
+            remaining = iter(range(requests))
+
+            async def worker():
+                nonlocal errors
+                for _ in remaining:
+                    started = time.perf_counter()
+                    try:
+                        response = await scenario.send(client)
+                        errors += failed(response)
+                    except httpx.HTTPError:
+                        errors += 1
+                    latencies.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            seconds = time.perf_counter() - started
+
+    upstream = server.mock.stats()
+    return Result(
+        app=module,
+        scenario=scenario.name,
+        concurrency=concurrency,
+        requests=requests,
+        errors=errors,
+        seconds=round(seconds, 3),
+        p50_ms=round(percentile(latencies, 50) * 1000, 2),
+        p95_ms=round(percentile(latencies, 95) * 1000, 2),
+        p99_ms=round(percentile(latencies, 99) * 1000, 2),
+        throughput=round(requests / seconds, 1),
+        upstream_calls=upstream["total"],
+        upstream_per_request=round(upstream["total"] / requests, 3),
+        upstream_429s=upstream["statuses"].get(429, 0),
+    )
+
+
+def print_table(results):
+    columns = ["app", "scenario", "concurrency", "requests", "errors", "p50_ms", "p95_ms", "p99_ms",
+               "throughput", "upstream_calls", "upstream_per_request", "upstream_429s"]
+    rows = [[str(getattr(result, column)) for column in columns] for result in results]
+    widths = [max(len(column), *(len(row[i]) for row in rows)) for i, column in enumerate(columns)]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+
+
+def regressions(results, baseline: dict, tolerance: float) -> list:
+    """Runs whose p95 or upstream calls per request grew by more than `tolerance` over the baseline."""
+    found = []
+    previous = {(r["app"], r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    for result in results:
+        before = previous.get(result.key)
+        if before is None:
+            continue
+        for metric in ("p95_ms", "upstream_per_request"):
+            old, new = before[metric], getattr(result, metric)
+            if new > old * (1 + tolerance) and new - old > 0.001:
+                found.append(f"{'/'.join(map(str, result.key))}: {metric} {old} -> {new}")
+        if result.errors > before["errors"]:
+            found.append(f"{'/'.join(map(str, result.key))}: errors {before['errors']} -> {result.errors}")
+    return found
+
+
+async def run(args) -> list:
+    results = []
+    for module in args.apps:
+        for name in args.scenarios:
+            for concurrency in args.concurrency:
+                scenario = Scenario(name, args.contacts, args.portals, args.seed)
+                result = await run_one(module, scenario, concurrency, args.requests, args.warmup,
+                                       args.server, args.mirror)
+                print(f"{module} {name} c={concurrency}: p95 {result.p95_ms} ms, "
+                      f"{result.throughput} req/s, {result.upstream_per_request} upstream/req", file=sys.stderr)
+                results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    add_mock_arguments(parser)
+    parser.add_argument("--apps", nargs="+", default=APPS, choices=APPS)
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per run")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--mirror", action="store_true", help="serve reads from a synced contact mirror")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against results saved with --json")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    args.server = MockServer(mock_from_args(args), port=args.port).start()
+    environ.update(HUBSPOT_API_BASE=args.server.url, CONTACT_MIRROR_PATH=":memory:")
+    environ["CONTACT_MIRROR_INTERVAL"] = "3600" if args.mirror else "0"
+    environ.setdefault("LOG_LEVEL", "WARNING")
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        args.server.stop()
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": {key: value for key, value in vars(args).items() if key != "server"},
+                       "results": [asdict(result) for result in results]}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
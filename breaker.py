@@ -0,0 +1,129 @@
+from os import getenv
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Stops calling one HubSpot endpoint while it keeps failing.
+
+    Closed, calls go through; `threshold` failures in a row open the
+    circuit. Open, calls are refused at once until `reset_timeout` has
+    passed, then a single probe is let through (half-open): its success
+    closes the circuit, its failure opens it again for another
+    `reset_timeout`. Successful calls slower than `slow_call` seconds count
+    as failures, since a HubSpot that answers in 20s is down for our users.
+    """
+
+    def __init__(self, name: str, threshold: int, reset_timeout: float, slow_call: float = 0, on_change=None):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call = slow_call
+        self._on_change = on_change
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probing = False
+
+    def retry_after(self) -> float:
+        """Seconds until the next probe may go out; 0 once it is due."""
+        if self.state == CLOSED:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    @property
+    def probe_due(self) -> bool:
+        return self.state != CLOSED and not self._probing and self.retry_after() == 0
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; when it is the half-open probe, only this caller gets True."""
+        if self.state == CLOSED:
+            return True
+        if self.probe_due:
+            self._probing = True
+            self._set(HALF_OPEN)
+            return True
+        self.rejected += 1
+        return False
+
+    def success(self, seconds: float = 0.0):
+        if self.slow_call and seconds >= self.slow_call:
+            self.failure()
+            return
+        self.failures = 0
+        self._probing = False
+        self._set(CLOSED)
+
+    def failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and 0 < self.threshold <= self.failures):
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+            self._probing = False
+            self._set(OPEN)
+
+    def abandon(self):
+        """An allowed call ended without an answer (it was cancelled); a probe is owed again straight away."""
+        if self._probing:
+            self._probing = False
+            self.opened_at = time.monotonic() - self.reset_timeout
+            self._set(OPEN)
+
+    def _set(self, state: str):
+        if state != self.state:
+            self.state = state
+            if self._on_change is not None:
+                self._on_change(self)
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "retry_after": round(self.retry_after(), 3),
+        }
+
+
+class CircuitBreakers:
+    """One `CircuitBreaker` per endpoint (gateway operation), made on first use.
+
+    A threshold of 0 turns them off: circuits never open. `on_change`, if
+    set, is called with a breaker whenever its state changes.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float, slow_call: float = 0, on_change=None):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call = slow_call
+        self.on_change = on_change
+        self._breakers = {}
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreakers":
+        return cls(
+            threshold=int(getenv("HUBSPOT_BREAKER_THRESHOLD", "5")),
+            reset_timeout=float(getenv("HUBSPOT_BREAKER_RESET", "30")),
+            slow_call=float(getenv("HUBSPOT_BREAKER_SLOW_CALL", "8")),
+        )
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = self._breakers[name] = CircuitBreaker(
+                name, self.threshold, self.reset_timeout, self.slow_call, self.on_change
+            )
+        return breaker
+
+    def stats(self) -> dict:
+        return {
+            "threshold": self.threshold,
+            "reset_timeout": self.reset_timeout,
+            "slow_call": self.slow_call,
+            "endpoints": {name: breaker.stats() for name, breaker in self._breakers.items()},
+        }
@@ -0,0 +1,233 @@
+import asyncio
+import codecs
+import csv
+import io
+import json
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# HubSpot's batch endpoints take at most 100 inputs per call.
+BATCH_SIZE = 100
+
+# Upload columns named like the contact forms map onto HubSpot property names.
+COLUMN_ALIASES = {
+    "first_name": "firstname",
+    "last_name": "lastname",
+}
+ID_COLUMNS = ("id", "contact_id")
+INVALID_RECORD = "Not a JSON object"
+NO_PROPERTIES = "No properties to write"
+
+
+async def spool_upload(upload, chunk_size: int = 1 << 20):
+    """Copy an upload into a temporary file owned by the caller; raises ValueError unless it is UTF-8.
+
+    Starlette closes the uploaded file as soon as the handler returns, which
+    is before a streamed response has finished reading it. The file is
+    written and checked on a worker thread.
+    """
+    spool = await asyncio.to_thread(tempfile.TemporaryFile)
+    try:
+        while chunk := await upload.read(chunk_size):
+            await asyncio.to_thread(spool.write, chunk)
+        await asyncio.to_thread(check_encoding, spool, chunk_size)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+def check_encoding(file, chunk_size: int = 1 << 20):
+    """Raise ValueError unless `file` is UTF-8 throughout; leaves it rewound."""
+    file.seek(0)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    offset = 0
+    try:
+        while chunk := file.read(chunk_size):
+            decoder.decode(chunk)
+            offset += len(chunk)
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError as e:
+        raise ValueError(f"Upload is not UTF-8 text (bad byte near offset {offset + max(e.start, 0)})") from None
+    file.seek(0)
+
+
+def read_rows(file, filename: str):
+    """Yield `(row_number, contact_id, properties)` from a CSV or NDJSON upload.
+
+    The file is read one line at a time, so memory use does not grow with
+    the size of the upload, and is closed once exhausted. Rows without an id
+    are creates (or upserts, see `chunk_rows`), the rest updates. An NDJSON
+    line that isn't a JSON object comes back with `None` for properties,
+    so it can be reported as a failed row.
+    """
+    with io.TextIOWrapper(file, encoding="utf-8-sig", newline="") as text:
+        if filename.lower().endswith((".json", ".jsonl", ".ndjson")):
+            records = (_json_record(line) for line in text if line.strip())
+        else:
+            records = csv.DictReader(text)
+
+        for row_number, record in enumerate(records, start=1):
+            if record is None:
+                yield row_number, None, None
+                continue
+            contact_id = None
+            properties = {}
+            for column, value in record.items():
+                if value is None or value == "":
+                    continue
+                if column in ID_COLUMNS:
+                    contact_id = str(value)
+                else:
+                    properties[COLUMN_ALIASES.get(column, column)] = value
+            yield row_number, contact_id, properties
+
+
+def _json_record(line: str):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) else None
+
+
+def chunk_rows(rows, size: int = BATCH_SIZE, upsert: bool = False):
+    """Group rows into `("create" | "update" | "upsert" | "invalid", chunk)` batches of at most `size`.
+
+    With `upsert`, rows that have an email but no id are upserts, matched to
+    existing contacts by email instead of always being created. Rows
+    `read_rows` couldn't parse, and rows with nothing to write, are
+    "invalid"; `send_chunk` fails them without sending anything.
+    """
+    pending = {"create": [], "update": [], "upsert": [], "invalid": []}
+    for row in rows:
+        if not row[2]:
+            kind = "invalid"
+        elif row[1]:
+            kind = "update"
+        else:
+            kind = "upsert" if upsert and row[2].get("email") else "create"
+        pending[kind].append(row)
+        if len(pending[kind]) == size:
+            yield kind, pending[kind]
+            pending[kind] = []
+    for kind, chunk in pending.items():
+        if chunk:
+            yield kind, chunk
+
+
+def match_results(kind: str, chunk, results, errors) -> list:
+    """Turn one batch response into per-row outcomes.
+
+    `results` and `errors` are the batch response lists as plain dicts.
+    Updates are matched by id; creates by email, then by position.
+    """
+    status = "created" if kind == "create" else "updated"
+    outcomes = {}
+
+    if kind == "update":
+        by_id = {row[1]: row for row in chunk}
+        for result in results:
+            row = by_id.get(str(result.get("id")))
+            if row:
+                outcomes[row[0]] = {"row": row[0], "status": status, "id": row[1]}
+        for error in errors:
+            for contact_id in (error.get("context") or {}).get("ids", []):
+                row = by_id.get(str(contact_id))
+                if row:
+                    outcomes[row[0]] = {"row": row[0], "status": "error", "id": row[1], "error": error.get("message")}
+    else:
+        by_email = {}
+        for row in chunk:
+            email = (row[2].get("email") or "").lower()
+            if email:
+                by_email[email] = row
+        unmatched = []
+        for result in results:
+            email = ((result.get("properties") or {}).get("email") or "").lower()
+            row = by_email.pop(email, None)
+            if row:
+                outcomes[row[0]] = {"row": row[0], "status": status, "id": str(result.get("id"))}
+            else:
+                unmatched.append(result)
+        leftovers = (row for row in chunk if row[0] not in outcomes and not row[2].get("email"))
+        for row, result in zip(leftovers, unmatched):
+            outcomes[row[0]] = {"row": row[0], "status": status, "id": str(result.get("id"))}
+
+    message = errors[0].get("message") if errors else "No result returned for this row"
+    return [
+        outcomes.get(row[0]) or {"row": row[0], "status": "error", "id": row[1], "error": message}
+        for row in chunk
+    ]
+
+
+def failed_chunk(chunk, error: str) -> list:
+    return [{"row": row[0], "status": "error", "id": row[1], "error": error} for row in chunk]
+
+
+async def send_chunk(send_batch, kind: str, chunk) -> list:
+    """`send_batch(kind, chunk)`, except that "invalid" chunks fail at once."""
+    if kind == "invalid":
+        return [failed_chunk([row], INVALID_RECORD if row[2] is None else NO_PROPERTIES)[0] for row in chunk]
+    return await send_batch(kind, chunk)
+
+
+async def in_thread(iterator):
+    """Step a blocking iterator (file reads, CSV parsing) on a worker thread, one item at a time."""
+    iterator = iter(iterator)
+    done = object()
+    while (item := await asyncio.to_thread(next, iterator, done)) is not done:
+        yield item
+
+
+async def run_bulk(rows, send_batch, concurrency: int = 4, upsert: bool = False):
+    """Send `rows` in batches, at most `concurrency` in flight, yielding per-row outcomes.
+
+    `send_batch(kind, chunk)` is an async callable returning the outcomes for
+    one chunk. Outcomes are yielded as chunks finish, so they may arrive out
+    of row order; each carries its row number.
+    """
+
+    async def send(kind, chunk):
+        try:
+            return await send_chunk(send_batch, kind, chunk)
+        except Exception as e:
+            return failed_chunk(chunk, str(e))
+
+    in_flight = set()
+    try:
+        async for kind, chunk in in_thread(chunk_rows(rows, upsert=upsert)):
+            if len(in_flight) >= concurrency:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    for outcome in task.result():
+                        yield outcome
+            in_flight.add(asyncio.create_task(send(kind, chunk)))
+        while in_flight:
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                for outcome in task.result():
+                    yield outcome
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+
+async def ndjson_report(outcomes):
+    """Stream per-row outcomes as NDJSON, ending with a summary line.
+
+    If the upload can't be read to the end, an error line comes before the
+    summary of what was sent.
+    """
+    summary = {"rows": 0, "created": 0, "updated": 0, "failed": 0}
+    try:
+        async for outcome in outcomes:
+            summary["rows"] += 1
+            summary["failed" if outcome["status"] == "error" else outcome["status"]] += 1
+            yield json.dumps(outcome) + "\n"
+    except Exception as e:
+        logger.warning("Bulk upload stopped early", extra={"fields": {"rows": summary["rows"], "error": str(e)}})
+        yield json.dumps({"error": f"Upload stopped after {summary['rows']} rows: {e}"}) + "\n"
+    yield json.dumps({"summary": summary}) + "\n"
@@ -0,0 +1,38 @@
+import asyncio
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key onto one in-flight future.
+
+    The first caller for a key starts the work; anyone arriving while it is
+    still running awaits the same result (or exception) instead of starting
+    another call. Nothing is cached once the call completes.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self.calls = 0
+        self.collapsed = 0
+
+    async def do(self, key, fn, *args, **kwargs):
+        self.calls += 1
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.collapsed += 1
+        else:
+            future = asyncio.ensure_future(fn(*args, **kwargs))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Shielded so one caller going away doesn't cancel the call for the rest.
+        return await asyncio.shield(future)
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "collapsed": self.collapsed,
+            "upstream": self.calls - self.collapsed,
+            "in_flight": len(self._in_flight),
+        }
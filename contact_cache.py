@@ -0,0 +1,221 @@
+from os import getenv
+import json
+import time
+from cache import TTLCache
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+# When a record was stored (wall clock), kept inside it so entries in Redis carry it too.
+CACHED_AT = "_cached_at"
+
+
+class MemoryContactStore:
+    """In-process LRU/TTL store; each worker process has its own."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._records = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key):
+        return self._records.get(key)
+
+    async def set(self, key, record):
+        self._records.set(key, record)
+
+    async def delete(self, key):
+        self._records.pop(key)
+
+    async def close(self):
+        self._records.clear()
+
+    def stats(self) -> dict:
+        return self._records.stats()
+
+
+class RedisContactStore:
+    """Store shared by every worker through a Redis-compatible server.
+
+    Needs the optional `redis` package.
+    """
+
+    def __init__(self, url: str, ttl: float):
+        if redis is None:
+            raise RuntimeError("CONTACT_CACHE_REDIS_URL is set but the 'redis' package is not installed")
+        self._redis = redis.from_url(url)
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(key):
+        portal, contact_id = key
+        return f"contact:{portal}:{contact_id}"
+
+    async def get(self, key):
+        raw = await self._redis.get(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key, record):
+        await self._redis.set(self._key(key), json.dumps(record, default=str), ex=int(self.ttl))
+
+    async def delete(self, key):
+        await self._redis.delete(self._key(key))
+
+    async def close(self):
+        await self._redis.aclose()
+
+    def stats(self) -> dict:
+        return {}
+
+
+class SharedContactStore:
+    """Store shared by every worker through `shared_state`, fronted by a small per-process copy.
+
+    Reads try the local copy first, then the shared state. Writes go to
+    both and tell the other workers to drop their local copies, so a change
+    made through one worker is seen by the rest within the state's
+    invalidation delay. Local copies expire after `local_ttl` seconds
+    anyway, which bounds staleness if an invalidation is missed.
+    """
+
+    def __init__(self, state, ttl: float, local_size: int, local_ttl: float):
+        self._state = state
+        self.ttl = ttl
+        self._local = TTLCache(maxsize=local_size, ttl=local_ttl)
+        self.invalidations = 0
+        state.subscribe("contact", self._invalidated)
+
+    @staticmethod
+    def _key(key):
+        portal, contact_id = key
+        return f"contact:{portal}:{contact_id}"
+
+    def _invalidated(self, message):
+        self.invalidations += 1
+        self._local.pop((message["portal"], message["id"]))
+
+    async def get(self, key):
+        record = self._local.get(key)
+        if record is None:
+            record = await self._state.get(self._key(key))
+            if record is not None:
+                self._local.set(key, record)
+        return record
+
+    async def set(self, key, record):
+        self._local.set(key, record)
+        await self._state.set(self._key(key), record, self.ttl)
+        await self._state.publish("contact", {"portal": key[0], "id": key[1]})
+
+    async def delete(self, key):
+        self._local.pop(key)
+        await self._state.delete(self._key(key))
+        await self._state.publish("contact", {"portal": key[0], "id": key[1]})
+
+    async def close(self):
+        self._local.clear()
+
+    def stats(self) -> dict:
+        return {**{f"local_{name}": value for name, value in self._local.stats().items()},
+                "invalidations": self.invalidations}
+
+
+class ContactCache:
+    """Read-through, write-through cache of contact records keyed by portal and id.
+
+    Records are plain dicts (the HubSpot JSON shape); callers must not
+    mutate what they get back. They are fresh for `ttl` seconds but kept
+    `stale_ttl` seconds longer, for `get(..., stale=True)` to serve while
+    HubSpot is unavailable.
+    """
+
+    def __init__(self, store, ttl: float, stale_ttl: float = 0):
+        self._store = store
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    @classmethod
+    def from_env(cls, state=None) -> "ContactCache":
+        """CONTACT_CACHE_REDIS_URL wins; otherwise the cache is shared if `state` is."""
+        ttl = float(getenv("CONTACT_CACHE_TTL", "300"))
+        stale_ttl = float(getenv("CONTACT_CACHE_STALE_TTL", "3600"))
+        size = int(getenv("CONTACT_CACHE_SIZE", "10000"))
+        url = getenv("CONTACT_CACHE_REDIS_URL")
+        if url:
+            return cls(RedisContactStore(url, ttl + stale_ttl), ttl, stale_ttl)
+        if state is not None and state.shared:
+            local_ttl = float(getenv("CONTACT_CACHE_LOCAL_TTL", "30"))
+            return cls(SharedContactStore(state, ttl + stale_ttl, size, local_ttl), ttl, stale_ttl)
+        return cls(MemoryContactStore(size, ttl + stale_ttl), ttl, stale_ttl)
+
+    async def get(self, portal: str, contact_id: str, properties=None, stale: bool = False):
+        """The cached record, or None; with `properties`, only a record holding all of them counts.
+
+        With `stale`, a record past its TTL is returned too; its `CACHED_AT` says how old it is.
+        """
+        record = await self._store.get((portal, str(contact_id)))
+        if record is not None and properties and not set(properties) <= (record.get("properties") or {}).keys():
+            record = None
+        if stale:
+            return record
+        if record is not None and record.get(CACHED_AT, 0) + self.ttl <= time.time():
+            record = None
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return record
+
+    async def put(self, portal: str, record: dict):
+        self.writes += 1
+        await self._store.set((portal, str(record["id"])), {**record, CACHED_AT: time.time()})
+
+    async def merge(self, portal: str, record: dict):
+        """Store `record`, keeping properties an earlier fetch cached that this one didn't ask for.
+
+        The merged record keeps the earlier `CACHED_AT`, so it is only as fresh as its
+        oldest property; once that entry is past its TTL, `record` replaces it instead.
+        """
+        key = (portal, str(record["id"]))
+        cached = await self._store.get(key)
+        now = time.time()
+        self.writes += 1
+        if cached is None or cached.get(CACHED_AT, 0) + self.ttl <= now:
+            await self._store.set(key, {**record, CACHED_AT: now})
+            return
+        await self._store.set(key, {
+            **cached, **record, CACHED_AT: cached[CACHED_AT],
+            "properties": {**(cached.get("properties") or {}), **(record.get("properties") or {})},
+        })
+
+    async def patch(self, portal: str, contact_id: str, properties: dict) -> bool:
+        """Merge changed properties into a cached record; False if it isn't cached."""
+        key = (portal, str(contact_id))
+        record = await self._store.get(key)
+        if record is None:
+            return False
+        self.writes += 1
+        await self._store.set(key, {**record, "properties": {**(record.get("properties") or {}), **properties}})
+        return True
+
+    async def invalidate(self, portal: str, contact_id: str):
+        await self._store.delete((portal, str(contact_id)))
+
+    async def close(self):
+        await self._store.close()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self._store).__name__,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            **{f"store_{name}": value for name, value in self._store.stats().items()},
+        }
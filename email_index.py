@@ -0,0 +1,75 @@
+from hashlib import blake2b
+from os import getenv
+from cache import TTLCache
+
+
+def email_key(email: str):
+    """A short digest of the normalised address, or None for a blank one.
+
+    The index keys on this rather than the address, which keeps entries
+    small and addresses out of process memory dumps.
+    """
+    email = (email or "").strip().lower()
+    return blake2b(email.encode(), digest_size=8).digest() if email else None
+
+
+class EmailIndex:
+    """Which contact id each email address belongs to, per portal.
+
+    Kept warm from every contact the gateway sees (list pages, mirror sync
+    searches, reads and writes) and from webhook changes, so upserts can
+    tell creates from updates without asking HubSpot. Entries are only a
+    hint: a contact deleted or re-addressed behind our back is caught when
+    the write fails, and the caller looks the address up again.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._ids = TTLCache(maxsize=maxsize, ttl=ttl, on_evict=self._evicted)
+        # (portal, contact id) -> key, so a contact's old address is dropped when it changes.
+        self._keys = {}
+
+    @classmethod
+    def from_env(cls) -> "EmailIndex":
+        return cls(
+            maxsize=int(getenv("EMAIL_INDEX_SIZE", "500000")),
+            ttl=float(getenv("EMAIL_INDEX_TTL", "86400")),
+        )
+
+    def _evicted(self, key, contact_id):
+        portal, _ = key
+        if self._keys.get((portal, contact_id)) == key[1]:
+            del self._keys[(portal, contact_id)]
+
+    def get(self, portal: str, email: str):
+        key = email_key(email)
+        return self._ids.get((portal, key)) if key else None
+
+    def add(self, portal: str, contact_id: str, email: str):
+        contact_id = str(contact_id)
+        # Drop the contact's previous address and whichever contact last had this one.
+        self.forget_contact(portal, contact_id)
+        self.forget(portal, email)
+        key = email_key(email)
+        if key is not None:
+            self._ids.set((portal, key), contact_id)
+            self._keys[(portal, contact_id)] = key
+
+    def learn(self, portal: str, contacts):
+        """Record the address of every contact in `contacts` that came with one."""
+        for contact in contacts:
+            if "email" in contact.properties:
+                self.add(portal, contact.id, contact.properties["email"])
+
+    def forget(self, portal: str, email: str):
+        key = email_key(email)
+        contact_id = self._ids.pop((portal, key)) if key else None
+        if contact_id is not None and self._keys.get((portal, contact_id)) == key:
+            del self._keys[(portal, contact_id)]
+
+    def forget_contact(self, portal: str, contact_id: str):
+        key = self._keys.pop((portal, str(contact_id)), None)
+        if key is not None:
+            self._ids.pop((portal, key))
+
+    def stats(self) -> dict:
+        return self._ids.stats()
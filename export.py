@@ -0,0 +1,66 @@
+import asyncio
+import csv
+import io
+import json
+
+# Largest page size the CRM list endpoint accepts.
+PAGE_SIZE = 100
+
+
+async def iter_contacts(fetch_page, prefetch: int = 2):
+    """Yield every contact across all pages, fetching up to `prefetch` pages ahead.
+
+    `fetch_page` is an async callable taking the `after` cursor (None for the
+    first page) and returning `(results, next_after)`. At most `prefetch`
+    pages are buffered, so memory stays flat however large the portal is.
+    """
+    queue = asyncio.Queue(maxsize=prefetch)
+
+    async def produce():
+        after = None
+        try:
+            while True:
+                results, after = await fetch_page(after)
+                await queue.put(results)
+                if not after:
+                    break
+        except Exception as e:
+            await queue.put(e)
+        await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            page = await queue.get()
+            if page is None:
+                return
+            if isinstance(page, Exception):
+                raise page
+            for contact in page:
+                yield contact
+    finally:
+        # Stops the prefetcher when the client disconnects mid-stream.
+        producer.cancel()
+
+
+async def ndjson_lines(contacts):
+    async for contact in contacts:
+        yield json.dumps(contact, default=str) + "\n"
+
+
+async def csv_lines(contacts, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    writer.writerow(["id", *columns])
+    yield flush()
+    async for contact in contacts:
+        properties = contact.get("properties") or {}
+        writer.writerow([contact.get("id"), *(properties.get(column) for column in columns)])
+        yield flush()
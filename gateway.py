@@ -0,0 +1,572 @@
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
+from functools import partial
+from itertools import chain
+from math import ceil
+from os import getenv
+from typing import NamedTuple
+import asyncio
+import logging
+import time
+from breaker import CLOSED, CircuitBreakers
+from bulk import BATCH_SIZE, failed_chunk, match_results
+from coalescing import SingleFlight
+from contact_cache import CACHED_AT, ContactCache
+from email_index import EmailIndex, email_key
+from metrics import Metrics
+from mirror import ContactMirror, MirrorSync
+from portals import PortalLimits, PortalRegistry
+from scheduler import Priority, RequestScheduler
+from schema_cache import DISPLAY_PROPERTIES, PropertySchemaCache
+from webhooks import apply_contact_events
+
+logger = logging.getLogger(__name__)
+
+
+class HubSpotError(Exception):
+    """A non-2xx answer from HubSpot, whichever backend made the call.
+
+    Carries `status` and `headers` so the scheduler can spot 429s and read
+    `Retry-After` the same way for every transport.
+    """
+
+    def __init__(self, status: int, message: str, headers=None, body=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+        self.body = body
+
+
+class CircuitOpenError(HubSpotError):
+    """Refused without calling HubSpot: the operation's circuit is open after repeated failures."""
+
+    def __init__(self, operation: str, retry_after: float):
+        seconds = max(1, ceil(retry_after))
+        super().__init__(
+            503, f"HubSpot is not answering {operation} calls; try again in {seconds}s",
+            headers={"Retry-After": str(seconds)},
+        )
+        self.operation = operation
+        self.retry_after = retry_after
+
+
+def is_outage(error) -> bool:
+    """True for failures that mean HubSpot itself is in trouble: 5xx, timeouts, dropped connections."""
+    if isinstance(error, HubSpotError):
+        return error.status >= 500
+    return isinstance(error, Exception)
+
+
+def _as_of(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat(timespec="seconds") if epoch else None
+
+
+def _timestamp(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value) if value is not None else None
+
+
+@dataclass
+class Contact:
+    id: str
+    properties: dict = field(default_factory=dict)
+    created_at: str = None
+    updated_at: str = None
+    archived: bool = False
+    # Set when this is an older local copy served because HubSpot is unavailable; `as_of` is when it was current.
+    stale: bool = False
+    as_of: str = None
+
+    @classmethod
+    def from_dict(cls, record: dict) -> "Contact":
+        """Build from HubSpot JSON, an SDK model's `to_dict()`, or a cached or mirrored record."""
+        return cls(
+            id=str(record["id"]),
+            properties=dict(record.get("properties") or {}),
+            created_at=_timestamp(record.get("createdAt", record.get("created_at"))),
+            updated_at=_timestamp(record.get("updatedAt", record.get("updated_at"))),
+            archived=bool(record.get("archived") or False),
+        )
+
+    def to_dict(self) -> dict:
+        """HubSpot's JSON shape, which is what the cache, the mirror and exports hold."""
+        record = {"id": self.id, "properties": self.properties, "archived": self.archived}
+        if self.created_at:
+            record["createdAt"] = self.created_at
+        if self.updated_at:
+            record["updatedAt"] = self.updated_at
+        return record
+
+    def with_properties(self, names) -> "Contact":
+        """This contact with every name in `names` present, None where HubSpot sent nothing.
+
+        That way a cached copy remembers which properties it was fetched with.
+        """
+        return replace(self, properties={**{name: None for name in names}, **self.properties})
+
+    def project(self, names) -> dict:
+        """Just the id and the named properties, for partial responses and templates."""
+        return {"id": self.id, "properties": {name: self.properties.get(name) for name in names}}
+
+
+class ContactPage(NamedTuple):
+    """One page of contacts; unpacks as `(results, next_after)` like any page fetcher."""
+    results: list
+    next_after: str = None
+
+
+class OperationStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds_total = 0.0
+        self.seconds_max = 0.0
+
+    def record(self, seconds: float, failed: bool):
+        self.calls += 1
+        self.errors += failed
+        self.seconds_total += seconds
+        self.seconds_max = max(self.seconds_max, seconds)
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "seconds_avg": round(self.seconds_total / self.calls, 6) if self.calls else 0.0,
+            "seconds_max": round(self.seconds_max, 6),
+        }
+
+
+class HubSpotGateway:
+    """Typed contact operations over a pluggable transport backend.
+
+    The backend (`HttpBackend` or `SdkBackend`) only moves requests and
+    responses. Everything else is done here, once, for both: per-portal
+    pacing and 429 retries, per-operation circuit breakers, coalescing of
+    identical reads, the contact cache, the local mirror, the email index,
+    property schemas and per-operation timings.
+    """
+
+    def __init__(self, backend, scheduler: RequestScheduler, contacts: ContactCache,
+                 schemas: PropertySchemaCache, mirror: ContactMirror, metrics: Metrics, breakers: CircuitBreakers,
+                 emails: EmailIndex, state=None):
+        self.backend = backend
+        self.scheduler = scheduler
+        self.contacts = contacts
+        self.schemas = schemas
+        self.mirror = mirror
+        self.metrics = metrics
+        self.breakers = breakers
+        self.breakers.on_change = self._circuit_changed
+        self.emails = emails
+        self.reads = SingleFlight()
+        self.portals = PortalRegistry(partial(self._call, None, "hub_id", backend.hub_id), scheduler.limits)
+        self.sync = MirrorSync.from_env(mirror, self._search_page, state)
+        self._operations = {}
+        self._revalidating = set()
+        self.stale_served = 0
+
+    @classmethod
+    def from_env(cls, backend, metrics: Metrics, state=None) -> "HubSpotGateway":
+        """`state` (see `shared_state`) is what worker processes share: rate budgets, contacts, schemas."""
+        return cls(
+            backend,
+            scheduler=RequestScheduler.from_env(PortalLimits.from_env(), backend.max_concurrency, state),
+            contacts=ContactCache.from_env(state),
+            schemas=PropertySchemaCache.from_env(state),
+            mirror=ContactMirror.from_env(),
+            metrics=metrics,
+            breakers=CircuitBreakers.from_env(),
+            emails=EmailIndex.from_env(),
+            state=state,
+        )
+
+    async def start(self):
+        await self.mirror.open()
+
+    async def close(self):
+        for task in self._revalidating:
+            task.cancel()
+        await asyncio.gather(*self._revalidating, return_exceptions=True)
+        await self.sync.close()
+        await self.mirror.close()
+        await self.contacts.close()
+        await self.schemas.close()
+        self.scheduler.close()
+        await self.backend.close()
+
+    async def _call(self, portal, operation: str, fn, *args, priority: Priority = Priority.INTERACTIVE, **kwargs):
+        """One paced, retried upstream call, timed under `operation`.
+
+        Fails fast with `CircuitOpenError` while the operation's circuit is open.
+        """
+        breaker = self.breakers.get(operation)
+        if not breaker.allow():
+            self.metrics.rejected.inc(operation)
+            raise CircuitOpenError(operation, breaker.retry_after())
+        stats = self._operations.get(operation)
+        if stats is None:
+            stats = self._operations[operation] = OperationStats()
+        upstream = 0.0
+
+        async def attempt(*args, **kwargs):
+            # Each try is timed on its own, so a retried 429 shows up as one 429 and one success.
+            nonlocal upstream
+            started = time.monotonic()
+            status = "cancelled"
+            try:
+                result = await fn(*args, **kwargs)
+                status = "2xx"
+                return result
+            except HubSpotError as e:
+                status = e.status
+                raise
+            except Exception:
+                status = "error"
+                raise
+            finally:
+                seconds = time.monotonic() - started
+                upstream += seconds
+                self.metrics.observe_upstream(self.backend.name, operation, status, seconds)
+
+        started = time.monotonic()
+        failed = True
+        error = None
+        try:
+            result = await self.scheduler.call(portal, attempt, *args, priority=priority, **kwargs)
+            failed = False
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            seconds = time.monotonic() - started
+            stats.record(seconds, failed)
+            self.metrics.observe_wait(operation, seconds - upstream)
+            if is_outage(error):
+                breaker.failure()
+            elif failed and error is None:
+                breaker.abandon()
+            else:
+                # A 404 or 409 still shows HubSpot is up.
+                breaker.success(upstream)
+
+    def _circuit_changed(self, breaker):
+        self.metrics.circuit_open.set(breaker.name, value=int(breaker.state != CLOSED))
+        log = logger.info if breaker.state == CLOSED else logger.warning
+        log("HubSpot circuit changed", extra={"fields": {
+            "operation": breaker.name, "state": breaker.state, "failures": breaker.failures,
+        }})
+
+    async def _coalesced(self, portal, operation: str, key: tuple, fn, *args, **kwargs):
+        # Concurrent identical reads for a portal share one upstream call, whichever token asked.
+        return await self.reads.do((portal, operation, *key), self._call, portal, operation, fn, *args, **kwargs)
+
+    async def exchange_token(self, form: dict) -> dict:
+        """POST an OAuth token form with the app's client credentials added."""
+        return await self._call(
+            None, "exchange_token", self.backend.exchange_token,
+            {"client_id": getenv('CLIENT_ID'), "client_secret": getenv('CLIENT_SECRET'), **form}
+        )
+
+    async def portal(self, access_token: str) -> str:
+        """The token's hub id; any portal a user works with gets mirrored, using the freshest token seen.
+
+        Without a token this fails with a 401 straight away, calling nobody.
+        """
+        if not access_token:
+            raise HubSpotError(401, "Authentication credentials not found")
+        portal = await self.portals.resolve(access_token)
+        self.sync.track(portal, access_token)
+        return portal
+
+    def mirror_covers(self, portal: str, properties) -> bool:
+        # The mirror only holds the display properties, and only hears of deletions through webhooks.
+        return (self.mirror.ready(portal) and self.sync.pushed(portal)
+                and set(properties) <= set(DISPLAY_PROPERTIES))
+
+    async def get_contact(self, access_token: str, portal: str, contact_id: str,
+                          properties=DISPLAY_PROPERTIES) -> Contact:
+        """Cache, then HubSpot; only a cached copy holding every property counts.
+
+        The mirror isn't read here: without webhooks it never hears of
+        deletions, so a contact page could outlive its contact. While
+        HubSpot is failing, whatever older copy there is (cache or mirror)
+        gets served instead, marked `stale`: stale-while-revalidate, where
+        the refresh goes out in the background as the circuit's half-open
+        probe.
+        """
+        record = await self.contacts.get(portal, contact_id, properties)
+        if record is not None:
+            return Contact.from_dict(record)
+
+        fetch = partial(self._fetch_contact, access_token, portal, contact_id, properties)
+        breaker = self.breakers.get("get_contact")
+        if breaker.state != CLOSED:
+            contact = await self._stale_contact(portal, contact_id, properties)
+            if contact is not None:
+                if breaker.probe_due:
+                    self._revalidate(fetch)
+                return contact
+        try:
+            return await fetch()
+        except Exception as e:
+            if not is_outage(e):
+                raise
+            contact = await self._stale_contact(portal, contact_id, properties)
+            if contact is None:
+                raise
+            return contact
+
+    async def _fetch_contact(self, access_token: str, portal: str, contact_id: str, properties) -> Contact:
+        # The schema is served from cache and refreshed in the background, never awaited here.
+        load_schema = partial(self._call, portal, "property_names", self.backend.property_names, access_token)
+        wanted = self.schemas.properties_for(portal, load_schema, properties)
+        contact = await self._coalesced(
+            portal, "get_contact", (contact_id, tuple(wanted)),
+            self.backend.get_contact, access_token, contact_id, wanted
+        )
+        self.emails.learn(portal, [contact])
+        contact = contact.with_properties(properties)
+        await self.contacts.merge(portal, contact.to_dict())
+        return contact
+
+    async def _stale_contact(self, portal: str, contact_id: str, properties):
+        """The newest local copy however old, from the cache or else the mirror; None if there is none."""
+        record = await self.contacts.get(portal, contact_id, stale=True)
+        if record is not None:
+            as_of = record.get(CACHED_AT)
+        else:
+            record = await self.mirror.get(portal, contact_id)
+            if record is None:
+                return None
+            as_of = await self.mirror.synced_at(portal)
+        self.stale_served += 1
+        return replace(Contact.from_dict(record).with_properties(properties), stale=True, as_of=_as_of(as_of))
+
+    def _revalidate(self, fetch):
+        task = asyncio.create_task(fetch())
+        self._revalidating.add(task)
+        task.add_done_callback(self._revalidated)
+
+    def _revalidated(self, task):
+        self._revalidating.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug("Background contact refresh failed", extra={"fields": {"error": str(task.exception())}})
+
+    def pager(self, access_token: str, portal: str, properties=DISPLAY_PROPERTIES,
+              priority: Priority = Priority.INTERACTIVE):
+        """An async `after -> ContactPage` fetcher, from the mirror when it covers `properties`
+        and webhooks are keeping it current (see `mirror_covers`).
+
+        The source is picked once, so a paged walk never switches cursors halfway.
+        """
+        if self.mirror_covers(portal, properties):
+            # Served locally: no HubSpot call and nothing taken from the rate budget.
+            return partial(self._mirror_page, portal)
+        return partial(self._upstream_page, access_token, portal, properties, priority)
+
+    async def _mirror_page(self, portal: str, after: str = None) -> ContactPage:
+        records, next_after = await self.mirror.page(portal, after)
+        return ContactPage([Contact.from_dict(record) for record in records], next_after)
+
+    async def _upstream_page(self, access_token, portal, properties, priority, after=None) -> ContactPage:
+        try:
+            page = await self._coalesced(
+                portal, "list_contacts", (after, tuple(properties), priority),
+                self.backend.list_contacts, access_token, properties, after, priority=priority
+            )
+            self.emails.learn(portal, page.results)
+            return page
+        except Exception as e:
+            # Someone looking at a page gets the mirror's copy, marked stale; exports fail rather than mix sources.
+            if priority != Priority.INTERACTIVE or not is_outage(e):
+                raise
+            page = await self._mirror_page(portal, after)
+            if not page.results:
+                raise
+            as_of = _as_of(await self.mirror.synced_at(portal))
+            self.stale_served += 1
+            return ContactPage([replace(contact, stale=True, as_of=as_of) for contact in page.results],
+                               page.next_after)
+
+    async def search(self, portal: str, **filters) -> ContactPage:
+        """Search the portal's mirror; see `ContactMirror.search` for the filters."""
+        records, next_after = await self.mirror.search(portal, **filters)
+        return ContactPage([Contact.from_dict(record) for record in records], next_after)
+
+    async def create_contact(self, access_token: str, portal: str, properties: dict) -> Contact:
+        contact = await self._call(portal, "create_contact", self.backend.create_contact, access_token, properties)
+        self.emails.learn(portal, [contact])
+        # Write through so the detail page and later reads are served locally.
+        await self.contacts.put(portal, contact.to_dict())
+        await self.mirror.upsert(portal, [contact.to_dict()])
+        return contact
+
+    async def update_contact(self, access_token: str, portal: str, contact_id: str, properties: dict) -> Contact:
+        try:
+            contact = await self._call(
+                portal, "update_contact", self.backend.update_contact, access_token, contact_id, properties
+            )
+        except Exception:
+            await self.contacts.invalidate(portal, contact_id)
+            raise
+        self.emails.learn(portal, [contact])
+        await self.contacts.put(portal, contact.to_dict())
+        await self.mirror.upsert(portal, [contact.to_dict()])
+        return contact
+
+    async def upsert_contact(self, access_token: str, portal: str, properties: dict) -> Contact:
+        """Update the contact that has this email address, or create one if HubSpot has none."""
+        email = properties.get("email")
+        if not email:
+            raise ValueError("An email address is needed to create or update by email")
+        for attempt in range(2):
+            # The second time round the index is skipped: it named a deleted contact, or someone just created one.
+            found = await self._find_emails(access_token, portal, [email], Priority.INTERACTIVE, fresh=attempt > 0)
+            contact_id = found.get(email_key(email))
+            try:
+                if contact_id is None:
+                    return await self.create_contact(access_token, portal, properties)
+                return await self.update_contact(access_token, portal, contact_id, properties)
+            except HubSpotError as e:
+                if attempt or e.status not in (404, 409):
+                    raise
+
+    async def _find_emails(self, access_token: str, portal: str, emails, priority: Priority, fresh=False) -> dict:
+        """`email_key` -> contact id for the addresses HubSpot has: the index first, then batch reads by email."""
+        found = {}
+        missing = []
+        for email in emails:
+            if fresh:
+                self.emails.forget(portal, email)
+            contact_id = None if fresh else self.emails.get(portal, email)
+            if contact_id is None:
+                missing.append(email)
+            else:
+                found[email_key(email)] = contact_id
+        for start in range(0, len(missing), BATCH_SIZE):
+            contacts = await self._call(
+                portal, "read_contacts", self.backend.read_contacts, access_token, missing[start:start + BATCH_SIZE],
+                ["email"], id_property="email", priority=priority
+            )
+            self.emails.learn(portal, contacts)
+            for contact in contacts:
+                found[email_key(contact.properties.get("email"))] = contact.id
+        return found
+
+    async def batch_contacts(self, access_token: str, portal: str, kind: str, chunk) -> list:
+        """Create, update or upsert one chunk of bulk rows; returns per-row outcomes."""
+        if kind == "upsert":
+            return await self._upsert_chunk(access_token, portal, chunk)
+        if kind == "create":
+            inputs = [{"properties": properties} for _, _, properties in chunk]
+        else:
+            inputs = [{"id": contact_id, "properties": properties} for _, contact_id, properties in chunk]
+        results, errors = await self._call(
+            portal, f"batch_{kind}", self.backend.batch_contacts, access_token, kind, inputs,
+            priority=Priority.BULK
+        )
+        # Batch results only echo the properties sent, so drop cached copies rather than overwrite them,
+        # and merge the changes into mirrored rows.
+        if kind == "update":
+            for _, contact_id, _ in chunk:
+                await self.contacts.invalidate(portal, contact_id)
+            for contact in results:
+                await self.mirror.patch(portal, contact.id, contact.properties)
+        else:
+            await self.mirror.upsert(portal, [contact.to_dict() for contact in results])
+        self.emails.learn(portal, results)
+        return match_results(kind, chunk, [contact.to_dict() for contact in results], errors)
+
+    async def _upsert_chunk(self, access_token: str, portal: str, chunk) -> list:
+        """Batch-update the rows whose email HubSpot already has and batch-create the rest.
+
+        Rows go in passes, each holding at most one row per address, so a
+        repeated address updates the contact its first row created. A row
+        that fails is given one more pass with its address looked up afresh:
+        the index may have named a contact since deleted, or another writer
+        may have just created one. That includes rows whose whole batch was
+        refused.
+        """
+        outcomes = {}
+        retried = set()
+        pending = list(chunk)
+        while pending:
+            batch, later, seen = [], [], set()
+            for row in pending:
+                key = email_key(row[2]["email"])
+                (later if key in seen else batch).append(row)
+                seen.add(key)
+            found = await self._find_emails(
+                access_token, portal, [row[2]["email"] for row in batch if row[0] not in retried], Priority.BULK
+            )
+            found.update(await self._find_emails(
+                access_token, portal, [row[2]["email"] for row in batch if row[0] in retried], Priority.BULK,
+                fresh=True
+            ))
+            updates, creates = [], []
+            for number, _, properties in batch:
+                contact_id = found.get(email_key(properties["email"]))
+                if contact_id is None:
+                    creates.append((number, None, properties))
+                else:
+                    updates.append((number, contact_id, properties))
+            batches = [(kind, rows) for kind, rows in (("update", updates), ("create", creates)) if rows]
+            sent = await asyncio.gather(
+                *(self.batch_contacts(access_token, portal, kind, rows) for kind, rows in batches),
+                return_exceptions=True
+            )
+            for index, result in enumerate(sent):
+                # An open circuit holds the whole chunk back (resending the updates is harmless); any other
+                # failure, say a 409 for the batch, fails only that batch's rows, which then get retried.
+                if isinstance(result, (CircuitOpenError, asyncio.CancelledError)):
+                    raise result
+                if isinstance(result, Exception):
+                    sent[index] = failed_chunk(batches[index][1], str(result))
+            rows = {row[0]: row for row in batch}
+            for outcome in chain.from_iterable(sent):
+                if outcome["status"] == "error" and outcome["row"] not in retried:
+                    retried.add(outcome["row"])
+                    later.append(rows[outcome["row"]])
+                else:
+                    outcomes[outcome["row"]] = outcome
+            pending = sorted(later)
+        return [outcomes[row[0]] for row in chunk]
+
+    async def _search_page(self, portal: str, access_token: str, body: dict) -> tuple:
+        page = await self._call(
+            portal, "search_contacts", self.backend.search_contacts, access_token, body, priority=Priority.BULK
+        )
+        self.emails.learn(portal, page.results)
+        return [contact.to_dict() for contact in page.results], page.next_after
+
+    async def _read_batch(self, portal: str, access_token: str, contact_ids) -> list:
+        contacts = await self._call(
+            portal, "read_contacts", self.backend.read_contacts, access_token, contact_ids, DISPLAY_PROPERTIES,
+            priority=Priority.BULK
+        )
+        self.emails.learn(portal, contacts)
+        return [contact.to_dict() for contact in contacts]
+
+    async def apply_events(self, events):
+        """Apply a batch of webhook events to the cache and mirror."""
+        await apply_contact_events(
+            events, contacts=self.contacts, mirror=self.mirror, sync=self.sync, emails=self.emails,
+            read_batch=self._read_batch
+        )
+
+    def stats(self) -> dict:
+        return {
+            "backend": {"name": self.backend.name, **self.backend.stats()},
+            "operations": {name: stats.to_dict() for name, stats in self._operations.items()},
+            "breakers": {**self.breakers.stats(), "stale_served": self.stale_served},
+            "portals": self.portals.stats(),
+            "schemas": self.schemas.stats(),
+            "scheduler": self.scheduler.stats(),
+            "contacts": self.contacts.stats(),
+            "emails": self.emails.stats(),
+            "coalescing": self.reads.stats(),
+            "mirror": self.sync.stats(),
+        }
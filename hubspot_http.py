@@ -0,0 +1,157 @@
+from os import getenv
+import httpx
+from export import PAGE_SIZE
+from gateway import Contact, ContactPage, HubSpotError
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def api_base() -> str:
+    return getenv("HUBSPOT_API_BASE", "https://api.hubapi.com")
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Build the app-lifetime client used for every outbound HubSpot call.
+
+    Settings are read when the client is built (from the FastAPI lifespan),
+    so values coming from `.env` are already loaded.
+    """
+    limits = httpx.Limits(
+        max_connections=int(getenv("HUBSPOT_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(getenv("HUBSPOT_MAX_KEEPALIVE", "20")),
+        keepalive_expiry=float(getenv("HUBSPOT_KEEPALIVE_EXPIRY", "30")),
+    )
+    timeout = httpx.Timeout(
+        float(getenv("HUBSPOT_TIMEOUT", "10")),
+        connect=float(getenv("HUBSPOT_CONNECT_TIMEOUT", "5")),
+        pool=float(getenv("HUBSPOT_POOL_TIMEOUT", "5")),
+    )
+    # HTTP/2 needs the optional `h2` package; fall back to HTTP/1.1 keep-alive without it.
+    http2 = HTTP2_AVAILABLE and getenv("HUBSPOT_HTTP2", "true").lower() != "false"
+
+    return httpx.AsyncClient(
+        base_url=api_base(),
+        http2=http2,
+        limits=limits,
+        timeout=timeout,
+    )
+
+
+class HttpBackend:
+    """Raw REST transport for `HubSpotGateway`, over the shared pooled client."""
+
+    name = "http"
+
+    def __init__(self, http: httpx.AsyncClient, max_concurrency: int):
+        self.http = http
+        # The connection pool size; the scheduler shares this many slots across portals.
+        self.max_concurrency = max_concurrency
+        self.requests = 0
+        self.failures = 0
+
+    @classmethod
+    def from_env(cls) -> "HttpBackend":
+        return cls(create_http_client(), int(getenv("HUBSPOT_MAX_CONNECTIONS", "100")))
+
+    async def close(self):
+        await self.http.aclose()
+
+    async def _send(self, method: str, url: str, access_token: str = None, **kwargs):
+        headers = {"authorization": f'Bearer {access_token}'} if access_token else {}
+        headers.update(kwargs.pop("headers", {}))
+        self.requests += 1
+        response = await self.http.request(method, url, headers=headers, **kwargs)
+        if response.status_code >= 400:
+            self.failures += 1
+            raise _error(response)
+        return response.json()
+
+    async def get_contact(self, access_token: str, contact_id: str, properties) -> Contact:
+        data = await self._send(
+            "GET", f"/crm/v3/objects/contacts/{contact_id}", access_token,
+            params={"properties": ",".join(properties)}
+        )
+        return Contact.from_dict(data)
+
+    async def list_contacts(self, access_token: str, properties, after: str = None) -> ContactPage:
+        params = {"limit": PAGE_SIZE, "archived": "false", "properties": ",".join(properties)}
+        if after:
+            params["after"] = after
+        return _page(await self._send("GET", "/crm/v3/objects/contacts", access_token, params=params))
+
+    async def search_contacts(self, access_token: str, body: dict) -> ContactPage:
+        return _page(await self._send("POST", "/crm/v3/objects/contacts/search", access_token, json=body))
+
+    async def read_contacts(self, access_token: str, contact_ids, properties, id_property: str = None) -> list:
+        """Batch read; with `id_property` (say "email") the ids are values of that property instead."""
+        body = {"properties": list(properties), "inputs": [{"id": contact_id} for contact_id in contact_ids]}
+        if id_property:
+            body["idProperty"] = id_property
+        data = await self._send("POST", "/crm/v3/objects/contacts/batch/read", access_token, json=body)
+        return [Contact.from_dict(record) for record in data["results"]]
+
+    async def create_contact(self, access_token: str, properties: dict) -> Contact:
+        data = await self._send("POST", "/crm/v3/objects/contacts", access_token, json={"properties": properties})
+        return Contact.from_dict(data)
+
+    async def update_contact(self, access_token: str, contact_id: str, properties: dict) -> Contact:
+        data = await self._send(
+            "PATCH", f"/crm/v3/objects/contacts/{contact_id}", access_token, json={"properties": properties}
+        )
+        return Contact.from_dict(data)
+
+    async def batch_contacts(self, access_token: str, kind: str, inputs: list) -> tuple:
+        """Batch create or update; returns `(results, errors)`."""
+        self.requests += 1
+        response = await self.http.post(
+            f"/crm/v3/objects/contacts/batch/{kind}",
+            headers={"authorization": f'Bearer {access_token}'},
+            json={"inputs": inputs}
+        )
+        # 207 Multi-Status still carries per-object results; anything else >= 400 failed outright.
+        data = _json(response) if response.status_code >= 400 else response.json()
+        if response.status_code >= 400 and not data.get("results"):
+            self.failures += 1
+            raise _error(response)
+        return [Contact.from_dict(record) for record in data.get("results", [])], data.get("errors", [])
+
+    async def hub_id(self, access_token: str) -> str:
+        data = await self._send("GET", f"/oauth/v1/access-tokens/{access_token}")
+        return str(data["hub_id"])
+
+    async def exchange_token(self, form: dict) -> dict:
+        return await self._send(
+            "POST", "/oauth/v1/token", data=form,
+            headers={"Content-Type": "application/x-www-form-urlencoded"}
+        )
+
+    async def property_names(self, access_token: str) -> list:
+        data = await self._send("GET", "/crm/v3/properties/contacts", access_token)
+        return [prop["name"] for prop in data["results"]]
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "failures": self.failures}
+
+
+def _page(data: dict) -> ContactPage:
+    next_after = data.get("paging", {}).get("next", {}).get("after")
+    return ContactPage([Contact.from_dict(record) for record in data["results"]], next_after)
+
+
+def _json(response: httpx.Response) -> dict:
+    """An error response's JSON body, or {} when it has none (say, a proxy's HTML page)."""
+    try:
+        data = response.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _error(response: httpx.Response) -> HubSpotError:
+    data = _json(response)
+    message = data.get("message") or data.get("error_description") or f"HubSpot returned {response.status_code}"
+    return HubSpotError(response.status_code, message, headers=response.headers, body=response.text)
@@ -0,0 +1,423 @@
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from pathlib import Path
+import asyncio
+import logging
+import sqlite3
+import time
+import uuid
+from bulk import chunk_rows, failed_chunk, in_thread, read_rows, send_chunk
+from gateway import CircuitOpenError
+from shared_state import WORKER_ID
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    portal TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    upsert INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    error TEXT,
+    rows_total INTEGER,
+    rows_done INTEGER NOT NULL DEFAULT 0,
+    created INTEGER NOT NULL DEFAULT 0,
+    updated INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    chunks_done INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    run_seconds REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_portal ON jobs (portal, created_at);
+CREATE TABLE IF NOT EXISTS job_chunks (
+    job_id TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    PRIMARY KEY (job_id, chunk)
+);
+CREATE TABLE IF NOT EXISTS job_errors (
+    job_id TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    contact_id TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, row)
+);
+"""
+
+# Jobs in these states are picked up again when the app starts.
+UNFINISHED = ("queued", "waiting", "running")
+
+
+class JobStore:
+    """Import jobs, their committed chunks and per-row errors in a local SQLite file.
+
+    Same threading model as `ContactMirror`: one worker thread owns the
+    connection.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+        self._conn = None
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _connect(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        # Files made before jobs could upsert.
+        if "upsert" not in {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN upsert INTEGER NOT NULL DEFAULT 0")
+
+    async def open(self):
+        await self._run(self._connect)
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+        self._executor.shutdown(wait=False)
+
+    def _create(self, job: dict):
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, portal, filename, path, upsert, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job["id"], job["portal"], job["filename"], job["path"], int(job["upsert"]), job["status"],
+                 job["created_at"]),
+            )
+
+    async def create(self, job: dict):
+        await self._run(self._create, job)
+
+    def _get(self, job_id: str):
+        row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    async def get(self, job_id: str):
+        return await self._run(self._get, job_id)
+
+    def _list(self, portal: str, limit: int) -> list:
+        rows = self._conn.execute(
+            "SELECT * FROM jobs WHERE portal = ? ORDER BY created_at DESC LIMIT ?", (portal, limit)
+        )
+        return [dict(row) for row in rows]
+
+    async def list(self, portal: str, limit: int = 50) -> list:
+        return await self._run(self._list, portal, limit)
+
+    def _unfinished(self) -> list:
+        marks = ",".join("?" * len(UNFINISHED))
+        rows = self._conn.execute(f"SELECT id FROM jobs WHERE status IN ({marks}) ORDER BY created_at", UNFINISHED)
+        return [job_id for job_id, in rows]
+
+    async def unfinished(self) -> list:
+        return await self._run(self._unfinished)
+
+    def _update(self, job_id: str, fields: dict):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._conn:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    async def update(self, job_id: str, **fields):
+        await self._run(self._update, job_id, fields)
+
+    def _end_run(self, job_id: str, status: str, error: str, finished: bool):
+        # Adds the run's duration to the total, so throughput spans every run of a resumed job.
+        with self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, started_at = NULL,"
+                " run_seconds = run_seconds + COALESCE(? - started_at, 0) WHERE id = ?",
+                (status, error, time.time() if finished else None, time.time(), job_id),
+            )
+
+    async def end_run(self, job_id: str, status: str, error: str = None, finished: bool = True):
+        await self._run(self._end_run, job_id, status, error, finished)
+
+    def _done_chunks(self, job_id: str) -> set:
+        rows = self._conn.execute("SELECT chunk FROM job_chunks WHERE job_id = ?", (job_id,))
+        return {chunk for chunk, in rows}
+
+    async def done_chunks(self, job_id: str) -> set:
+        return await self._run(self._done_chunks, job_id)
+
+    def _commit_chunk(self, job_id: str, chunk: int, outcomes: list):
+        counts = {"created": 0, "updated": 0, "error": 0}
+        for outcome in outcomes:
+            counts[outcome["status"]] += 1
+        # One transaction, so a chunk is either fully recorded or re-sent on resume.
+        with self._conn:
+            self._conn.execute("INSERT INTO job_chunks (job_id, chunk) VALUES (?, ?)", (job_id, chunk))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO job_errors (job_id, row, contact_id, error) VALUES (?, ?, ?, ?)",
+                [(job_id, o["row"], o.get("id"), o.get("error")) for o in outcomes if o["status"] == "error"],
+            )
+            self._conn.execute(
+                "UPDATE jobs SET rows_done = rows_done + ?, created = created + ?, updated = updated + ?,"
+                " failed = failed + ?, chunks_done = chunks_done + 1 WHERE id = ?",
+                (len(outcomes), counts["created"], counts["updated"], counts["error"], job_id),
+            )
+
+    async def commit_chunk(self, job_id: str, chunk: int, outcomes: list):
+        await self._run(self._commit_chunk, job_id, chunk, outcomes)
+
+    def _errors(self, job_id: str, after: int, limit: int) -> list:
+        rows = self._conn.execute(
+            "SELECT row, contact_id, error FROM job_errors WHERE job_id = ? AND row > ? ORDER BY row LIMIT ?",
+            (job_id, after, limit),
+        )
+        return [{"row": row, "id": contact_id, "error": error} for row, contact_id, error in rows]
+
+    async def errors(self, job_id: str, after: int = 0, limit: int = 100) -> list:
+        return await self._run(self._errors, job_id, after, limit)
+
+
+def describe(job: dict) -> dict:
+    """A job's state, progress and throughput as the status endpoint returns it."""
+    run_seconds = job["run_seconds"]
+    if job["started_at"]:
+        run_seconds += time.time() - job["started_at"]
+    throughput = job["rows_done"] / run_seconds if run_seconds > 0 else 0.0
+    total = job["rows_total"]
+    remaining = total - job["rows_done"] if total is not None else None
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "filename": job["filename"],
+        "upsert": bool(job["upsert"]),
+        "error": job["error"],
+        "rows": {
+            "total": total,
+            "done": job["rows_done"],
+            "created": job["created"],
+            "updated": job["updated"],
+            "failed": job["failed"],
+        },
+        "progress": round(job["rows_done"] / total, 4) if total else (1.0 if total == 0 else None),
+        "throughput_rows_per_second": round(throughput, 1),
+        "eta_seconds": round(remaining / throughput, 1) if remaining and throughput else None,
+        "chunks_done": job["chunks_done"],
+        "created_at": job["created_at"],
+        "finished_at": job["finished_at"],
+        "run_seconds": round(run_seconds, 3),
+        "errors_url": f"/jobs/{job['id']}/errors",
+    }
+
+
+class JobRunner:
+    """Runs contact imports in the background, at most `workers` jobs at a time.
+
+    An upload is copied to `upload_dir` and the job recorded before
+    `submit` returns, so jobs survive a restart: anything unfinished is
+    queued again by `start`. Each job sends its rows in batches
+    (`concurrency` in flight) through `send_batch(token, portal, kind,
+    chunk)` and commits every finished chunk with its per-row errors, so a
+    resumed job skips the chunks already done. A chunk that was in flight
+    when the process stopped is sent again.
+
+    Jobs never store credentials, only the submitter's session id (in
+    memory, not in the job database). `token_for(portal, session_id)`
+    supplies a current access token for each chunk; a job with none (say,
+    after a restart, until someone from that portal signs in again) waits
+    and is retried every `retry_interval` seconds.
+
+    With several worker processes on one job database, a worker takes a
+    lease on a job in `state` (see `shared_state`) before running it and
+    renews it every `lease / 3` seconds. A job leased by another worker is
+    looked at again every `retry_interval` seconds, so it is picked up if
+    that worker dies and its lease lapses.
+    """
+
+    def __init__(self, store: JobStore, send_batch, token_for, upload_dir: str, workers: int, concurrency: int,
+                 retry_interval: float, state=None, lease: float = 60):
+        self.store = store
+        self._send_batch = send_batch
+        self._token_for = token_for
+        self.upload_dir = Path(upload_dir)
+        self.workers = workers
+        self.concurrency = concurrency
+        self.retry_interval = retry_interval
+        self._state = state
+        self.lease = lease
+        self._queue = asyncio.Queue()
+        self._sessions = {}
+        self._running = set()
+        self._tasks = []
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.leased_elsewhere = 0
+
+    @classmethod
+    def from_env(cls, send_batch, token_for, state=None) -> "JobRunner":
+        return cls(
+            JobStore(getenv("JOBS_DB_PATH", "jobs.db")),
+            send_batch,
+            token_for,
+            upload_dir=getenv("JOBS_UPLOAD_DIR", "job_uploads"),
+            workers=int(getenv("JOBS_WORKERS", "2")),
+            concurrency=int(getenv("HUBSPOT_BULK_CONCURRENCY", "4")),
+            retry_interval=float(getenv("JOBS_RETRY_INTERVAL", "10")),
+            state=state,
+            lease=float(getenv("JOBS_LEASE", "60")),
+        )
+
+    async def start(self):
+        await self.store.open()
+        self.upload_dir.mkdir(parents=True, exist_ok=True)
+        for job_id in await self.store.unfinished():
+            self._queue.put_nowait(job_id)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.store.close()
+
+    async def submit(self, portal: str, upload, session_id: str = None, upsert: bool = False) -> dict:
+        """Save the upload and queue it; returns the new job. With `upsert`, rows are matched by email."""
+        job_id = uuid.uuid4().hex
+        filename = upload.filename or "upload.csv"
+        path = self.upload_dir / f"{job_id}{Path(filename).suffix.lower() or '.csv'}"
+        f = await asyncio.to_thread(open, path, "wb")
+        try:
+            while chunk := await upload.read(1 << 20):
+                await asyncio.to_thread(f.write, chunk)
+        finally:
+            await asyncio.to_thread(f.close)
+        job = {"id": job_id, "portal": portal, "filename": filename, "path": str(path), "upsert": upsert,
+               "status": "queued", "created_at": time.time()}
+        await self.store.create(job)
+        if session_id:
+            self._sessions[job_id] = session_id
+        self.submitted += 1
+        self._queue.put_nowait(job_id)
+        return await self.store.get(job_id)
+
+    async def resume(self, job_id: str) -> bool:
+        """Queue a failed job again; it carries on after its last committed chunk."""
+        job = await self.store.get(job_id)
+        if job is None or job["status"] != "failed":
+            return False
+        await self.store.update(job_id, status="queued", error=None, finished_at=None)
+        self._queue.put_nowait(job_id)
+        return True
+
+    async def _hold(self, job_id: str):
+        """Renew this worker's lease on a running job."""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self._state.set(f"job:{job_id}", WORKER_ID, self.lease)
+            except Exception as e:
+                logger.warning("Error renewing job lease", extra={"fields": {"job": job_id, "error": str(e)}})
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            holder = None
+            if self._state is not None:
+                if not await self._state.add(f"job:{job_id}", WORKER_ID, self.lease):
+                    # Another worker process has it; look again later in case that worker dies.
+                    self.leased_elsewhere += 1
+                    asyncio.get_running_loop().call_later(self.retry_interval, self._queue.put_nowait, job_id)
+                    continue
+                holder = asyncio.create_task(self._hold(job_id))
+            self._running.add(job_id)
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                # Shutting down: leave it queued so the next start resumes it.
+                await asyncio.shield(self.store.end_run(job_id, "queued", finished=False))
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.warning("Import job failed", extra={"fields": {"job": job_id, "error": str(e)}})
+                await self.store.end_run(job_id, "failed", str(e))
+            finally:
+                self._running.discard(job_id)
+                if holder is not None:
+                    holder.cancel()
+                    await asyncio.shield(self._state.delete(f"job:{job_id}"))
+
+    async def _run(self, job_id: str):
+        job = await self.store.get(job_id)
+        if job is None or job["status"] not in UNFINISHED:
+            return
+        if await self._token_for(job["portal"], self._sessions.get(job_id)) is None:
+            await self.store.update(job_id, status="waiting")
+            asyncio.get_running_loop().call_later(self.retry_interval, self._queue.put_nowait, job_id)
+            return
+
+        await self.store.update(job_id, status="running", started_at=time.time())
+        if job["rows_total"] is None:
+            total = await asyncio.to_thread(_count_rows, job["path"], job["filename"])
+            await self.store.update(job_id, rows_total=total)
+
+        done = await self.store.done_chunks(job_id)
+        logger.info("Import job started", extra={"fields": {"job": job_id, "chunks_done": len(done)}})
+        in_flight = set()
+
+        async def send_batch(kind, chunk):
+            token = await self._token_for(job["portal"], self._sessions.get(job_id))
+            if token is None:
+                raise RuntimeError("No access token for this portal")
+            return await self._send_batch(token, job["portal"], kind, chunk)
+
+        async def send(index, kind, chunk):
+            while True:
+                try:
+                    outcomes = await send_chunk(send_batch, kind, chunk)
+                except CircuitOpenError as e:
+                    # HubSpot is down: hold the chunk until calls go through again rather than fail its rows.
+                    await asyncio.sleep(max(e.retry_after, 1.0))
+                    continue
+                except Exception as e:
+                    outcomes = failed_chunk(chunk, str(e))
+                break
+            await self.store.commit_chunk(job_id, index, outcomes)
+
+        try:
+            with open(job["path"], "rb") as f:
+                rows = read_rows(f, job["filename"])
+                # Reading and parsing the file happen on a worker thread, a chunk at a time.
+                async for index, (kind, chunk) in in_thread(enumerate(chunk_rows(rows, upsert=bool(job["upsert"])))):
+                    if index in done:
+                        continue
+                    if len(in_flight) >= self.concurrency:
+                        finished, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                        for task in finished:
+                            task.result()
+                    in_flight.add(asyncio.create_task(send(index, kind, chunk)))
+            await asyncio.gather(*in_flight)
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+        await self.store.end_run(job_id, "completed")
+        self.completed += 1
+        self._sessions.pop(job_id, None)
+        Path(job["path"]).unlink(missing_ok=True)
+        logger.info("Import job completed", extra={"fields": {"job": job_id}})
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize(),
+            "running": len(self._running),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "leased_elsewhere": self.leased_elsewhere,
+        }
+
+
+def _count_rows(path: str, filename: str) -> int:
+    with open(path, "rb") as f:
+        return sum(1 for _ in read_rows(f, filename))
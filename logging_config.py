@@ -0,0 +1,154 @@
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from os import getenv
+import json
+import logging
+import queue
+import random
+import re
+import sys
+
+# Request path of the request being handled, for sampling and for the log line itself.
+route_var = ContextVar("route", default=None)
+
+SENSITIVE_KEYS = {
+    "access_token", "refresh_token", "access_key", "id_token", "token",
+    "code", "client_secret", "authorization", "hubspot_session",
+}
+REDACTED = "[REDACTED]"
+_SENSITIVE_TEXT = re.compile(
+    r"(?i)(bearer\s+|/access-tokens/|/refresh-tokens/|\b(?:access_token|refresh_token|access_key|client_secret|code|token)[\"']?\s*[=:]\s*[\"']?)[^\s\"'&,;}]+"
+)
+
+
+def redact(value):
+    """Copy `value` with secrets masked, by key name for mappings and by pattern for text."""
+    if isinstance(value, dict):
+        return {k: REDACTED if str(k).lower() in SENSITIVE_KEYS else redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        return _SENSITIVE_TEXT.sub(lambda m: m.group(1) + REDACTED, value)
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; `extra={"fields": {...}}` is merged in, redacted and size-capped."""
+
+    def __init__(self, body_limit: int):
+        super().__init__()
+        self.body_limit = body_limit
+
+    def _cap(self, value):
+        if isinstance(value, (dict, list, tuple)):
+            text = json.dumps(value, default=str)
+        elif isinstance(value, (str, int, float, bool)) or value is None:
+            text = value
+        else:
+            text = str(value)
+        if isinstance(text, str) and len(text) > self.body_limit:
+            return f"{text[:self.body_limit]}...[{len(text) - self.body_limit} more chars]"
+        return text
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": redact(record.getMessage()),
+        }
+        route = getattr(record, "route", None)
+        if route:
+            entry["route"] = route
+        for name, value in redact(getattr(record, "fields", None) or {}).items():
+            entry[name] = self._cap(value)
+        if record.exc_info:
+            entry["exc"] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, default=str)
+
+
+class RouteSampler(logging.Filter):
+    """Stamp records with the current route and keep only a sample of sub-warning ones.
+
+    `rates` maps path prefixes to the fraction of records kept; the longest
+    matching prefix wins. Warnings and errors are always kept.
+    """
+
+    def __init__(self, rates: dict, default_rate: float):
+        super().__init__()
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+        self.default_rate = default_rate
+
+    def rate_for(self, route):
+        for prefix, rate in self.rates:
+            if route and route.startswith(prefix):
+                return rate
+        return self.default_rate
+
+    def filter(self, record):
+        record.route = route_var.get()
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.route)
+        return rate >= 1 or random.random() < rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener thread untouched; drops them if the queue is full.
+
+    The stock QueueHandler formats each record on the calling thread, which
+    is the work we want off the request path.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_rates(spec: str) -> dict:
+    """Parse `"/get-all-contacts=0.1,/get-contact=0.5"` into a prefix -> rate map."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        prefix, _, rate = item.partition("=")
+        rates[prefix.strip()] = float(rate)
+    return rates
+
+
+def configure_logging() -> QueueListener:
+    """Route the root logger through a bounded queue to a JSON stdout writer.
+
+    Returns the started listener; stop it on shutdown to flush what's queued.
+    """
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=int(getenv("LOG_QUEUE_SIZE", "10000"))))
+    handler.addFilter(RouteSampler(
+        parse_rates(getenv("LOG_SAMPLE_RATES", "")),
+        float(getenv("LOG_SAMPLE_RATE", "1.0")),
+    ))
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter(body_limit=int(getenv("LOG_BODY_LIMIT", "2048"))))
+
+    root = logging.getLogger()
+    for existing in [h for h in root.handlers if isinstance(h, NonBlockingQueueHandler)]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(getenv("LOG_LEVEL", "INFO").upper())
+
+    listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+async def log_request_context(request, call_next):
+    """HTTP middleware: remember the route so records logged while handling it can be sampled."""
+    route_var.set(request.url.path)
+    return await call_next(request)
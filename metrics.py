@@ -0,0 +1,207 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from os import getenv
+import asyncio
+import time
+
+# Time spent per phase ("upstream", "render", ...) by the request being handled, for Server-Timing.
+timings_var = ContextVar("timings", default=None)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def add_timing(phase: str, seconds: float):
+    """Charge `seconds` to `phase` of the current request, if there is one."""
+    timings = timings_var.get()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        labels = tuple(map(str, labels))
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self._values.items()):
+            yield self.name, _labels(self.labels, labels), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels, value: float):
+        self._values[tuple(map(str, labels))] = value
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, *labels, value: float):
+        labels = tuple(map(str, labels))
+        series = self._series.get(labels)
+        if series is None:
+            # Per-bucket counts (the last is +Inf), then the sum.
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                yield f"{self.name}_bucket", _labels((*self.labels, "le"), (*labels, le)), cumulative
+            yield f"{self.name}_sum", _labels(self.labels, labels), total
+            yield f"{self.name}_count", _labels(self.labels, labels), cumulative
+
+
+class Metrics:
+    """The app's metrics, rendered for Prometheus by `/metrics`.
+
+    Covers per-route request latency, per-HubSpot-operation call latency
+    (one observation per attempt, so retried 429s show up), open circuits
+    and the calls they refused, template render time, in-flight requests
+    and event-loop lag. The lag monitor sleeps for `lag_interval` seconds at
+    a time and records how late it wakes up.
+    """
+
+    def __init__(self, lag_interval: float, server_timing: bool):
+        self.lag_interval = lag_interval
+        self.server_timing = server_timing
+        self.requests = Histogram(
+            "http_request_duration_seconds", "Time to handle a request, by route template and status.",
+            ("method", "route", "status"),
+        )
+        self.in_flight = Gauge("http_requests_in_flight", "Requests being handled.")
+        self.upstream = Histogram(
+            "hubspot_request_duration_seconds", "Time per HubSpot call attempt, by backend, operation and status.",
+            ("backend", "operation", "status"),
+        )
+        self.upstream_wait = Histogram(
+            "hubspot_call_wait_seconds", "Time HubSpot calls spent waiting on rate-limit pacing and retries.",
+            ("operation",),
+        )
+        self.circuit_open = Gauge(
+            "hubspot_circuit_open", "1 while calls for a HubSpot operation are being failed fast.", ("operation",),
+        )
+        self.rejected = Counter(
+            "hubspot_calls_rejected_total", "HubSpot calls refused by an open circuit.", ("operation",),
+        )
+        self.render = Histogram(
+            "template_render_seconds", "Time to render a template.", ("template",),
+            buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+        )
+        self.loop_lag = Histogram("event_loop_lag_seconds", "How late the event loop runs a timer.",
+                                  buckets=LAG_BUCKETS)
+        self.loop_lag_last = Gauge("event_loop_lag_last_seconds", "Event-loop lag at the latest check.")
+        self._all = [self.requests, self.in_flight, self.upstream, self.upstream_wait, self.circuit_open,
+                     self.rejected, self.render, self.loop_lag, self.loop_lag_last]
+        self._task = None
+
+    @classmethod
+    def from_env(cls) -> "Metrics":
+        return cls(
+            lag_interval=float(getenv("METRICS_LOOP_LAG_INTERVAL", "0.5")),
+            server_timing=getenv("SERVER_TIMING", "false").lower() == "true",
+        )
+
+    def start(self):
+        self._task = asyncio.create_task(self._watch_loop())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _watch_loop(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, time.perf_counter() - started - self.lag_interval)
+            self.loop_lag.observe(value=lag)
+            self.loop_lag_last.set(value=lag)
+
+    def observe_upstream(self, backend: str, operation: str, status, seconds: float):
+        self.upstream.observe(backend, operation, status, value=seconds)
+        add_timing("upstream", seconds)
+
+    def observe_wait(self, operation: str, seconds: float):
+        self.upstream_wait.observe(operation, value=seconds)
+        add_timing("ratelimit", seconds)
+
+    def render_text(self) -> str:
+        lines = []
+        for metric in self._all:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def server_timing(timings: dict, total: float) -> str:
+    entries = [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in timings.items()]
+    return ", ".join([*entries, f"total;dur={total * 1000:.1f}"])
+
+
+async def track_requests(request, call_next):
+    """HTTP middleware: time each request under its route template and count it while in flight.
+
+    Streamed responses (exports, bulk reports) are timed to their first byte.
+    """
+    metrics = request.app.state.metrics
+    timings = {}
+    timings_var.set(timings)
+    metrics.in_flight.inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.in_flight.dec()
+        # Templates, not raw paths, so contact ids and typos don't each become a series.
+        route = request.scope.get("route")
+        metrics.requests.observe(request.method, route.path if route else "unmatched", status, value=elapsed)
+    if metrics.server_timing:
+        response.headers["Server-Timing"] = server_timing(timings, elapsed)
+    return response
+
@@ -0,0 +1,439 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os import getenv
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+import time
+from schema_cache import DISPLAY_PROPERTIES
+from shared_state import WORKER_ID
+
+logger = logging.getLogger(__name__)
+
+# HubSpot's search API pages up to this many results per query, then stops.
+SEARCH_WINDOW = 10000
+SEARCH_PAGE_SIZE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contacts (
+    portal TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    email TEXT COLLATE NOCASE,
+    firstname TEXT COLLATE NOCASE,
+    lastname TEXT COLLATE NOCASE,
+    phone TEXT,
+    phone_digits TEXT,
+    lastmodified INTEGER,
+    properties TEXT NOT NULL,
+    PRIMARY KEY (portal, id)
+);
+CREATE INDEX IF NOT EXISTS contacts_email ON contacts (portal, email);
+CREATE INDEX IF NOT EXISTS contacts_lastname ON contacts (portal, lastname, firstname);
+CREATE INDEX IF NOT EXISTS contacts_firstname ON contacts (portal, firstname);
+CREATE INDEX IF NOT EXISTS contacts_phone ON contacts (portal, phone_digits);
+CREATE TABLE IF NOT EXISTS sync_state (
+    portal TEXT PRIMARY KEY,
+    watermark INTEGER NOT NULL DEFAULT 0,
+    completed_at REAL
+);
+"""
+
+
+def modified_ms(value) -> int:
+    """`lastmodifieddate` as epoch milliseconds; HubSpot returns ISO-8601 strings."""
+    if not value:
+        return 0
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    text = str(value)
+    if text.isdigit():
+        return int(text)
+    return int(datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp() * 1000)
+
+
+def _phone_key(phone: str) -> str:
+    """Phone digits reversed, so a prefix match on the key finds numbers by their trailing digits."""
+    return re.sub(r"\D", "", phone)[::-1]
+
+
+def _like_prefix(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+class ContactMirror:
+    """Local SQLite copy of each portal's contacts, with a sync watermark per portal.
+
+    Only the display properties are kept. Rows come back in the HubSpot
+    record shape (`{"id": ..., "properties": {...}}`) so templates and
+    exports treat them like API results. A single worker thread owns the
+    connection, which keeps SQLite off the event loop and serialises writes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="contact-mirror")
+        self._conn = None
+        self._ready = set()
+
+    @classmethod
+    def from_env(cls) -> "ContactMirror":
+        return cls(getenv("CONTACT_MIRROR_PATH", "contacts_mirror.db"))
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _connect(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._ready = self._completed()
+
+    def _completed(self) -> set:
+        rows = self._conn.execute("SELECT portal FROM sync_state WHERE completed_at IS NOT NULL")
+        return {portal for portal, in rows}
+
+    async def open(self):
+        await self._run(self._connect)
+
+    async def reload_ready(self):
+        """Pick up portals whose first sync another process sharing the file finished."""
+        self._ready = await self._run(self._completed)
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+        self._executor.shutdown(wait=False)
+
+    def ready(self, portal: str) -> bool:
+        """True once the portal has had one complete sync, so reads can skip HubSpot."""
+        return portal in self._ready
+
+    def ready_portals(self) -> set:
+        return set(self._ready)
+
+    @staticmethod
+    def _row(portal: str, record: dict) -> tuple:
+        properties = {name: (record.get("properties") or {}).get(name) for name in DISPLAY_PROPERTIES}
+        phone = properties.get("phone")
+        return (
+            portal,
+            int(record["id"]),
+            properties.get("email"),
+            properties.get("firstname"),
+            properties.get("lastname"),
+            phone,
+            _phone_key(phone) if phone else None,
+            modified_ms(properties.get("lastmodifieddate")),
+            json.dumps(properties, default=str),
+        )
+
+    @staticmethod
+    def _record(row) -> dict:
+        contact_id, properties = row
+        return {"id": str(contact_id), "properties": json.loads(properties)}
+
+    def _upsert(self, rows):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO contacts "
+                "(portal, id, email, firstname, lastname, phone, phone_digits, lastmodified, properties) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    async def upsert(self, portal: str, records):
+        rows = [self._row(portal, record) for record in records]
+        if rows:
+            await self._run(self._upsert, rows)
+
+    def _patch(self, portal, contact_id, properties):
+        row = self._conn.execute(
+            "SELECT properties FROM contacts WHERE portal = ? AND id = ?", (portal, int(contact_id))
+        ).fetchone()
+        if row is None:
+            return False
+        merged = {**json.loads(row[0]), **{name: properties[name] for name in DISPLAY_PROPERTIES if name in properties}}
+        self._upsert([self._row(portal, {"id": contact_id, "properties": merged})])
+        return True
+
+    async def patch(self, portal: str, contact_id: str, properties: dict) -> bool:
+        """Merge changed properties into a mirrored row; False if the row isn't there."""
+        if not str(contact_id).isdigit():
+            return False
+        if not any(name in properties for name in DISPLAY_PROPERTIES):
+            return True
+        return await self._run(self._patch, portal, contact_id, properties)
+
+    def _delete(self, portal, contact_ids):
+        with self._conn:
+            self._conn.executemany(
+                "DELETE FROM contacts WHERE portal = ? AND id = ?",
+                [(portal, int(contact_id)) for contact_id in contact_ids],
+            )
+
+    async def delete(self, portal: str, contact_ids):
+        await self._run(self._delete, portal, list(contact_ids))
+
+    def _get(self, portal, contact_id):
+        row = self._conn.execute(
+            "SELECT id, properties FROM contacts WHERE portal = ? AND id = ?", (portal, int(contact_id))
+        ).fetchone()
+        return self._record(row) if row else None
+
+    async def get(self, portal: str, contact_id: str):
+        if not str(contact_id).isdigit():
+            return None
+        return await self._run(self._get, portal, contact_id)
+
+    def _search(self, portal, q, email, name, phone, after, limit):
+        clauses, params = ["portal = ?"], [portal]
+        if email:
+            clauses.append("email LIKE ? ESCAPE '\\'")
+            params.append(_like_prefix(email))
+        if name:
+            clauses.append("(firstname LIKE ? ESCAPE '\\' OR lastname LIKE ? ESCAPE '\\')")
+            params += [_like_prefix(name)] * 2
+        if phone:
+            clauses.append("phone_digits GLOB ?")
+            params.append(_phone_key(phone) + "*")
+        if q:
+            # One indexed lookup per column, unioned; a plain OR would scan the portal.
+            lookups = [f"SELECT id FROM contacts WHERE portal = ? AND {column} LIKE ? ESCAPE '\\'"
+                       for column in ("email", "firstname", "lastname")]
+            params += [portal, _like_prefix(q)] * 3
+            if _phone_key(q) and re.fullmatch(r"[\d\s+().-]+", q):
+                lookups.append("SELECT id FROM contacts WHERE portal = ? AND phone_digits GLOB ?")
+                params += [portal, _phone_key(q) + "*"]
+            clauses.append(f"id IN ({' UNION '.join(lookups)})")
+        if after:
+            clauses.append("id > ?")
+            params.append(int(after))
+        rows = self._conn.execute(
+            f"SELECT id, properties FROM contacts WHERE {' AND '.join(clauses)} ORDER BY id LIMIT ?",
+            (*params, limit + 1),
+        ).fetchall()
+        records = [self._record(row) for row in rows[:limit]]
+        next_after = records[-1]["id"] if len(rows) > limit else None
+        return records, next_after
+
+    async def search(self, portal: str, q: str = None, email: str = None, name: str = None,
+                     phone: str = None, after: str = None, limit: int = SEARCH_PAGE_SIZE) -> tuple:
+        """Prefix-match contacts on the indexed columns; returns `(records, next_after)`.
+
+        `q` matches email, first or last name, or the trailing digits of the
+        phone number (so country codes and formatting don't matter). Results
+        are in id order and `next_after` is the cursor for the next page.
+        """
+        return await self._run(self._search, portal, q, email, name, phone, after, limit)
+
+    async def page(self, portal: str, after: str = None, limit: int = SEARCH_PAGE_SIZE) -> tuple:
+        """One page of every contact in id order, as `(records, next_after)` like the search results."""
+        return await self.search(portal, after=after, limit=limit)
+
+    def _watermark(self, portal):
+        row = self._conn.execute("SELECT watermark FROM sync_state WHERE portal = ?", (portal,)).fetchone()
+        return row[0] if row else 0
+
+    async def watermark(self, portal: str) -> int:
+        return await self._run(self._watermark, portal)
+
+    def _save_watermark(self, portal, watermark, completed):
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO sync_state (portal, watermark, completed_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (portal) DO UPDATE SET watermark = excluded.watermark, "
+                "completed_at = COALESCE(excluded.completed_at, sync_state.completed_at)",
+                (portal, watermark, time.time() if completed else None),
+            )
+
+    def _synced_at(self, portal):
+        row = self._conn.execute("SELECT completed_at FROM sync_state WHERE portal = ?", (portal,)).fetchone()
+        return row[0] if row else None
+
+    async def synced_at(self, portal: str):
+        """When the portal's last complete sync finished (epoch seconds), or None if it never has."""
+        return await self._run(self._synced_at, portal)
+
+    async def save_watermark(self, portal: str, watermark: int, completed: bool = False):
+        await self._run(self._save_watermark, portal, watermark, completed)
+        if completed:
+            self._ready.add(portal)
+
+
+def sync_request(since: int, after: str = None) -> dict:
+    """Search API body for contacts modified at or after `since` (epoch ms), oldest first."""
+    body = {
+        "filterGroups": [{"filters": [
+            {"propertyName": "lastmodifieddate", "operator": "GTE", "value": str(since)},
+        ]}],
+        "sorts": [{"propertyName": "lastmodifieddate", "direction": "ASCENDING"}],
+        "properties": DISPLAY_PROPERTIES,
+        "limit": SEARCH_PAGE_SIZE,
+    }
+    if after:
+        body["after"] = after
+    return body
+
+
+def instant_request(modified: int, after_id: int = 0, after: str = None) -> dict:
+    """Search API body for contacts modified exactly at `modified` (epoch ms) with ids past `after_id`, by id."""
+    body = {
+        "filterGroups": [{"filters": [
+            {"propertyName": "lastmodifieddate", "operator": "EQ", "value": str(modified)},
+            {"propertyName": "hs_object_id", "operator": "GT", "value": str(after_id)},
+        ]}],
+        "sorts": [{"propertyName": "hs_object_id", "direction": "ASCENDING"}],
+        "properties": DISPLAY_PROPERTIES,
+        "limit": SEARCH_PAGE_SIZE,
+    }
+    if after:
+        body["after"] = after
+    return body
+
+
+class MirrorSync:
+    """Keeps a `ContactMirror` current by pulling changed contacts in the background.
+
+    `search` is an async callable `(portal, access_token, body)` that posts a
+    contact search and returns `(results, next_after)`. Portals are synced
+    once something calls `track` with a token for them; the latest token
+    seen for a portal is the one the sync uses. Once webhooks are pushing
+    changes for a portal (`mark_pushed`), polling drops to `push_interval`
+    and only serves to reconcile anything a delivery missed.
+
+    Each pass asks for contacts modified since the stored watermark, oldest
+    first, and advances the watermark page by page. The search API stops
+    after 10,000 results, so a pass that reaches that restarts the query
+    from the newest timestamp it has seen; a window that never gets past one
+    timestamp has that instant paged through by contact id instead.
+    Deletions don't show up in a modified-since query; they reach the
+    mirror through the app's own writes and webhooks. So the gateway never
+    reads single contacts from it, and lists only for portals webhooks
+    push to (`pushed`). An `interval` of 0 turns polling off; the mirror
+    then only gets what the app writes and what webhooks push.
+
+    Worker processes sharing the mirror file take turns through `state`
+    (see `shared_state`): a pass is skipped if another worker started one
+    for the portal within the interval.
+    """
+
+    def __init__(self, mirror: ContactMirror, search, interval: float, push_interval: float, state=None):
+        self.mirror = mirror
+        self._state = state
+        self._search = search
+        self.interval = interval
+        self.push_interval = push_interval
+        self._tokens = {}
+        self._pushed = set()
+        self._tasks = {}
+        self.passes = 0
+        self.skipped = 0
+        self.failures = 0
+        self.synced = 0
+        self.last_synced = {}
+
+    @classmethod
+    def from_env(cls, mirror: ContactMirror, search, state=None) -> "MirrorSync":
+        return cls(
+            mirror,
+            search,
+            interval=float(getenv("CONTACT_MIRROR_INTERVAL", "60")),
+            push_interval=float(getenv("CONTACT_MIRROR_PUSH_INTERVAL", "3600")),
+            state=state,
+        )
+
+    def track(self, portal: str, access_token: str):
+        self._tokens[portal] = access_token
+        if self.interval > 0 and portal not in self._tasks:
+            self._tasks[portal] = asyncio.create_task(self._sync_loop(portal))
+
+    def token_for(self, portal: str):
+        return self._tokens.get(portal)
+
+    def mark_pushed(self, portal: str):
+        self._pushed.add(portal)
+
+    def pushed(self, portal: str) -> bool:
+        """Whether webhooks have delivered changes for `portal`, so the mirror hears of its deletions."""
+        return portal in self._pushed
+
+    async def close(self):
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _sync_loop(self, portal: str):
+        while True:
+            interval = self.push_interval if portal in self._pushed else self.interval
+            try:
+                if self._state is None or await self._state.add(f"mirror-sync:{portal}", WORKER_ID, interval * 0.9):
+                    await self.sync(portal)
+                else:
+                    self.skipped += 1
+                    await self.mirror.reload_ready()
+            except Exception as e:
+                self.failures += 1
+                logger.warning("Contact mirror sync failed", extra={"fields": {"portal": portal, "error": str(e)}})
+            await asyncio.sleep(interval)
+
+    async def sync(self, portal: str):
+        """Pull everything modified since the portal's watermark into the mirror."""
+        since = await self.mirror.watermark(portal)
+        while True:
+            newest, after, fetched = since, None, 0
+            while True:
+                results, after = await self._search(portal, self._tokens[portal], sync_request(since, after))
+                await self.mirror.upsert(portal, results)
+                fetched += len(results)
+                self.synced += len(results)
+                for record in results:
+                    newest = max(newest, modified_ms((record.get("properties") or {}).get("lastmodifieddate")))
+                # Everything older than `newest` is in; ties are re-read on the next query.
+                await self.mirror.save_watermark(portal, newest)
+                if not after or fetched + SEARCH_PAGE_SIZE > SEARCH_WINDOW:
+                    break
+            if after and newest == since:
+                # A whole window shares one timestamp: page through that instant by id, then step past it.
+                logger.info("Contact mirror window stalled", extra={"fields": {"portal": portal, "since": since}})
+                await self._sync_instant(portal, since)
+                newest += 1
+                await self.mirror.save_watermark(portal, newest)
+            since = newest
+            if not after:
+                break
+        await self.mirror.save_watermark(portal, since, completed=True)
+        self.passes += 1
+        self.last_synced[portal] = time.time()
+
+    async def _sync_instant(self, portal: str, modified: int):
+        """Pull every contact modified at exactly `modified`, using the contact id as the cursor."""
+        since_id = 0
+        while True:
+            newest_id, after, fetched = since_id, None, 0
+            while True:
+                results, after = await self._search(portal, self._tokens[portal],
+                                                    instant_request(modified, since_id, after))
+                await self.mirror.upsert(portal, results)
+                fetched += len(results)
+                self.synced += len(results)
+                newest_id = max([newest_id, *(int(record["id"]) for record in results)])
+                if not after or fetched + SEARCH_PAGE_SIZE > SEARCH_WINDOW:
+                    break
+            if not after:
+                return
+            since_id = newest_id
+
+    def stats(self) -> dict:
+        return {
+            "portals": len(self._tasks),
+            "pushed": sorted(self._pushed),
+            "ready": sorted(self.mirror.ready_portals()),
+            "passes": self.passes,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "synced_records": self.synced,
+            "last_synced": self.last_synced,
+        }
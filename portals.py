@@ -0,0 +1,126 @@
+from dataclasses import asdict, dataclass, replace
+from os import getenv
+import asyncio
+import time
+from cache import TTLCache
+
+
+class PortalResolver:
+    """Maps access tokens to the HubSpot portal (hub id) they belong to.
+
+    `lookup` is an async callable taking a token and returning its hub id.
+    Results are cached for the token's lifetime and concurrent lookups for
+    the same token share one upstream call. A token HubSpot turns down
+    (any 4xx but 429) is remembered for `failure_ttl` seconds and refused
+    again without asking, so a client retrying a bad token can't spend the
+    app-wide budget that OAuth exchanges and refreshes share.
+    """
+
+    def __init__(self, lookup, maxsize: int = 1024, ttl: float = 1800, failure_ttl: float = 30):
+        self._lookup = lookup
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._failures = TTLCache(maxsize=maxsize, ttl=failure_ttl)
+        self._pending = {}
+
+    async def resolve(self, access_token: str) -> str:
+        hub_id = self._cache.get(access_token)
+        if hub_id is not None:
+            return hub_id
+        failure = self._failures.get(access_token)
+        if failure is not None:
+            raise failure.with_traceback(None)
+        pending = self._pending.get(access_token)
+        if pending is None:
+            pending = asyncio.ensure_future(self._lookup(access_token))
+            self._pending[access_token] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(access_token, None))
+        try:
+            hub_id = str(await asyncio.shield(pending))
+        except Exception as e:
+            status = getattr(e, "status", None)
+            if status is not None and 400 <= status < 500 and status != 429:
+                self._failures.set(access_token, e)
+            raise
+        self._cache.set(access_token, hub_id)
+        return hub_id
+
+    def stats(self) -> dict:
+        return {**self._cache.stats(), "failures_cached": len(self._failures)}
+
+
+@dataclass(frozen=True)
+class Limits:
+    """What one portal may use: `rate` calls per `per` seconds, `concurrency` in flight, and its fair-share `weight`."""
+    rate: int
+    per: float
+    concurrency: int
+    weight: float = 1.0
+
+
+def parse_portal_limits(spec: str) -> dict:
+    """Parse `"123:rate=200:concurrency=20,456:weight=0.5"` into a hub id -> overrides map."""
+    overrides = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        hub_id, *settings = item.split(":")
+        values = {}
+        for setting in settings:
+            name, _, value = setting.partition("=")
+            if name not in ("rate", "per", "concurrency", "weight"):
+                raise ValueError(f"Unknown portal limit {name!r} in {item!r}")
+            values[name] = float(value) if name in ("per", "weight") else int(value)
+        overrides[hub_id.strip()] = values
+    return overrides
+
+
+class PortalLimits:
+    """Default `Limits` for every portal, with per-hub-id overrides."""
+
+    def __init__(self, defaults: Limits, overrides: dict = None):
+        self.defaults = defaults
+        self._limits = {portal: replace(defaults, **values) for portal, values in (overrides or {}).items()}
+
+    @classmethod
+    def from_env(cls) -> "PortalLimits":
+        return cls(
+            Limits(
+                # HubSpot's per-app, per-portal burst limit is 100 requests per 10 seconds.
+                rate=int(getenv("HUBSPOT_RATE_LIMIT", "100")),
+                per=float(getenv("HUBSPOT_RATE_WINDOW", "10")),
+                concurrency=int(getenv("HUBSPOT_PORTAL_CONCURRENCY", "10")),
+                weight=float(getenv("HUBSPOT_PORTAL_WEIGHT", "1")),
+            ),
+            parse_portal_limits(getenv("HUBSPOT_PORTAL_LIMITS", "")),
+        )
+
+    def for_portal(self, portal: str) -> Limits:
+        return self._limits.get(portal, self.defaults)
+
+
+class PortalRegistry:
+    """The portals the app works for, keyed by hub id.
+
+    Tokens are resolved to their hub id once and cached (see
+    `PortalResolver`); each portal's `Limits` come from `limits`.
+    """
+
+    def __init__(self, lookup, limits: PortalLimits):
+        self.resolver = PortalResolver(lookup)
+        self.limits = limits
+        self._seen = {}
+
+    async def resolve(self, access_token: str) -> str:
+        portal = await self.resolver.resolve(access_token)
+        self._seen[portal] = time.time()
+        return portal
+
+    def limits_for(self, portal: str) -> Limits:
+        return self.limits.for_portal(portal)
+
+    def stats(self) -> dict:
+        return {
+            "tokens": self.resolver.stats(),
+            "portals": {
+                portal: {**asdict(self.limits_for(portal)), "last_seen": last_seen}
+                for portal, last_seen in self._seen.items()
+            },
+        }
@@ -0,0 +1,476 @@
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, Request, Form, File, UploadFile
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from functools import partial
+from os import getenv
+from urllib.parse import urlencode
+from export import PAGE_SIZE, iter_contacts, ndjson_lines, csv_lines
+from schema_cache import DISPLAY_PROPERTIES, requested_properties
+from bulk import spool_upload, read_rows, run_bulk, ndjson_report
+from scheduler import Priority
+from gateway import CircuitOpenError, HubSpotGateway, HubSpotError
+from tokens import SESSION_COOKIE, TokenManager, clear_dropped_session
+from jobs import JobRunner, describe
+from shared_state import shared_state_from_env
+from webhooks import WebhookProcessor, signature_valid
+from logging_config import configure_logging, log_request_context
+from metrics import Metrics, track_requests
+from templating import AppTemplates
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+templates = AppTemplates(directory="templates")
+
+
+def create_app(backend_factory) -> FastAPI:
+    """Build the integration app on top of whichever transport `backend_factory` returns.
+
+    The factory runs inside the lifespan, after `.env` has been loaded.
+    """
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # JSON log lines are written from a background thread, never on the request path.
+        listener = configure_logging()
+        # Compile every template now rather than on its first request.
+        templates.precompile()
+        app.state.metrics = Metrics.from_env()
+        app.state.metrics.start()
+        # What worker processes share (rate budgets, sessions, caches); per process unless SHARED_STATE says otherwise.
+        app.state.shared = shared_state_from_env()
+        await app.state.shared.start()
+        # Every HubSpot call, for either backend, goes through the gateway.
+        app.state.gateway = HubSpotGateway.from_env(backend_factory(), app.state.metrics, app.state.shared)
+        await app.state.gateway.start()
+        app.state.tokens = TokenManager.from_env(app.state.gateway.exchange_token, app.state.shared)
+        app.state.tokens.start()
+        # Webhook events keep the cache and mirror current without polling.
+        app.state.webhooks = WebhookProcessor.from_env(app.state.gateway.apply_events)
+        app.state.webhooks.start()
+        # Large imports run here instead of inside the request.
+        app.state.jobs = JobRunner.from_env(app.state.gateway.batch_contacts, partial(job_token, app), app.state.shared)
+        await app.state.jobs.start()
+        try:
+            yield
+        finally:
+            await app.state.jobs.close()
+            await app.state.webhooks.close()
+            await app.state.tokens.close()
+            await app.state.gateway.close()
+            await app.state.shared.close()
+            await app.state.metrics.close()
+            listener.stop()
+
+    app = FastAPI(lifespan=lifespan)
+    app.middleware("http")(log_request_context)
+    app.middleware("http")(track_requests)
+    app.middleware("http")(clear_dropped_session)
+    app.include_router(router)
+    return app
+
+
+async def job_token(app, portal, session_id):
+    # The submitter's session while it lasts, else the latest token seen for the portal.
+    try:
+        token = await app.state.tokens.access_token(session_id)
+    except Exception:
+        token = None
+    return token or app.state.gateway.sync.token_for(portal)
+
+def error_response(request, e, format="html"):
+    if format == "json":
+        if isinstance(e, HubSpotError):
+            status = e.status
+        else:
+            status = 400 if isinstance(e, ValueError) else 502
+        headers = e.headers if isinstance(e, CircuitOpenError) else None
+        return JSONResponse({"error": str(e)}, status_code=status, headers=headers)
+    return templates.TemplateResponse(
+        "error.html", {"request": request, "error": str(e)}
+    )
+
+def staleness(contacts) -> dict:
+    # Set when HubSpot was unavailable and older local copies were served instead.
+    stale = next((contact for contact in contacts if contact.stale), None)
+    return {"stale": True, "as_of": stale.as_of} if stale else {}
+
+def render_contact(request, contact, properties, format="html"):
+    if format == "json":
+        return JSONResponse({**contact.project(properties), **staleness([contact])})
+    return templates.TemplateResponse(
+        "contact_detail.html",
+        {"request": request, "contact": contact.project(properties),
+         "extra_properties": [name for name in properties if name not in DISPLAY_PROPERTIES],
+         **staleness([contact])}
+    )
+
+def form_properties(form_data) -> dict:
+    return {
+        "firstname": form_data.get("first_name"),
+        "lastname": form_data.get("last_name"),
+        "email": form_data.get("email"),
+        "phone": form_data.get("phone"),
+    }
+
+@router.get("/", response_class=HTMLResponse)
+async def home(request: Request):
+    return templates.TemplateResponse("index.html", {"request": request})
+
+@router.get("/integrate")
+def get_hubspot_oauth_url(request: Request):
+    params = {
+        "client_id": getenv('CLIENT_ID'),
+        "redirect_uri": getenv('REDIRECT_URI'),
+        "scope": "oauth crm.objects.contacts.read crm.objects.contacts.write crm.schemas.contacts.read crm.schemas.contacts.write",
+        "response_type": "code"
+    }
+    oauth_url = f"https://app.hubspot.com/oauth/authorize?{urlencode(params)}"
+    return templates.TemplateResponse(
+        "open_in_new_tab.html", {"request": request, "oauth_url": oauth_url}
+    )
+
+@router.get("/hubspot/oauth/callback")
+async def auth_callback(request: Request, code: str):
+    try:
+        logger.info("OAuth callback received")
+        session_id, tokens = await request.app.state.tokens.authorize(code)
+
+        template_response = templates.TemplateResponse(
+            "success.html",
+            {"request": request, "tokens": tokens}
+        )
+        # Tokens stay server-side and are refreshed in the background; the browser keeps a session id.
+        request.app.state.tokens.set_cookies(template_response, session_id)
+        return template_response
+    except Exception as e:
+        logger.warning("Error during token exchange", extra={"fields": {"error": str(e)}})
+        return templates.TemplateResponse(
+            "error.html",
+            {"request": request, "error": str(e)}
+        )
+
+@router.post("/refresh-token")
+async def refresh_hubspot_token(request: Request, refresh_token: str = Form(...)):
+    try:
+        logger.info("Refresh token submitted")
+        session_id, tokens = await request.app.state.tokens.adopt(refresh_token)
+
+        template_response = templates.TemplateResponse(
+            "success.html",
+            {"request": request, "tokens": tokens}
+        )
+        request.app.state.tokens.set_cookies(template_response, session_id)
+        return template_response
+    except Exception as e:
+        logger.warning("Error during token exchange", extra={"fields": {"error": str(e)}})
+        return templates.TemplateResponse(
+            "error.html",
+            {"request": request, "error": str(e)}
+        )
+
+@router.get("/stats")
+def get_stats(request: Request):
+    return {
+        **request.app.state.gateway.stats(),
+        "tokens": request.app.state.tokens.stats(),
+        "webhooks": request.app.state.webhooks.stats(),
+        "jobs": request.app.state.jobs.stats(),
+        "shared_state": request.app.state.shared.stats(),
+    }
+
+@router.get("/metrics")
+async def get_metrics(request: Request):
+    return PlainTextResponse(request.app.state.metrics.render_text(), media_type="text/plain; version=0.0.4")
+
+@router.post("/schema/invalidate")
+async def invalidate_schema(request: Request):
+    try:
+        access_key = await request.app.state.tokens.access_token_for(request)
+        portal = await request.app.state.gateway.portal(access_key)
+        await request.app.state.gateway.schemas.invalidate(portal)
+    except Exception as e:
+        logger.warning("Error during schema invalidation", extra={"fields": {"error": str(e)}})
+        return error_response(request, e, "json")
+    return {"invalidated": portal}
+
+@router.post("/hubspot/webhooks")
+async def receive_webhooks(request: Request):
+    body = await request.body()
+    if not signature_valid(request, body):
+        logger.warning("Webhook signature rejected")
+        return JSONResponse({"error": "invalid signature"}, status_code=401)
+    try:
+        events = json.loads(body)
+    except ValueError:
+        events = None
+    if not isinstance(events, list):
+        return JSONResponse({"error": "expected a JSON array of events"}, status_code=400)
+    # Acknowledge straight away; the events are applied by the webhook workers.
+    try:
+        accepted = request.app.state.webhooks.submit(events)
+    except asyncio.QueueFull:
+        return JSONResponse({"error": "webhook queue is full"}, status_code=503)
+    return {"accepted": accepted}
+
+@router.get("/contacts", response_class=HTMLResponse)
+def return_contacts(request: Request):
+    return templates.TemplateResponse("contacts.html", {"request": request})
+
+@router.get("/get-all-contacts", response_class=HTMLResponse)
+async def get_contacts(request: Request, format: str = "html", after: str = None, properties: str = None,
+                       all: bool = False):
+    try:
+        access_key = await request.app.state.tokens.access_token_for(request)
+        # The HTML table has fixed columns; the data formats carry exactly what was asked for.
+        properties = requested_properties(properties if format != "html" else None)
+
+        gateway = request.app.state.gateway
+        portal = await gateway.portal(access_key)
+        fetch_page = gateway.pager(access_key, portal, properties)
+
+        # Full exports walk every page and stream as they go, behind interactive traffic.
+        if format in ("ndjson", "csv"):
+            contacts = (
+                contact.project(properties)
+                async for contact in iter_contacts(gateway.pager(access_key, portal, properties, Priority.BULK))
+            )
+            if format == "ndjson":
+                return StreamingResponse(ndjson_lines(contacts), media_type="application/x-ndjson")
+            return StreamingResponse(
+                csv_lines(contacts, properties),
+                media_type="text/csv",
+                headers={"Content-Disposition": "attachment; filename=contacts.csv"}
+            )
+
+        # The whole table, rendered while later pages are still being fetched.
+        if format == "html" and all:
+            contacts = (
+                contact.project(properties)
+                async for contact in iter_contacts(gateway.pager(access_key, portal, properties, Priority.BULK))
+            )
+            return templates.StreamingTemplateResponse(
+                "all_contacts.html", {"request": request, "contacts": contacts, "showing_all": True}
+            )
+
+        page = await fetch_page(after)
+        logger.debug("Contacts page fetched", extra={"fields": {"count": len(page.results), "after": after}})
+        contacts = [contact.project(properties) for contact in page.results]
+        if format == "json":
+            return JSONResponse({
+                "results": contacts,
+                "paging": {"next": {"after": page.next_after}} if page.next_after else {},
+                **staleness(page.results),
+            })
+
+        return templates.TemplateResponse(
+            "all_contacts.html",
+            {"request": request, "contacts": contacts, "next_after": page.next_after, **staleness(page.results)}
+        )
+    except Exception as e:
+        logger.warning("Error during contacts retrieval", extra={"fields": {"error": str(e)}})
+        return error_response(request, e, format)
+
+@router.get("/contacts/search", response_class=HTMLResponse)
+async def search_mirror(request: Request, q: str = None, email: str = None, name: str = None, phone: str = None,
+                        after: str = None, limit: int = PAGE_SIZE, format: str = "html"):
+    try:
+        access_key = await request.app.state.tokens.access_token_for(request)
+        gateway = request.app.state.gateway
+        portal = await gateway.portal(access_key)
+
+        # Runs entirely against the mirror; results may lag HubSpot by one sync interval.
+        page = await gateway.search(
+            portal, q=q, email=email, name=name, phone=phone, after=after, limit=max(1, min(limit, 500))
+        )
+        contacts = [contact.project(DISPLAY_PROPERTIES) for contact in page.results]
+        synced = gateway.mirror.ready(portal)
+        if format == "json":
+            return JSONResponse({
+                "results": contacts,
+                "paging": {"next": {"after": page.next_after}} if page.next_after else {},
+                "synced": synced,
+            })
+
+        query = {key: value for key, value in {"q": q, "email": email, "name": name, "phone": phone}.items() if value}
+        next_url = f"/contacts/search?{urlencode({**query, 'after': page.next_after})}" if page.next_after else None
+        return templates.TemplateResponse(
+            "all_contacts.html",
+            {"request": request, "contacts": contacts, "next_after": page.next_after, "next_url": next_url,
+             "query": q, "syncing": not synced}
+        )
+    except Exception as e:
+        logger.warning("Error during contact search", extra={"fields": {"error": str(e)}})
+        return error_response(request, e, format)
+
+@router.post("/get-contact", response_class=HTMLResponse)
+async def get_contact_by_id(request: Request, access_key: str = Form(None), contact_id: str = Form(...),
+                            properties: str = Form(None), format: str = Form("html")):
+    try:
+        access_key = access_key or await request.app.state.tokens.access_token_for(request)
+        logger.debug("Contact requested", extra={"fields": {"contact_id": contact_id}})
+        # The page always renders the display fields; JSON returns only what was asked for.
+        properties = requested_properties(properties, always=DISPLAY_PROPERTIES if format != "json" else ())
+
+        gateway = request.app.state.gateway
+        portal = await gateway.portal(access_key)
+        contact = await gateway.get_contact(access_key, portal, contact_id, properties)
+
+        return render_contact(request, contact, properties, format)
+    except Exception as e:
+        logger.warning("Error during contact retrieval", extra={"fields": {"error": str(e)}})
+        return error_response(request, e, format)
+
+@router.get("/get-contact/{contact_id}", response_class=HTMLResponse)
+async def get_contact_by_id(request: Request, contact_id: str, properties: str = None, format: str = "html"):
+    try:
+        access_key = await request.app.state.tokens.access_token_for(request)
+        logger.debug("Contact requested", extra={"fields": {"contact_id": contact_id}})
+        properties = requested_properties(properties, always=DISPLAY_PROPERTIES if format != "json" else ())
+
+        gateway = request.app.state.gateway
+        portal = await gateway.portal(access_key)
+        contact = await gateway.get_contact(access_key, portal, contact_id, properties)
+
+        return render_contact(request, contact, properties, format)
+    except Exception as e:
+        logger.warning("Error during contact retrieval", extra={"fields": {"error": str(e)}})
+        return error_response(request, e, format)
+
+@router.post("/create-contact", response_class=HTMLResponse)
+async def create_contact(request: Request):
+    try:
+        form_data = await request.form()
+        access_key = form_data.get("access_key") or await request.app.state.tokens.access_token_for(request)
+        properties = form_properties(form_data)
+        # Upsert: update whichever contact already has this email instead of failing with a 409.
+        upsert = form_data.get("upsert") in ("on", "true", "1")
+
+        logger.debug("Create contact", extra={"fields": {"properties": properties, "upsert": upsert}})
+
+        gateway = request.app.state.gateway
+        portal = await gateway.portal(access_key)
+        if upsert:
+            contact = await gateway.upsert_contact(access_key, portal, properties)
+        else:
+            contact = await gateway.create_contact(access_key, portal, properties)
+
+        return render_contact(request, contact, DISPLAY_PROPERTIES)
+    except Exception as e:
+        logger.warning("Error during contact creation", extra={"fields": {"error": str(e)}})
+        return templates.TemplateResponse(
+            "error.html", {"request": request, "error": str(e)}
+        )
+
+@router.post("/update-contact", response_class=HTMLResponse)
+async def update_contact(request: Request):
+    try:
+        form_data = await request.form()
+        access_key = await request.app.state.tokens.access_token_for(request)
+        contact_id = form_data.get("contact_id")
+        properties = form_properties(form_data)
+
+        logger.debug("Update contact", extra={"fields": {"contact_id": contact_id, "properties": properties}})
+
+        gateway = request.app.state.gateway
+        portal = await gateway.portal(access_key)
+        contact = await gateway.update_contact(access_key, portal, contact_id, properties)
+
+        return render_contact(request, contact, DISPLAY_PROPERTIES)
+    except Exception as e:
+        logger.warning("Error during contact update", extra={"fields": {"error": str(e)}})
+        return templates.TemplateResponse(
+            "error.html", {"request": request, "error": str(e)}
+        )
+
+@router.post("/contacts/bulk")
+async def bulk_upsert_contacts(request: Request, file: UploadFile = File(...), upsert: bool = Form(False)):
+    logger.info("Bulk upload received", extra={"fields": {"filename": file.filename, "upsert": upsert}})
+    gateway = request.app.state.gateway
+    # Resolved and checked before the stream starts, so a bad token or upload gets an error status
+    # instead of a broken stream.
+    try:
+        access_key = await request.app.state.tokens.access_token_for(request)
+        portal = await gateway.portal(access_key)
+        rows = read_rows(await spool_upload(file), file.filename or "")
+    except Exception as e:
+        logger.warning("Error during bulk upload", extra={"fields": {"error": str(e)}})
+        return error_response(request, e, "json")
+    send_batch = partial(gateway.batch_contacts, access_key, portal)
+    concurrency = int(getenv("HUBSPOT_BULK_CONCURRENCY", "4"))
+
+    return StreamingResponse(
+        ndjson_report(run_bulk(rows, send_batch, concurrency, upsert)), media_type="application/x-ndjson"
+    )
+
+@router.post("/jobs/contacts")
+async def submit_import_job(request: Request, file: UploadFile = File(...), upsert: bool = Form(False)):
+    try:
+        access_key = await request.app.state.tokens.access_token_for(request)
+        portal = await request.app.state.gateway.portal(access_key)
+        job = await request.app.state.jobs.submit(portal, file, request.cookies.get(SESSION_COOKIE), upsert)
+    except Exception as e:
+        logger.warning("Error during import job submission", extra={"fields": {"error": str(e)}})
+        return error_response(request, e, "json")
+    logger.info("Import job queued", extra={"fields": {"job": job["id"], "filename": file.filename}})
+    return JSONResponse({**describe(job), "status_url": f"/jobs/{job['id']}"}, status_code=202)
+
+async def portal_job(request, job_id):
+    # Jobs are only visible to the portal that submitted them.
+    access_key = await request.app.state.tokens.access_token_for(request)
+    portal = await request.app.state.gateway.portal(access_key)
+    job = await request.app.state.jobs.store.get(job_id)
+    return job if job is not None and job["portal"] == portal else None
+
+@router.get("/jobs")
+async def list_import_jobs(request: Request, limit: int = 50):
+    try:
+        access_key = await request.app.state.tokens.access_token_for(request)
+        portal = await request.app.state.gateway.portal(access_key)
+        jobs = await request.app.state.jobs.store.list(portal, max(1, min(limit, 500)))
+    except Exception as e:
+        logger.warning("Error during import job listing", extra={"fields": {"error": str(e)}})
+        return error_response(request, e, "json")
+    return {"results": [describe(job) for job in jobs]}
+
+@router.get("/jobs/{job_id}")
+async def get_import_job(request: Request, job_id: str):
+    try:
+        job = await portal_job(request, job_id)
+    except Exception as e:
+        logger.warning("Error during import job lookup", extra={"fields": {"error": str(e)}})
+        return error_response(request, e, "json")
+    if job is None:
+        return JSONResponse({"error": "job not found"}, status_code=404)
+    return describe(job)
+
+@router.get("/jobs/{job_id}/errors")
+async def get_import_job_errors(request: Request, job_id: str, after: int = 0, limit: int = 100):
+    limit = max(1, min(limit, 1000))
+    try:
+        job = await portal_job(request, job_id)
+        if job is None:
+            return JSONResponse({"error": "job not found"}, status_code=404)
+        errors = await request.app.state.jobs.store.errors(job_id, after, limit)
+    except Exception as e:
+        logger.warning("Error during import job errors lookup", extra={"fields": {"error": str(e)}})
+        return error_response(request, e, "json")
+    next_after = errors[-1]["row"] if len(errors) == limit else None
+    return {"results": errors, "paging": {"next": {"after": next_after}} if next_after else {}}
+
+@router.post("/jobs/{job_id}/resume")
+async def resume_import_job(request: Request, job_id: str):
+    try:
+        job = await portal_job(request, job_id)
+        if job is None:
+            return JSONResponse({"error": "job not found"}, status_code=404)
+        if not await request.app.state.jobs.resume(job_id):
+            return JSONResponse({"error": f"only failed jobs can be resumed; this one is {job['status']}"},
+                                status_code=409)
+        return describe(await request.app.state.jobs.store.get(job_id))
+    except Exception as e:
+        logger.warning("Error during import job resume", extra={"fields": {"error": str(e)}})
+        return error_response(request, e, "json")
@@ -0,0 +1,358 @@
+from enum import IntEnum
+from os import getenv
+import asyncio
+import heapq
+import itertools
+import random
+import time
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BULK = 1
+
+
+# Bucket used for calls not tied to a portal (OAuth token exchange and lookups).
+APP_BUCKET = "_app"
+
+
+class TokenBucket:
+    """Per-portal request budget that hands out permits in priority order.
+
+    Tokens refill continuously at `rate` per `per` seconds. Callers that
+    can't take a token straight away queue up; a single drain task releases
+    them lowest priority value first, FIFO within a priority.
+    """
+
+    def __init__(self, rate: int, per: float):
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.fill_rate = rate / per
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._drainer = None
+
+    def _try_take(self) -> bool:
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.fill_rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self, priority: Priority):
+        if not self._waiters and self._try_take():
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), waiter))
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.create_task(self._drain())
+        await waiter
+
+    async def _drain(self):
+        while self._waiters:
+            waiter = self._waiters[0][2]
+            if waiter.done():
+                heapq.heappop(self._waiters)
+            elif self._try_take():
+                heapq.heappop(self._waiters)
+                waiter.set_result(None)
+            else:
+                now = time.monotonic()
+                await asyncio.sleep(max(self.paused_until - now, (1 - self.tokens) / self.fill_rate))
+
+    def pause(self, seconds: float):
+        """Hold every caller back for `seconds`, e.g. after a 429."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        self.updated = self.paused_until
+
+    def depth(self) -> int:
+        return len(self._waiters)
+
+    def close(self):
+        if self._drainer is not None:
+            self._drainer.cancel()
+
+
+class SharedTokenBucket(TokenBucket):
+    """A `TokenBucket` whose tokens live in shared state, so worker processes draw on one budget.
+
+    Callers still queue locally in priority order; the drain task takes
+    each permit from `state` under `key` (see `shared_state`), so N
+    workers together stay within `rate` per `per` seconds.
+    """
+
+    def __init__(self, state, key: str, rate: int, per: float):
+        super().__init__(rate, per)
+        self._state = state
+        self.key = key
+        self.per = per
+        self._pausing = set()
+
+    async def acquire(self, priority: Priority):
+        if not self._waiters and not await self._state.take(self.key, self.capacity, self.per):
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), waiter))
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.create_task(self._drain())
+        await waiter
+
+    async def _drain(self):
+        while self._waiters:
+            if self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+                continue
+            wait = await self._state.take(self.key, self.capacity, self.per)
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            # Whoever is first now gets the permit, even if the caller it was drawn for has given up.
+            while self._waiters:
+                _, _, waiter = heapq.heappop(self._waiters)
+                if not waiter.done():
+                    waiter.set_result(None)
+                    break
+
+    def pause(self, seconds: float):
+        """Hold every worker's callers back for `seconds`, e.g. after a 429."""
+        task = asyncio.create_task(self._state.pause(self.key, seconds))
+        self._pausing.add(task)
+        task.add_done_callback(self._pausing.discard)
+
+    def close(self):
+        super().close()
+        for task in self._pausing:
+            task.cancel()
+
+
+class _Lane:
+    """One portal's place in `FairShare`."""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.in_flight = 0
+        self.waiters = []
+        self.finish = 0.0
+
+
+class FairShare:
+    """Upstream call slots shared across portals by weighted fair queueing.
+
+    At most `capacity` calls run at once overall, and no portal runs more
+    than its own `Limits.concurrency`. While calls are waiting, each freed
+    slot goes to the waiting portal with the lowest virtual finish time;
+    every call a portal is granted moves its finish time on by `1/weight`.
+    Busy portals therefore share slots in proportion to their weights
+    however many calls each has queued, so one tenant's backlog can't
+    starve the rest. A portal that was idle rejoins at the current virtual
+    time instead of spending credit saved up while it was quiet. Within a
+    portal, interactive calls go ahead of bulk ones.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_flight = 0
+        self.granted = 0
+        self.queued = 0
+        self._lanes = {}
+        self._vtime = 0.0
+        self._seq = itertools.count()
+
+    def _lane(self, portal: str, limits) -> _Lane:
+        lane = self._lanes.get(portal)
+        if lane is None:
+            lane = self._lanes[portal] = _Lane(limits)
+        return lane
+
+    def _grant(self, lane: _Lane):
+        start = max(lane.finish, self._vtime)
+        self._vtime = start
+        lane.finish = start + 1 / lane.limits.weight
+        lane.in_flight += 1
+        self.in_flight += 1
+        self.granted += 1
+
+    async def acquire(self, portal: str, limits, priority: Priority):
+        lane = self._lane(portal, limits)
+        # Free slots are always handed out on release, so nobody eligible is waiting for one now.
+        if not lane.waiters and lane.in_flight < limits.concurrency and self.in_flight < self.capacity:
+            self._grant(lane)
+            return
+        if not lane.waiters:
+            lane.finish = max(lane.finish, self._vtime)
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(lane.waiters, (priority, next(self._seq), waiter))
+        self.queued += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(portal)
+            raise
+
+    def release(self, portal: str):
+        lane = self._lanes[portal]
+        lane.in_flight -= 1
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.in_flight < self.capacity:
+            eligible = [
+                lane for lane in self._lanes.values()
+                if lane.waiters and lane.in_flight < lane.limits.concurrency
+            ]
+            if not eligible:
+                return
+            lane = min(eligible, key=lambda lane: lane.finish)
+            _, _, waiter = heapq.heappop(lane.waiters)
+            if waiter.done():
+                continue
+            self._grant(lane)
+            waiter.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "granted": self.granted,
+            "queued": self.queued,
+            "by_portal": {
+                portal: {"in_flight": lane.in_flight, "waiting": len(lane.waiters)}
+                for portal, lane in self._lanes.items() if lane.in_flight or lane.waiters
+            },
+        }
+
+
+def retry_after(outcome):
+    """Seconds to wait if `outcome` is a 429, 0.0 if it gave no hint, None otherwise.
+
+    Handles `httpx.Response` results as well as `HubSpotError`s and SDK `ApiException`s.
+    """
+    status = getattr(outcome, "status_code", None) or getattr(outcome, "status", None)
+    if status != 429:
+        return None
+    headers = getattr(outcome, "headers", None) or {}
+    try:
+        return max(0.0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class RequestScheduler:
+    """Central gate for outbound HubSpot calls.
+
+    Every call takes a permit from its portal's token bucket (HubSpot limits
+    apps per portal per 10 seconds), interactive calls ahead of bulk ones,
+    and then a slot from the `FairShare` that splits the app's upstream
+    concurrency across portals. Rates, caps and weights come from
+    `limits`, per portal. 429 responses are retried with jittered
+    exponential backoff, honouring `Retry-After`, and pause the portal's
+    bucket meanwhile. When `state` is shared between worker processes the
+    buckets are `SharedTokenBucket`s, so the rates hold for all workers
+    together; concurrency caps stay per process.
+    """
+
+    def __init__(self, limits, capacity: int, max_retries: int, base_delay: float, max_delay: float,
+                 state=None):
+        self.limits = limits
+        self.state = state
+        self.fair = FairShare(capacity)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets = {}
+        self.calls = 0
+        self.throttled = 0
+        self.retries = 0
+        self.waits = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    @classmethod
+    def from_env(cls, limits, capacity: int, state=None) -> "RequestScheduler":
+        """`capacity` is how many calls the backend can run at once; HUBSPOT_MAX_IN_FLIGHT lowers it."""
+        return cls(
+            limits,
+            capacity=min(capacity, int(getenv("HUBSPOT_MAX_IN_FLIGHT", str(capacity)))),
+            max_retries=int(getenv("HUBSPOT_MAX_RETRIES", "5")),
+            base_delay=float(getenv("HUBSPOT_BACKOFF_BASE", "0.5")),
+            max_delay=float(getenv("HUBSPOT_BACKOFF_MAX", "30")),
+            state=state,
+        )
+
+    def bucket(self, portal: str) -> TokenBucket:
+        portal = portal or APP_BUCKET
+        bucket = self._buckets.get(portal)
+        if bucket is None:
+            limits = self.limits.for_portal(portal)
+            if self.state is not None and self.state.shared:
+                bucket = SharedTokenBucket(self.state, f"bucket:{portal}", limits.rate, limits.per)
+            else:
+                bucket = TokenBucket(limits.rate, limits.per)
+            self._buckets[portal] = bucket
+        return bucket
+
+    async def call(self, portal: str, fn, *args, priority: Priority = Priority.INTERACTIVE, **kwargs):
+        """Await `fn(*args, **kwargs)` once the portal's budget and fair share allow, retrying 429s."""
+        portal = portal or APP_BUCKET
+        bucket = self.bucket(portal)
+        limits = self.limits.for_portal(portal)
+        self.calls += 1
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            await bucket.acquire(priority)
+            await self.fair.acquire(portal, limits, priority)
+            self._record_wait(time.monotonic() - started)
+
+            try:
+                result = await fn(*args, **kwargs)
+                hint = retry_after(result)
+            except Exception as e:
+                hint = retry_after(e)
+                if hint is None or attempt == self.max_retries:
+                    raise
+            else:
+                if hint is None or attempt == self.max_retries:
+                    return result
+            finally:
+                self.fair.release(portal)
+
+            self.throttled += 1
+            self.retries += 1
+            delay = self._backoff(attempt, hint)
+            bucket.pause(delay)
+            await asyncio.sleep(delay)
+
+    def _backoff(self, attempt: int, hint: float) -> float:
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+        # Full jitter spreads retries out; Retry-After is a floor, not a target.
+        return max(hint, random.uniform(0, ceiling))
+
+    def _record_wait(self, waited: float):
+        self.waits += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def close(self):
+        for bucket in self._buckets.values():
+            bucket.close()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "queue_depth": sum(bucket.depth() for bucket in self._buckets.values()),
+            "queue_depth_by_portal": {portal: bucket.depth() for portal, bucket in self._buckets.items()},
+            "wait_seconds_avg": round(self.wait_seconds_total / self.waits, 6) if self.waits else 0.0,
+            "wait_seconds_max": round(self.wait_seconds_max, 6),
+            "fair_share": self.fair.stats(),
+        }
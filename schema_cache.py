@@ -0,0 +1,124 @@
+from os import getenv
+import asyncio
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Properties the contact pages actually render.
+DISPLAY_PROPERTIES = ["firstname", "lastname", "email", "phone", "createdate", "lastmodifieddate"]
+
+# Internal property names: lowercase letters, digits and underscores.
+_PROPERTY_NAME = re.compile(r"[a-z0-9_]{1,100}")
+MAX_REQUESTED_PROPERTIES = 100
+
+
+def requested_properties(spec: str = None, always=()) -> list:
+    """Parse a comma-separated `properties` parameter, defaulting to the display set.
+
+    Names in `always` come first whatever was asked for. Raises ValueError
+    for malformed names.
+    """
+    names = [name.strip().lower() for name in (spec or "").split(",") if name.strip()] or DISPLAY_PROPERTIES
+    invalid = [name for name in names if not _PROPERTY_NAME.fullmatch(name)]
+    if invalid:
+        raise ValueError(f"Invalid property names: {', '.join(invalid)}")
+    names = list(dict.fromkeys([*always, *names]))
+    if len(names) > MAX_REQUESTED_PROPERTIES:
+        raise ValueError(f"At most {MAX_REQUESTED_PROPERTIES} properties can be requested")
+    return names
+
+
+class PropertySchemaCache:
+    """Contact property names per portal, kept fresh in the background.
+
+    Lookups never wait on HubSpot: a missing or stale entry schedules a
+    refresh and the caller carries on with whatever is cached (or nothing).
+    Given a `shared_state` backend, a refresh takes the schema another
+    worker already fetched when there is one, and invalidations reach every
+    worker.
+    """
+
+    def __init__(self, ttl: float, state=None):
+        self.ttl = ttl
+        self._state = state
+        self._entries = {}  # portal -> (fetched_at, frozenset of property names)
+        self._refreshing = {}
+        self.refreshes = 0
+        self.refresh_errors = 0
+        if state is not None:
+            state.subscribe("schema", lambda message: self._drop(message["portal"]))
+
+    @classmethod
+    def from_env(cls, state=None) -> "PropertySchemaCache":
+        return cls(ttl=float(getenv("HUBSPOT_SCHEMA_TTL", "3600")), state=state)
+
+    def property_names(self, portal: str, loader):
+        """Return the cached names for `portal` (or None), refreshing if needed.
+
+        `loader` is an async callable returning the portal's property names.
+        """
+        entry = self._entries.get(portal)
+        if entry is None or entry[0] + self.ttl <= time.monotonic():
+            self._schedule_refresh(portal, loader)
+        return entry[1] if entry else None
+
+    def properties_for(self, portal: str, loader, wanted=DISPLAY_PROPERTIES) -> list:
+        """Pick which of `wanted` to request, dropping any the portal doesn't define."""
+        names = self.property_names(portal, loader)
+        if names is None:
+            return list(wanted)
+        return [name for name in wanted if name in names]
+
+    def _drop(self, portal: str = None):
+        if portal is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(portal, None)
+
+    async def invalidate(self, portal: str = None):
+        self._drop(portal)
+        if self._state is not None:
+            if portal is not None:
+                await self._state.delete(f"schema:{portal}")
+            await self._state.publish("schema", {"portal": portal})
+
+    def _schedule_refresh(self, portal: str, loader):
+        if portal in self._refreshing:
+            return
+        task = asyncio.create_task(self._refresh(portal, loader))
+        self._refreshing[portal] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(portal, None))
+
+    async def _refresh(self, portal: str, loader):
+        fetched_at = time.time()
+        try:
+            shared = await self._state.get(f"schema:{portal}") if self._state is not None else None
+            if shared is not None:
+                fetched_at, names = shared
+            else:
+                names = await loader()
+                if self._state is not None:
+                    await self._state.set(f"schema:{portal}", [fetched_at, sorted(names)], self.ttl)
+        except Exception as e:
+            # Keep serving the previous schema; the next lookup retries.
+            self.refresh_errors += 1
+            logger.warning("Error during property schema refresh", extra={"fields": {"error": str(e)}})
+            return
+        # Age it by when it was fetched, whichever worker did that.
+        self._entries[portal] = (time.monotonic() - (time.time() - fetched_at), frozenset(names))
+        self.refreshes += 1
+
+    async def close(self):
+        for task in list(self._refreshing.values()):
+            task.cancel()
+        await asyncio.gather(*self._refreshing.values(), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "portals": len(self._entries),
+            "refreshing": len(self._refreshing),
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+        }
@@ -0,0 +1,234 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from os import getenv
+import asyncio
+import threading
+import hubspot
+import json
+from hubspot.crm.contacts import (
+    SimplePublicObjectInputForCreate,
+    SimplePublicObjectInput,
+    SimplePublicObjectBatchInput,
+    BatchInputSimplePublicObjectInputForCreate,
+    BatchInputSimplePublicObjectBatchInput,
+    BatchReadInputSimplePublicObjectId,
+    SimplePublicObjectId,
+    PublicObjectSearchRequest,
+)
+from urllib3.util.retry import Retry
+from cache import TTLCache
+from export import PAGE_SIZE
+from gateway import Contact, ContactPage, HubSpotError
+from hubspot_http import api_base
+
+
+class SDKClientPool:
+    """Reusable `hubspot.Client` instances plus the thread pool their calls run on.
+
+    The SDK is synchronous, so every call is pushed onto a sized executor to
+    keep the event loop free. Clients are cached per access token for `ttl`
+    seconds from first use, an access token's lifetime by default. A
+    refreshed token is a new key, so the old token's client just ages out
+    (or is evicted sooner once `maxsize` clients are cached).
+    """
+
+    def __init__(self, maxsize: int, ttl: float, max_workers: int):
+        self._clients = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hubspot-sdk")
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._peak_active = 0
+        self._completed = 0
+
+    @classmethod
+    def from_env(cls) -> "SDKClientPool":
+        return cls(
+            maxsize=int(getenv("HUBSPOT_SDK_CLIENT_CACHE_SIZE", "256")),
+            # HubSpot access tokens live for 30 minutes.
+            ttl=float(getenv("HUBSPOT_SDK_CLIENT_TTL", "1800")),
+            max_workers=int(getenv("HUBSPOT_SDK_WORKERS", "32")),
+        )
+
+    def client_for(self, access_token: str) -> hubspot.Client:
+        """The cached client for `access_token`; calls without a token (OAuth exchanges) get a fresh one."""
+        client = self._clients.get(access_token) if access_token else None
+        if client is None:
+            # Leave 429 handling to the RequestScheduler rather than urllib3's own retries.
+            retry = Retry(3, status=0, respect_retry_after_header=False, raise_on_status=False)
+            client = hubspot.Client.create(access_token=access_token, host=api_base(), retry=retry)
+            if access_token:
+                self._clients.set(access_token, client)
+        return client
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a blocking SDK call on the executor and await its result."""
+        with self._lock:
+            self._queued += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(self._call, fn, args, kwargs))
+
+    def _call(self, fn, args, kwargs):
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+            self._peak_active = max(self._peak_active, self._active)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._clients.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            executor = {
+                "max_workers": self.max_workers,
+                "active": self._active,
+                "queued": self._queued,
+                "peak_active": self._peak_active,
+                "completed": self._completed,
+                "saturation": round(self._active / self.max_workers, 4),
+            }
+        return {"client_cache": self._clients.stats(), "executor": executor}
+
+
+def _error(e: Exception) -> HubSpotError:
+    """Translate any of the SDK's per-package `ApiException`s."""
+    try:
+        data = json.loads(e.body) if e.body else {}
+    except ValueError:
+        data = {}
+    message = data.get("message") or data.get("error_description") or e.reason or f"HubSpot returned {e.status}"
+    return HubSpotError(e.status, message, headers=e.headers, body=e.body)
+
+
+def _page(api_response) -> ContactPage:
+    paging = api_response.paging
+    next_after = paging.next.after if paging and paging.next else None
+    return ContactPage([Contact.from_dict(contact.to_dict()) for contact in api_response.results], next_after)
+
+
+class SdkBackend:
+    """`hubspot-api-client` transport for `HubSpotGateway`; calls run on the pool's executor."""
+
+    name = "sdk"
+
+    def __init__(self, pool: SDKClientPool):
+        self.pool = pool
+        # Every call holds an executor thread; the scheduler shares this many slots across portals.
+        self.max_concurrency = pool.max_workers
+        self.requests = 0
+        self.failures = 0
+
+    @classmethod
+    def from_env(cls) -> "SdkBackend":
+        return cls(SDKClientPool.from_env())
+
+    async def close(self):
+        self.pool.shutdown()
+
+    async def _run(self, access_token, call, **kwargs):
+        """`call(client)` picks the SDK method; the SDK's exceptions come back as `HubSpotError`."""
+        self.requests += 1
+        try:
+            return await self.pool.run(call(self.pool.client_for(access_token)), **kwargs)
+        except Exception as e:
+            if not isinstance(getattr(e, "status", None), int):
+                raise
+            self.failures += 1
+            raise _error(e) from e
+
+    async def get_contact(self, access_token: str, contact_id: str, properties) -> Contact:
+        api_response = await self._run(
+            access_token, lambda client: client.crm.contacts.basic_api.get_by_id,
+            contact_id=contact_id, properties=list(properties)
+        )
+        return Contact.from_dict(api_response.to_dict())
+
+    async def list_contacts(self, access_token: str, properties, after: str = None) -> ContactPage:
+        return _page(await self._run(
+            access_token, lambda client: client.crm.contacts.basic_api.get_page,
+            limit=PAGE_SIZE, after=after, properties=list(properties), archived=False
+        ))
+
+    async def search_contacts(self, access_token: str, body: dict) -> ContactPage:
+        return _page(await self._run(
+            access_token, lambda client: client.crm.contacts.search_api.do_search,
+            public_object_search_request=PublicObjectSearchRequest(
+                filter_groups=body["filterGroups"], sorts=body["sorts"], properties=body["properties"],
+                limit=body["limit"], after=body.get("after")
+            )
+        ))
+
+    async def read_contacts(self, access_token: str, contact_ids, properties, id_property: str = None) -> list:
+        """Batch read; with `id_property` (say "email") the ids are values of that property instead."""
+        api_response = await self._run(
+            access_token, lambda client: client.crm.contacts.batch_api.read,
+            batch_read_input_simple_public_object_id=BatchReadInputSimplePublicObjectId(
+                properties=list(properties), properties_with_history=[], id_property=id_property,
+                inputs=[SimplePublicObjectId(id=contact_id) for contact_id in contact_ids]
+            )
+        )
+        return [Contact.from_dict(contact.to_dict()) for contact in api_response.results]
+
+    async def create_contact(self, access_token: str, properties: dict) -> Contact:
+        api_response = await self._run(
+            access_token, lambda client: client.crm.contacts.basic_api.create,
+            simple_public_object_input_for_create=SimplePublicObjectInputForCreate(
+                associations=[], properties=properties
+            )
+        )
+        return Contact.from_dict(api_response.to_dict())
+
+    async def update_contact(self, access_token: str, contact_id: str, properties: dict) -> Contact:
+        api_response = await self._run(
+            access_token, lambda client: client.crm.contacts.basic_api.update,
+            contact_id=contact_id, simple_public_object_input=SimplePublicObjectInput(properties=properties)
+        )
+        return Contact.from_dict(api_response.to_dict())
+
+    async def batch_contacts(self, access_token: str, kind: str, inputs: list) -> tuple:
+        """Batch create or update; returns `(results, errors)`."""
+        if kind == "create":
+            api_response = await self._run(
+                access_token, lambda client: client.crm.contacts.batch_api.create,
+                batch_input_simple_public_object_input_for_create=BatchInputSimplePublicObjectInputForCreate(
+                    inputs=[SimplePublicObjectInputForCreate(associations=[], properties=item["properties"])
+                            for item in inputs]
+                )
+            )
+        else:
+            api_response = await self._run(
+                access_token, lambda client: client.crm.contacts.batch_api.update,
+                batch_input_simple_public_object_batch_input=BatchInputSimplePublicObjectBatchInput(
+                    inputs=[SimplePublicObjectBatchInput(id=item["id"], properties=item["properties"])
+                            for item in inputs]
+                )
+            )
+        data = api_response.to_dict()
+        return [Contact.from_dict(record) for record in data.get("results") or []], data.get("errors") or []
+
+    async def hub_id(self, access_token: str) -> str:
+        info = await self._run(
+            access_token, lambda client: client.oauth.access_tokens_api.get, token=access_token
+        )
+        return str(info.hub_id)
+
+    async def exchange_token(self, form: dict) -> dict:
+        api_response = await self._run(None, lambda client: client.oauth.tokens_api.create, **form)
+        return api_response.to_dict()
+
+    async def property_names(self, access_token: str) -> list:
+        all_props = await self._run(
+            access_token, lambda client: client.crm.properties.core_api.get_all, object_type="contacts"
+        )
+        return [prop.name for prop in all_props.results]
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "failures": self.failures, **self.pool.stats()}
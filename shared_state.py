@@ -0,0 +1,436 @@
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+import asyncio
+import json
+import logging
+import os
+import secrets
+import socket
+import sqlite3
+import time
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Tells this process's own invalidation messages apart from other workers'.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+
+
+class MemoryState:
+    """State for a single worker process: plain dicts, nothing shared.
+
+    The default. With only one process there is nobody to tell about
+    invalidations, so `publish` goes nowhere. Expired values are dropped
+    when read and swept every `sweep_every` writes.
+    """
+
+    shared = False
+
+    def __init__(self, sweep_every: int = 1000):
+        self.sweep_every = sweep_every
+        self._values = {}  # key -> (expires_at, value)
+        self._buckets = {}  # key -> (tokens, updated)
+        self._writes = 0
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        self._values.clear()
+
+    async def get(self, key: str):
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self._values[key]
+            return None
+        return entry[1]
+
+    async def set(self, key: str, value, ttl: float):
+        now = time.time()
+        self._values[key] = (now + ttl, value)
+        self._writes += 1
+        if self._writes % self.sweep_every == 0:
+            self._values = {key: entry for key, entry in self._values.items() if entry[0] > now}
+
+    async def add(self, key: str, value, ttl: float) -> bool:
+        """Set `key` unless it already holds a live value; True if this call set it."""
+        if await self.get(key) is not None:
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def delete(self, key: str):
+        self._values.pop(key, None)
+
+    async def take(self, key: str, rate: int, per: float) -> float:
+        tokens, updated = self._buckets.get(key, (float(rate), 0.0))
+        tokens, updated, wait = _take(tokens, updated, rate, rate / per, time.time())
+        self._buckets[key] = (tokens, updated)
+        return wait
+
+    async def pause(self, key: str, seconds: float):
+        _, updated = self._buckets.get(key, (0.0, 0.0))
+        self._buckets[key] = (0.0, max(updated, time.time() + seconds))
+
+    def subscribe(self, topic: str, callback):
+        pass
+
+    async def publish(self, topic: str, message: dict):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "keys": len(self._values), "buckets": len(self._buckets)}
+
+
+def _take(tokens: float, updated: float, capacity: int, fill_rate: float, now: float) -> tuple:
+    """One token-bucket draw; returns `(tokens, updated, wait)`, `wait` 0 when a token was taken.
+
+    An `updated` in the future is a pause (see `pause`): nothing refills
+    and nothing is handed out until then.
+    """
+    if now < updated:
+        return tokens, updated, updated - now
+    tokens = min(capacity, tokens + (now - updated) * fill_rate)
+    if tokens >= 1:
+        return tokens - 1, now, 0.0
+    return tokens, now, (1 - tokens) / fill_rate
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    origin TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    message TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class _Subscribers:
+    """Invalidation callbacks by topic, fed with messages from other workers."""
+
+    def __init__(self):
+        self._callbacks = {}
+        self.received = 0
+
+    def add(self, topic: str, callback):
+        self._callbacks.setdefault(topic, []).append(callback)
+
+    def deliver(self, topic: str, message: dict):
+        self.received += 1
+        for callback in self._callbacks.get(topic, ()):
+            try:
+                callback(message)
+            except Exception as e:
+                logger.warning("Error handling shared invalidation", extra={"fields": {"topic": topic, "error": str(e)}})
+
+
+class SqliteState:
+    """State shared by the worker processes on one host through a SQLite file.
+
+    Values are JSON with an expiry, rate buckets are drawn inside an
+    immediate transaction so two processes can't both take the last token,
+    and invalidations are rows in an `events` table that every worker polls
+    every `poll_interval` seconds. As with `ContactMirror`, one worker
+    thread owns the connection.
+
+    Sessions, OAuth tokens included, are stored here, so a new file is
+    created readable by its owner only (0600); SQLite gives its `-wal` and
+    `-shm` files the same mode. An existing file keeps its permissions.
+    """
+
+    shared = True
+
+    def __init__(self, path: str, poll_interval: float, event_ttl: float = 60):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.event_ttl = event_ttl
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+        self._conn = None
+        self._subscribers = _Subscribers()
+        self._last_event = 0
+        self._task = None
+        self.published = 0
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _connect(self):
+        if self.path != ":memory:" and not self.path.startswith("file:"):
+            os.close(os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600))
+        # Autocommit; `take` opens its own transaction.
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        # Only what other workers publish from now on matters.
+        self._last_event = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    async def start(self):
+        await self._run(self._connect)
+        self._task = asyncio.create_task(self._poll_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._conn is not None:
+            await self._run(self._conn.close)
+        self._executor.shutdown(wait=False)
+
+    def _get(self, key):
+        row = self._conn.execute("SELECT value FROM kv WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def get(self, key: str):
+        return await self._run(self._get, key)
+
+    def _set(self, key, value, ttl):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, default=str), time.time() + ttl),
+        )
+
+    async def set(self, key: str, value, ttl: float):
+        await self._run(self._set, key, value, ttl)
+
+    def _add(self, key, value, ttl):
+        now = time.time()
+        cursor = self._conn.execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?)"
+            " ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at"
+            " WHERE kv.expires_at <= ?",
+            (key, json.dumps(value, default=str), now + ttl, now),
+        )
+        return cursor.rowcount == 1
+
+    async def add(self, key: str, value, ttl: float) -> bool:
+        """Set `key` unless it already holds a live value; True if this call set it."""
+        return await self._run(self._add, key, value, ttl)
+
+    async def delete(self, key: str):
+        await self._run(self._conn.execute, "DELETE FROM kv WHERE key = ?", (key,))
+
+    def _take(self, key, rate, per):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row or (float(rate), 0.0)
+            tokens, updated, wait = _take(tokens, updated, rate, rate / per, time.time())
+            self._conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, updated)
+            )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    async def take(self, key: str, rate: int, per: float) -> float:
+        return await self._run(self._take, key, rate, per)
+
+    def _pause(self, key, seconds):
+        until = time.time() + seconds
+        self._conn.execute(
+            "INSERT INTO buckets (key, tokens, updated) VALUES (?, 0, ?)"
+            " ON CONFLICT (key) DO UPDATE SET tokens = 0, updated = MAX(updated, excluded.updated)",
+            (key, until),
+        )
+
+    async def pause(self, key: str, seconds: float):
+        await self._run(self._pause, key, seconds)
+
+    def subscribe(self, topic: str, callback):
+        self._subscribers.add(topic, callback)
+
+    def _publish(self, topic, message):
+        self._conn.execute(
+            "INSERT INTO events (origin, topic, message, created_at) VALUES (?, ?, ?, ?)",
+            (WORKER_ID, topic, json.dumps(message, default=str), time.time()),
+        )
+
+    async def publish(self, topic: str, message: dict):
+        self.published += 1
+        await self._run(self._publish, topic, message)
+
+    def _events(self):
+        rows = self._conn.execute(
+            "SELECT id, origin, topic, message FROM events WHERE id > ? ORDER BY id", (self._last_event,)
+        ).fetchall()
+        if rows:
+            self._last_event = rows[-1][0]
+        return [(topic, json.loads(message)) for _, origin, topic, message in rows if origin != WORKER_ID]
+
+    def _purge(self):
+        now = time.time()
+        self._conn.execute("DELETE FROM kv WHERE expires_at <= ?", (now,))
+        self._conn.execute("DELETE FROM events WHERE created_at < ?", (now - self.event_ttl,))
+
+    async def _poll_loop(self):
+        purged = time.monotonic()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                for topic, message in await self._run(self._events):
+                    self._subscribers.deliver(topic, message)
+                # Any worker may purge; an idle minute between purges is plenty.
+                if time.monotonic() - purged > self.event_ttl:
+                    purged = time.monotonic()
+                    await self._run(self._purge)
+            except sqlite3.Error as e:
+                logger.warning("Error polling shared state", extra={"fields": {"error": str(e)}})
+
+    def stats(self) -> dict:
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "published": self.published,
+            "received": self._subscribers.received,
+        }
+
+
+# Token-bucket draw and pause against the server's clock, atomic in Redis.
+_TAKE = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local capacity, fill_rate = tonumber(ARGV[1]), tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens, updated = tonumber(state[1]) or capacity, tonumber(state[2]) or 0
+local wait = 0
+if now < updated then
+    wait = updated - now
+else
+    tokens = math.min(capacity, tokens + (now - updated) * fill_rate)
+    updated = now
+    if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / fill_rate end
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', updated)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / fill_rate + wait) + 60)
+return tostring(wait)
+"""
+
+_PAUSE = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local updated = math.max(tonumber(redis.call('HGET', KEYS[1], 'updated')) or 0, now + tonumber(ARGV[1]))
+redis.call('HSET', KEYS[1], 'tokens', 0, 'updated', updated)
+redis.call('EXPIRE', KEYS[1], math.ceil(updated - now) + 60)
+"""
+
+
+class RedisState:
+    """State shared through a Redis-compatible server, for workers on one host or many.
+
+    Buckets are drawn by a Lua script against the server's clock, and
+    invalidations go out over pub/sub on `channel`. Needs the optional
+    `redis` package.
+    """
+
+    shared = True
+
+    def __init__(self, url: str, channel: str = "hubspot-app:invalidate"):
+        if redis is None:
+            raise RuntimeError("SHARED_STATE=redis but the 'redis' package is not installed")
+        self._redis = redis.from_url(url)
+        self.channel = channel
+        self._take_script = self._redis.register_script(_TAKE)
+        self._pause_script = self._redis.register_script(_PAUSE)
+        self._subscribers = _Subscribers()
+        self._pubsub = None
+        self._task = None
+        self.published = 0
+
+    async def start(self):
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.channel)
+        self._task = asyncio.create_task(self._listen())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        await self._redis.aclose()
+
+    async def get(self, key: str):
+        raw = await self._redis.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value, ttl: float):
+        await self._redis.set(key, json.dumps(value, default=str), px=max(1, int(ttl * 1000)))
+
+    async def add(self, key: str, value, ttl: float) -> bool:
+        """Set `key` unless it already holds a live value; True if this call set it."""
+        return bool(await self._redis.set(key, json.dumps(value, default=str), px=max(1, int(ttl * 1000)), nx=True))
+
+    async def delete(self, key: str):
+        await self._redis.delete(key)
+
+    async def take(self, key: str, rate: int, per: float) -> float:
+        return float(await self._take_script(keys=[key], args=[rate, rate / per]))
+
+    async def pause(self, key: str, seconds: float):
+        await self._pause_script(keys=[key], args=[seconds])
+
+    def subscribe(self, topic: str, callback):
+        self._subscribers.add(topic, callback)
+
+    async def publish(self, topic: str, message: dict):
+        self.published += 1
+        await self._redis.publish(self.channel, json.dumps({"origin": WORKER_ID, "topic": topic, "message": message},
+                                                           default=str))
+
+    async def _listen(self):
+        while True:
+            try:
+                async for item in self._pubsub.listen():
+                    event = json.loads(item["data"])
+                    if event["origin"] != WORKER_ID:
+                        self._subscribers.deliver(event["topic"], event["message"])
+            except Exception as e:
+                logger.warning("Error listening for shared invalidations", extra={"fields": {"error": str(e)}})
+                await asyncio.sleep(1)
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "published": self.published, "received": self._subscribers.received}
+
+
+def shared_state_from_env():
+    """The state backend for caches, sessions and rate budgets, chosen by SHARED_STATE.
+
+    `memory` (the default) suits one worker process. With `uvicorn
+    --workers N`, use `sqlite` (SHARED_STATE_PATH, a file every worker on
+    the host can reach) or `redis` (SHARED_STATE_REDIS_URL) so the workers
+    share one rate budget, one session store and one contact cache.
+    Sessions hold OAuth tokens, so keep the SQLite file (created 0600) or
+    the Redis server private to the app.
+    """
+    kind = getenv("SHARED_STATE", "memory").lower()
+    if kind == "memory":
+        return MemoryState()
+    if kind == "sqlite":
+        return SqliteState(
+            getenv("SHARED_STATE_PATH", "shared_state.db"),
+            poll_interval=float(getenv("SHARED_STATE_POLL_INTERVAL", "0.25")),
+        )
+    if kind == "redis":
+        return RedisState(getenv("SHARED_STATE_REDIS_URL", "redis://localhost:6379/0"))
+    raise ValueError(f"Unknown SHARED_STATE {kind!r}; expected memory, sqlite or redis")
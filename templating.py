@@ -0,0 +1,77 @@
+from fastapi.responses import StreamingResponse
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from os import getenv
+import logging
+import time
+from metrics import add_timing
+
+logger = logging.getLogger(__name__)
+
+# Streamed pages are sent in pieces of about this many characters, not one per template fragment.
+STREAM_CHUNK_SIZE = 8192
+
+
+class AppTemplates(Jinja2Templates):
+    """The app's templates: timed, precompiled at startup, and renderable as a stream.
+
+    Streaming needs an async Jinja environment so `{% for %}` can walk an
+    async iterator of rows; an async environment can't serve the ordinary
+    synchronous `TemplateResponse`, so there are two over the same loader.
+    Their compiled code differs, so each gets its own bytecode cache files.
+    """
+
+    def __init__(self, directory: str):
+        loader = FileSystemLoader(directory)
+        super().__init__(env=Environment(loader=loader, autoescape=True))
+        self.stream_env = Environment(loader=loader, autoescape=True, enable_async=True)
+        self._setup_env_defaults(self.stream_env)
+
+    def precompile(self) -> int:
+        """Load every template into both environments, through the bytecode cache when there is one.
+
+        Settings are read here, from the lifespan, so values from `.env`
+        apply. Templates aren't re-checked on disk per render unless
+        TEMPLATE_AUTO_RELOAD is set.
+        """
+        cache_dir = getenv("TEMPLATE_CACHE_DIR") or None
+        auto_reload = getenv("TEMPLATE_AUTO_RELOAD", "false").lower() == "true"
+        use_cache = getenv("TEMPLATE_BYTECODE_CACHE", "true").lower() != "false"
+        started = time.monotonic()
+        names = self.env.list_templates(extensions=["html"])
+        for env, pattern in ((self.env, "__jinja2_%s.cache"), (self.stream_env, "__jinja2_async_%s.cache")):
+            env.auto_reload = auto_reload
+            env.bytecode_cache = FileSystemBytecodeCache(cache_dir, pattern) if use_cache else None
+            for name in names:
+                env.get_template(name)
+        logger.info("Templates compiled", extra={"fields": {
+            "templates": len(names), "seconds": round(time.monotonic() - started, 4), "bytecode_cache": use_cache,
+        }})
+        return len(names)
+
+    def TemplateResponse(self, name, context, *args, **kwargs):
+        started = time.perf_counter()
+        response = super().TemplateResponse(name, context, *args, **kwargs)
+        elapsed = time.perf_counter() - started
+        context["request"].app.state.metrics.render.observe(name, value=elapsed)
+        add_timing("render", elapsed)
+        return response
+
+    def StreamingTemplateResponse(self, name: str, context: dict, chunk_size: int = STREAM_CHUNK_SIZE):
+        """Render `name` as it goes; async iterables in `context` are consumed while the page is sent."""
+        template = self.stream_env.get_template(name)
+        return StreamingResponse(_chunks(template.generate_async(context), chunk_size), media_type="text/html")
+
+
+async def _chunks(fragments, chunk_size: int):
+    buffer = []
+    size = 0
+    async for fragment in fragments:
+        buffer.append(fragment)
+        size += len(fragment)
+        if size >= chunk_size:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
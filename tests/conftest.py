@@ -0,0 +1,47 @@
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import httpx
+import pytest
+
+# The app's modules live at the repository root.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench.mock_hubspot import MockHubSpot, create_mock_app  # noqa: E402
+from hubspot_http import HttpBackend  # noqa: E402
+from routes import create_app  # noqa: E402
+
+
+@pytest.fixture
+def hubspot():
+    """The bench HubSpot stand-in, served in process."""
+    return MockHubSpot(contacts=50)
+
+
+@pytest.fixture
+def serve(hubspot, tmp_path, monkeypatch):
+    """`async with serve() as (app, client):` runs the app against `hubspot` with throwaway storage."""
+    settings = {
+        "SHARED_STATE": "memory",
+        "CONTACT_MIRROR_PATH": ":memory:",
+        "CONTACT_MIRROR_INTERVAL": "0",
+        "JOBS_DB_PATH": str(tmp_path / "jobs.db"),
+        "JOBS_UPLOAD_DIR": str(tmp_path / "uploads"),
+        "LOG_LEVEL": "ERROR",
+    }
+    for name, value in settings.items():
+        monkeypatch.setenv(name, value)
+
+    @asynccontextmanager
+    async def running(cookies=None):
+        upstream = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_mock_app(hubspot)),
+                                     base_url="http://hubspot.test")
+        app = create_app(lambda: HttpBackend(upstream, max_concurrency=10))
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://app.test",
+                                         cookies={"access_token": "bench-1"} if cookies is None else cookies) as client:
+                yield app, client
+
+    return running
@@ -0,0 +1,86 @@
+import pytest
+
+import breaker
+from breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(breaker.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_opens_after_threshold_failures_in_a_row(clock):
+    circuit = CircuitBreaker("get_contact", threshold=3, reset_timeout=30)
+    circuit.failure()
+    circuit.failure()
+    circuit.success()
+    circuit.failure()
+    circuit.failure()
+    assert circuit.state == CLOSED
+    circuit.failure()
+    assert circuit.state == OPEN
+    assert circuit.times_opened == 1
+
+
+def test_open_circuit_rejects_until_one_probe_is_due(clock):
+    circuit = CircuitBreaker("get_contact", threshold=1, reset_timeout=30)
+    circuit.failure()
+    assert not circuit.allow()
+    assert circuit.retry_after() == 30
+    clock[0] += 30
+    assert circuit.allow()
+    assert circuit.state == HALF_OPEN
+    assert not circuit.allow()
+    assert circuit.rejected == 2
+
+
+def test_probe_success_closes_the_circuit(clock):
+    circuit = CircuitBreaker("get_contact", threshold=1, reset_timeout=30)
+    circuit.failure()
+    clock[0] += 30
+    assert circuit.allow()
+    circuit.success()
+    assert circuit.state == CLOSED
+    assert circuit.failures == 0
+    assert circuit.allow()
+
+
+def test_probe_failure_opens_the_circuit_again(clock):
+    circuit = CircuitBreaker("get_contact", threshold=1, reset_timeout=30)
+    circuit.failure()
+    clock[0] += 30
+    assert circuit.allow()
+    circuit.failure()
+    assert circuit.state == OPEN
+    assert circuit.times_opened == 2
+    assert circuit.retry_after() == 30
+
+
+def test_abandoned_probe_is_owed_again_at_once(clock):
+    circuit = CircuitBreaker("get_contact", threshold=1, reset_timeout=30)
+    circuit.failure()
+    clock[0] += 30
+    assert circuit.allow()
+    circuit.abandon()
+    assert circuit.state == OPEN
+    assert circuit.allow()
+
+
+def test_slow_success_counts_as_failure(clock):
+    circuit = CircuitBreaker("get_contact", threshold=1, reset_timeout=30, slow_call=5)
+    circuit.success(seconds=4)
+    assert circuit.state == CLOSED
+    circuit.success(seconds=6)
+    assert circuit.state == OPEN
+
+
+def test_state_changes_are_reported(clock):
+    seen = []
+    circuit = CircuitBreaker("get_contact", threshold=1, reset_timeout=30, on_change=lambda c: seen.append(c.state))
+    circuit.failure()
+    clock[0] += 30
+    circuit.allow()
+    circuit.success()
+    assert seen == [OPEN, HALF_OPEN, CLOSED]
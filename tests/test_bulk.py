@@ -0,0 +1,120 @@
+import asyncio
+import io
+import json
+
+import pytest
+
+from bulk import (INVALID_RECORD, NO_PROPERTIES, check_encoding, chunk_rows, match_results, ndjson_report,
+                  read_rows, send_chunk)
+
+
+def test_updates_are_matched_by_id():
+    chunk = [(1, "10", {"firstname": "A"}), (2, "11", {"firstname": "B"})]
+    outcomes = match_results("update", chunk, [{"id": "11"}, {"id": "10"}], [])
+    assert outcomes == [
+        {"row": 1, "status": "updated", "id": "10"},
+        {"row": 2, "status": "updated", "id": "11"},
+    ]
+
+
+def test_update_errors_are_matched_by_context_ids():
+    chunk = [(1, "10", {}), (2, "11", {})]
+    errors = [{"message": "Object not found", "context": {"ids": ["11"]}}]
+    outcomes = match_results("update", chunk, [{"id": "10"}], errors)
+    assert outcomes[0]["status"] == "updated"
+    assert outcomes[1] == {"row": 2, "status": "error", "id": "11", "error": "Object not found"}
+
+
+def test_creates_are_matched_by_email_ignoring_case():
+    chunk = [(1, None, {"email": "a@example.com"}), (2, None, {"email": "B@example.com"})]
+    results = [{"id": "21", "properties": {"email": "b@example.com"}},
+               {"id": "20", "properties": {"email": "A@EXAMPLE.COM"}}]
+    outcomes = match_results("create", chunk, results, [])
+    assert [outcome["id"] for outcome in outcomes] == ["20", "21"]
+    assert all(outcome["status"] == "created" for outcome in outcomes)
+
+
+def test_creates_without_email_are_matched_by_position():
+    chunk = [(1, None, {"firstname": "A"}), (2, None, {"email": "b@example.com"}), (3, None, {"firstname": "C"})]
+    results = [{"id": "30", "properties": {}},
+               {"id": "31", "properties": {"email": "b@example.com"}},
+               {"id": "32", "properties": {}}]
+    outcomes = match_results("create", chunk, results, [])
+    assert [outcome["id"] for outcome in outcomes] == ["30", "31", "32"]
+
+
+def test_rows_without_a_result_report_the_batch_error():
+    chunk = [(1, None, {"email": "a@example.com"}), (2, None, {"email": "b@example.com"})]
+    results = [{"id": "40", "properties": {"email": "a@example.com"}}]
+    errors = [{"message": "Contact already exists. Existing ID: 7"}]
+    outcomes = match_results("create", chunk, results, errors)
+    assert outcomes[1] == {"row": 2, "status": "error", "id": None, "error": "Contact already exists. Existing ID: 7"}
+    assert match_results("create", chunk, [], [])[0]["error"] == "No result returned for this row"
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_rows_with_nothing_to_write_are_invalid():
+    rows = list(read_rows(io.BytesIO(b"email,firstname\n,\na@example.com,A\n"), "upload.csv"))
+    assert rows[0] == (1, None, {})
+    assert [kind for kind, _ in chunk_rows(rows)] == ["create", "invalid"]
+
+
+def test_invalid_rows_fail_without_being_sent():
+    sent = []
+
+    async def send_batch(kind, chunk):
+        sent.append(kind)
+        return []
+
+    outcomes = run(send_chunk(send_batch, "invalid", [(1, None, None), (2, "7", {})]))
+    assert sent == []
+    assert [outcome["error"] for outcome in outcomes] == [INVALID_RECORD, NO_PROPERTIES]
+
+
+def test_non_utf8_upload_is_rejected():
+    with pytest.raises(ValueError, match="not UTF-8"):
+        check_encoding(io.BytesIO(b"email\n\xff\xfe\n"))
+    upload = io.BytesIO("email\né@example.com\n".encode())
+    check_encoding(upload, chunk_size=7)
+    assert upload.tell() == 0
+
+
+def test_report_ends_with_a_summary_when_the_upload_breaks():
+    async def outcomes():
+        yield {"row": 1, "status": "created", "id": "1"}
+        raise UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte")
+
+    async def report():
+        return [json.loads(line) async for line in ndjson_report(outcomes())]
+
+    lines = run(report())
+    assert "error" in lines[1]
+    assert lines[-1] == {"summary": {"rows": 1, "created": 1, "updated": 0, "failed": 0}}
+
+
+def test_bulk_route_rejects_non_utf8_uploads(serve, hubspot):
+    async def scenario():
+        async with serve() as (app, client):
+            return await client.post("/contacts/bulk", files={"file": ("upload.csv", b"email\n\xff\xfe\n")})
+
+    response = run(scenario())
+    assert response.status_code == 400
+    assert "not UTF-8" in response.json()["error"]
+
+
+def test_bulk_route_reports_every_row(serve, hubspot):
+    body = b'{"id": "5", "firstname": "A"}\n{bad json\n{}\n{"email": "new@example.com"}\n'
+
+    async def scenario():
+        async with serve() as (app, client):
+            response = await client.post("/contacts/bulk", files={"file": ("upload.ndjson", body)})
+            return [json.loads(line) for line in response.text.splitlines()]
+
+    lines = run(scenario())
+    errors = {line["row"]: line["error"] for line in lines if line.get("status") == "error"}
+    assert errors == {2: INVALID_RECORD, 3: NO_PROPERTIES}
+    assert lines[-1] == {"summary": {"rows": 4, "created": 1, "updated": 1, "failed": 2}}
+    assert hubspot.portals[1].find_email("new@example.com") is not None
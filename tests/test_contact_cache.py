@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+import contact_cache
+from contact_cache import CACHED_AT, ContactCache, MemoryContactStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(contact_cache.time, "time", lambda: now[0])
+    return now
+
+
+def make_cache(ttl=10, stale_ttl=100):
+    return ContactCache(MemoryContactStore(maxsize=100, ttl=1e9), ttl=ttl, stale_ttl=stale_ttl)
+
+
+def contact(contact_id="1", **properties):
+    return {"id": contact_id, "properties": properties}
+
+
+def test_record_is_fresh_for_ttl(clock):
+    async def scenario():
+        cache = make_cache()
+        await cache.put("p", contact(email="a@example.com"))
+        clock[0] += 9
+        fresh = await cache.get("p", "1")
+        clock[0] += 1
+        expired = await cache.get("p", "1")
+        return fresh, expired, cache.hits, cache.misses
+
+    fresh, expired, hits, misses = asyncio.run(scenario())
+    assert fresh["properties"] == {"email": "a@example.com"}
+    assert expired is None
+    assert (hits, misses) == (1, 1)
+
+
+def test_invalidate_drops_the_record(clock):
+    async def scenario():
+        cache = make_cache()
+        await cache.put("p", contact())
+        await cache.invalidate("p", 1)
+        return await cache.get("p", "1")
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_patch_updates_cached_records_only(clock):
+    async def scenario():
+        cache = make_cache()
+        await cache.put("p", contact(email="a@example.com", phone="1"))
+        clock[0] += 5
+        patched = await cache.patch("p", "1", {"phone": "2"})
+        missing = await cache.patch("p", "2", {"phone": "2"})
+        return patched, missing, await cache.get("p", "1")
+
+    patched, missing, record = asyncio.run(scenario())
+    assert (patched, missing) == (True, False)
+    assert record["properties"] == {"email": "a@example.com", "phone": "2"}
+    assert record[CACHED_AT] == 1000
+
+
+def test_record_only_counts_when_it_holds_the_requested_properties(clock):
+    async def scenario():
+        cache = make_cache()
+        await cache.put("p", contact(email="a@example.com"))
+        return await cache.get("p", "1", ["email"]), await cache.get("p", "1", ["email", "phone"])
+
+    assert asyncio.run(scenario()) == (contact(email="a@example.com") | {CACHED_AT: 1000}, None)
+
+
+def test_merge_keeps_properties_from_an_earlier_fetch(clock):
+    async def scenario():
+        cache = make_cache()
+        await cache.merge("p", contact(email="a@example.com"))
+        clock[0] += 5
+        await cache.merge("p", contact(phone="1"))
+        return await cache.get("p", "1", ["email", "phone"])
+
+    record = asyncio.run(scenario())
+    assert record["properties"] == {"email": "a@example.com", "phone": "1"}
+    assert record[CACHED_AT] == 1000
+
+
+def test_merge_does_not_keep_old_properties_fresh(clock):
+    async def scenario():
+        cache = make_cache()
+        await cache.merge("p", contact(email="a@example.com"))
+        clock[0] = 1009
+        await cache.merge("p", contact(phone="1"))
+        clock[0] = 1018
+        return await cache.get("p", "1", ["email"]), await cache.get("p", "1", ["phone"])
+
+    assert asyncio.run(scenario()) == (None, None)
+
+
+def test_merge_replaces_an_expired_record(clock):
+    async def scenario():
+        cache = make_cache()
+        await cache.merge("p", contact(email="a@example.com"))
+        clock[0] += 10
+        await cache.merge("p", contact(phone="1"))
+        return await cache.get("p", "1")
+
+    record = asyncio.run(scenario())
+    assert record["properties"] == {"phone": "1"}
+    assert record[CACHED_AT] == 1010
+
+
+def test_expired_record_is_served_stale_with_its_age(clock):
+    async def scenario():
+        cache = make_cache()
+        await cache.put("p", contact(email="a@example.com"))
+        clock[0] += 50
+        return await cache.get("p", "1"), await cache.get("p", "1", stale=True)
+
+    fresh, stale = asyncio.run(scenario())
+    assert fresh is None
+    assert stale["properties"] == {"email": "a@example.com"}
+    assert stale[CACHED_AT] == 1000
@@ -0,0 +1,34 @@
+from email_index import EmailIndex, email_key
+
+
+def test_addresses_are_normalised_and_never_kept_in_clear():
+    index = EmailIndex(maxsize=10, ttl=60)
+    index.add("1", 7, " Ada@Example.com ")
+    assert index.get("1", "ada@example.com") == "7"
+    assert index.get("2", "ada@example.com") is None
+    assert email_key("") is None and index.get("1", "") is None
+    assert list(index._ids._data) == [("1", email_key("ada@example.com"))]
+
+
+def test_a_new_address_replaces_the_contacts_old_one():
+    index = EmailIndex(maxsize=10, ttl=60)
+    index.add("1", "7", "old@example.com")
+    index.add("1", "7", "new@example.com")
+    assert index.get("1", "old@example.com") is None
+    assert index.get("1", "new@example.com") == "7"
+
+
+def test_an_address_moving_to_another_contact_unlinks_the_first():
+    index = EmailIndex(maxsize=10, ttl=60)
+    index.add("1", "7", "ada@example.com")
+    index.add("1", "8", "ada@example.com")
+    index.forget_contact("1", "7")
+    assert index.get("1", "ada@example.com") == "8"
+
+
+def test_eviction_drops_the_reverse_entry():
+    index = EmailIndex(maxsize=1, ttl=60)
+    index.add("1", "7", "ada@example.com")
+    index.add("1", "8", "bob@example.com")
+    assert index.get("1", "ada@example.com") is None
+    assert index._keys == {("1", "8"): email_key("bob@example.com")}
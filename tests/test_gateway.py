@@ -0,0 +1,116 @@
+import asyncio
+
+from hubspot_http import HttpBackend
+
+CREATE = "POST /crm/v3/objects/contacts"
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_upsert_creates_when_the_indexed_contact_was_deleted(serve, hubspot):
+    async def scenario():
+        async with serve() as (app, client):
+            gateway = app.state.gateway
+            portal = await gateway.portal("bench-1")
+            await gateway.get_contact("bench-1", portal, "5")
+            hubspot.portals[1]._deleted.add(5)
+            contact = await gateway.upsert_contact("bench-1", portal, {"email": "contact5@example.com"})
+            return contact, gateway.emails.get(portal, "contact5@example.com")
+
+    contact, indexed = run(scenario())
+    assert contact.id != "5"
+    assert indexed == contact.id
+    assert hubspot.portals[1].find_email("contact5@example.com") == int(contact.id)
+
+
+def test_upsert_updates_when_a_create_races_another_writer(serve, hubspot, monkeypatch):
+    read_contacts = HttpBackend.read_contacts
+    lookups = []
+
+    async def lookup_misses_once(self, *args, **kwargs):
+        # The first lookup runs before the other writer's create lands.
+        lookups.append(args)
+        return [] if len(lookups) == 1 else await read_contacts(self, *args, **kwargs)
+
+    monkeypatch.setattr(HttpBackend, "read_contacts", lookup_misses_once)
+
+    async def scenario():
+        async with serve() as (app, client):
+            gateway = app.state.gateway
+            portal = await gateway.portal("bench-1")
+            hubspot.reset()
+            contact = await gateway.upsert_contact("bench-1", portal, {"email": "contact9@example.com",
+                                                                       "firstname": "Raced"})
+            return contact, hubspot.statuses
+
+    contact, statuses = run(scenario())
+    assert contact.id == "9"
+    assert contact.properties["firstname"] == "Raced"
+    assert len(lookups) == 2
+    assert statuses[409] == 1
+
+
+GET_CONTACT = "GET /crm/v3/objects/contacts/{contact_id}"
+
+
+def test_expired_cache_copy_is_served_stale_while_hubspot_fails(serve, hubspot, monkeypatch):
+    monkeypatch.setenv("CONTACT_CACHE_TTL", "0")
+
+    async def scenario():
+        async with serve() as (app, client):
+            fresh = (await client.get("/get-contact/5?format=json")).json()
+            hubspot.rate_503 = 1.0
+            stale = await client.get("/get-contact/5?format=json")
+            return fresh, stale
+
+    fresh, stale = run(scenario())
+    assert "stale" not in fresh
+    assert stale.status_code == 200
+    assert stale.json()["stale"] is True
+    assert stale.json()["properties"]["email"] == "contact5@example.com"
+
+
+def test_open_circuit_serves_the_mirror_without_calling_hubspot(serve, hubspot, monkeypatch):
+    monkeypatch.setenv("HUBSPOT_BREAKER_THRESHOLD", "1")
+
+    async def scenario():
+        async with serve() as (app, client):
+            gateway = app.state.gateway
+            await gateway.sync.sync(await gateway.portal("bench-1"))
+            hubspot.rate_503 = 1.0
+            hubspot.reset()
+            first = (await client.get("/get-contact/7?format=json")).json()
+            second = (await client.get("/get-contact/8?format=json")).json()
+            return first, second, hubspot.calls[GET_CONTACT]
+
+    first, second, calls = run(scenario())
+    assert first["stale"] is True and first["properties"]["email"] == "contact7@example.com"
+    assert second["stale"] is True and second["properties"]["email"] == "contact8@example.com"
+    assert calls == 1
+
+
+def test_failed_list_page_falls_back_to_the_mirror(serve, hubspot):
+    async def scenario():
+        async with serve() as (app, client):
+            gateway = app.state.gateway
+            await gateway.sync.sync(await gateway.portal("bench-1"))
+            hubspot.rate_503 = 1.0
+            return await client.get("/get-all-contacts?format=json")
+
+    response = run(scenario())
+    assert response.status_code == 200
+    assert response.json()["stale"] is True
+    assert response.json()["results"]
+
+
+def test_nothing_local_means_the_outage_is_reported(serve, hubspot):
+    async def scenario():
+        async with serve() as (app, client):
+            hubspot.rate_503 = 1.0
+            return await client.get("/get-contact/5?format=json")
+
+    response = run(scenario())
+    assert response.status_code >= 500
+    assert "stale" not in response.json()
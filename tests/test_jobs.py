@@ -0,0 +1,166 @@
+import asyncio
+import io
+
+from jobs import JobRunner, JobStore
+from shared_state import MemoryState
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class Upload:
+    def __init__(self, filename, data):
+        self.filename = filename
+        self._file = io.BytesIO(data)
+
+    async def read(self, size):
+        return self._file.read(size)
+
+
+def csv_upload(rows):
+    return Upload("contacts.csv", b"email\n" + b"".join(b"c%d@example.com\n" % i for i in range(rows)))
+
+
+class Sender:
+    """Records the rows it is sent; blocks once `stall_after` rows have gone, until `release` is set."""
+
+    def __init__(self, stall_after=None):
+        self.rows = []
+        self.stall_after = stall_after
+        self.release = asyncio.Event()
+
+    async def __call__(self, token, portal, kind, chunk):
+        if self.stall_after is not None and len(self.rows) >= self.stall_after:
+            await self.release.wait()
+        self.rows.extend(row[0] for row in chunk)
+        return [{"row": row[0], "status": "created", "id": str(row[0])} for row in chunk]
+
+
+async def no_wait_token(portal, session_id):
+    return "token"
+
+
+def runner(tmp_path, send_batch, token_for=no_wait_token, state=None, **settings):
+    options = {"workers": 1, "concurrency": 1, "retry_interval": 0.05}
+    return JobRunner(JobStore(str(tmp_path / "jobs.db")), send_batch, token_for, str(tmp_path / "uploads"),
+                     state=state, **{**options, **settings})
+
+
+async def finished(jobs, job_id, timeout=5):
+    async def poll():
+        while (job := await jobs.store.get(job_id))["status"] not in ("completed", "failed"):
+            await asyncio.sleep(0.01)
+        return job
+    return await asyncio.wait_for(poll(), timeout)
+
+
+def test_job_runs_every_chunk(tmp_path):
+    async def scenario():
+        sender = Sender()
+        jobs = runner(tmp_path, sender)
+        await jobs.start()
+        try:
+            job = await jobs.submit("1", csv_upload(250))
+            return await finished(jobs, job["id"]), sender.rows
+        finally:
+            await jobs.close()
+
+    job, rows = run(scenario())
+    assert job["status"] == "completed"
+    assert (job["rows_total"], job["rows_done"], job["created"]) == (250, 250, 250)
+    assert sorted(rows) == list(range(1, 251))
+
+
+async def read_job(tmp_path, job_id):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    await store.open()
+    try:
+        return await store.get(job_id)
+    finally:
+        await store.close()
+
+
+def test_restart_carries_on_after_the_last_committed_chunk(tmp_path):
+    async def scenario():
+        first = Sender(stall_after=100)
+        jobs = runner(tmp_path, first)
+        await jobs.start()
+        job = await jobs.submit("1", csv_upload(250))
+        while not await jobs.store.done_chunks(job["id"]):
+            await asyncio.sleep(0.01)
+        await jobs.close()
+        interrupted = await read_job(tmp_path, job["id"])
+
+        second = Sender()
+        jobs = runner(tmp_path, second)
+        await jobs.start()
+        try:
+            return interrupted, await finished(jobs, job["id"]), second.rows
+        finally:
+            await jobs.close()
+
+    interrupted, job, resent = run(scenario())
+    assert (interrupted["status"], interrupted["rows_done"]) == ("queued", 100)
+    assert job["status"] == "completed"
+    assert resent == list(range(101, 251))
+
+
+def test_failed_job_resumes(tmp_path):
+    calls = []
+
+    async def token_for(portal, session_id):
+        calls.append(portal)
+        if len(calls) == 1:
+            raise RuntimeError("token store unavailable")
+        return "token"
+
+    async def scenario():
+        sender = Sender()
+        jobs = runner(tmp_path, sender, token_for)
+        await jobs.start()
+        try:
+            job = await jobs.submit("1", csv_upload(10))
+            failed = await finished(jobs, job["id"])
+            resumed = await jobs.resume(job["id"])
+            again = await jobs.resume(job["id"])
+            return failed, resumed, again, await finished(jobs, job["id"]), len(sender.rows)
+        finally:
+            await jobs.close()
+
+    failed, resumed, again, job, sent = run(scenario())
+    assert (failed["status"], failed["error"]) == ("failed", "token store unavailable")
+    assert (resumed, again) == (True, False)
+    assert job["status"] == "completed"
+    assert sent == 10
+
+
+def test_job_leased_by_another_worker_waits_for_the_lease(tmp_path):
+    path = tmp_path / "leased.csv"
+    path.write_bytes(b"email\na@example.com\n")
+    job = {"id": "leased", "portal": "1", "filename": "leased.csv", "path": str(path), "upsert": False,
+           "status": "queued", "created_at": 0.0}
+
+    async def scenario():
+        store = JobStore(str(tmp_path / "jobs.db"))
+        await store.open()
+        await store.create(job)
+        await store.close()
+        state = MemoryState()
+        await state.add("job:leased", "another-worker", 60)
+
+        sender = Sender()
+        jobs = runner(tmp_path, sender, state=state)
+        await jobs.start()
+        try:
+            await asyncio.sleep(0.2)
+            held = (jobs.leased_elsewhere > 0, list(sender.rows), (await jobs.store.get("leased"))["status"])
+            await state.delete("job:leased")
+            done = await finished(jobs, "leased")
+            return held, done["status"], sender.rows, await state.get("job:leased")
+        finally:
+            await jobs.close()
+
+    held, status, rows, lease = run(scenario())
+    assert held == (True, [], "queued")
+    assert (status, rows, lease) == ("completed", [1], None)
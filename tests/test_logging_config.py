@@ -0,0 +1,71 @@
+import json
+import logging
+import sys
+
+from logging_config import REDACTED, JsonFormatter, RouteSampler, parse_rates, redact, route_var
+
+
+def record(msg, *args, fields=None, level=logging.INFO):
+    entry = logging.LogRecord("hubspot", level, __file__, 1, msg, args, None)
+    if fields is not None:
+        entry.fields = fields
+    return entry
+
+
+def test_redact_masks_sensitive_keys_at_any_depth():
+    value = {
+        "portal": 1,
+        "Authorization": "Bearer abc",
+        "nested": {"refresh_token": "r-1", "rows": [{"client_secret": "s", "email": "a@example.com"}]},
+    }
+    assert redact(value) == {
+        "portal": 1,
+        "Authorization": REDACTED,
+        "nested": {"refresh_token": REDACTED, "rows": [{"client_secret": REDACTED, "email": "a@example.com"}]},
+    }
+
+
+def test_redact_masks_tokens_inside_text():
+    text = (
+        "GET /oauth/v1/access-tokens/abc123 with Bearer xyz "
+        "and body code=c0de&client_secret='s3cret', {\"refresh_token\": \"r-1\"}"
+    )
+    masked = redact(text)
+    for secret in ("abc123", "xyz", "c0de", "s3cret", "r-1"):
+        assert secret not in masked
+    assert masked.startswith("GET /oauth/v1/access-tokens/[REDACTED] with Bearer [REDACTED]")
+
+
+def test_redact_leaves_ordinary_text_alone():
+    assert redact("Contact 42 updated; barcode unchanged") == "Contact 42 updated; barcode unchanged"
+
+
+def test_formatter_redacts_message_fields_and_exceptions():
+    entry = record("Refreshing with refresh_token=%s", "r-1", fields={"access_token": "a-1", "status": 401})
+    try:
+        raise RuntimeError("upstream said access_token=a-2")
+    except RuntimeError:
+        entry.exc_info = sys.exc_info()
+    line = JsonFormatter(body_limit=2048).format(entry)
+    assert "r-1" not in line and "a-1" not in line and "a-2" not in line
+    payload = json.loads(line)
+    assert payload["msg"] == f"Refreshing with refresh_token={REDACTED}"
+    assert payload["access_token"] == REDACTED
+    assert payload["status"] == 401
+
+
+def test_formatter_caps_large_fields():
+    payload = json.loads(JsonFormatter(body_limit=10).format(record("Body", fields={"body": "x" * 25})))
+    assert payload["body"] == "x" * 10 + "...[15 more chars]"
+
+
+def test_sampler_keeps_warnings_and_drops_by_route():
+    sampler = RouteSampler(parse_rates("/get-all-contacts=0, /get-contact=1"), default_rate=1.0)
+    token = route_var.set("/get-all-contacts")
+    try:
+        assert not sampler.filter(record("Listed"))
+        assert sampler.filter(record("Slow page", level=logging.WARNING))
+    finally:
+        route_var.reset(token)
+    assert sampler.rate_for("/get-contact/5") == 1
+    assert sampler.rate_for("/other") == 1.0
@@ -0,0 +1,85 @@
+import asyncio
+
+import mirror
+from mirror import ContactMirror, MirrorSync
+
+LIST = "GET /crm/v3/objects/contacts"
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def mirrored_ids(contact_mirror, portal):
+    ids, after = set(), None
+    while True:
+        records, after = await contact_mirror.page(portal, after, 1000)
+        ids |= {record["id"] for record in records}
+        if not after:
+            return ids
+
+
+def test_lists_come_from_the_mirror_only_once_webhooks_push(serve, hubspot):
+    async def scenario():
+        async with serve() as (app, client):
+            gateway = app.state.gateway
+            portal = await gateway.portal("bench-1")
+            await gateway.sync.sync(portal)
+            assert gateway.mirror.ready(portal)
+            hubspot.reset()
+            await client.get("/get-all-contacts?format=json")
+            polled = hubspot.calls[LIST]
+            gateway.sync.mark_pushed(portal)
+            await client.get("/get-all-contacts?format=json")
+            return polled, hubspot.calls[LIST]
+
+    assert run(scenario()) == (1, 1)
+
+
+def test_batch_updates_reach_the_mirror(serve, hubspot):
+    async def scenario():
+        async with serve() as (app, client):
+            gateway = app.state.gateway
+            portal = await gateway.portal("bench-1")
+            await gateway.sync.sync(portal)
+            await client.post("/contacts/bulk", files={"file": ("upload.csv", b"id,firstname\n5,Changed\n")})
+            records, _ = await gateway.mirror.page(portal, None, 1000)
+            return next(record for record in records if record["id"] == "5")
+
+    assert run(scenario())["properties"]["firstname"] == "Changed"
+
+
+def test_sync_pages_through_a_window_stuck_on_one_timestamp(monkeypatch):
+    # 250 contacts share one timestamp, more than a search window holds.
+    monkeypatch.setattr(mirror, "SEARCH_WINDOW", 100)
+    monkeypatch.setattr(mirror, "SEARCH_PAGE_SIZE", 50)
+    records = [{"id": str(i), "properties": {"lastmodifieddate": "1000"}} for i in range(1, 251)]
+    records.append({"id": "300", "properties": {"lastmodifieddate": "2000"}})
+
+    async def search(portal, token, body):
+        filters = {f["propertyName"] + f["operator"]: int(f["value"]) for f in body["filterGroups"][0]["filters"]}
+        if "lastmodifieddateEQ" in filters:
+            rows = [r for r in records if int(r["properties"]["lastmodifieddate"]) == filters["lastmodifieddateEQ"]
+                    and int(r["id"]) > filters["hs_object_idGT"]]
+        else:
+            rows = sorted((r for r in records if int(r["properties"]["lastmodifieddate"]) >= filters["lastmodifieddateGTE"]),
+                          key=lambda r: int(r["properties"]["lastmodifieddate"]))
+        offset = int(body.get("after") or 0)
+        assert offset + body["limit"] <= mirror.SEARCH_WINDOW
+        page = rows[offset:offset + body["limit"]]
+        return page, str(offset + body["limit"]) if len(rows) > offset + body["limit"] else None
+
+    async def scenario():
+        contact_mirror = ContactMirror(":memory:")
+        await contact_mirror.open()
+        sync = MirrorSync(contact_mirror, search, interval=0, push_interval=0)
+        sync.track("p", "token")
+        await sync.sync("p")
+        try:
+            return await mirrored_ids(contact_mirror, "p"), await contact_mirror.watermark("p")
+        finally:
+            await contact_mirror.close()
+
+    ids, watermark = run(scenario())
+    assert len(ids) == 251
+    assert watermark == 2000
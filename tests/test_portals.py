@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from gateway import HubSpotError
+from portals import PortalResolver
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class Lookup:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self, token):
+        self.calls += 1
+        await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+        return 42
+
+
+def test_lookups_are_cached_and_shared():
+    async def scenario():
+        lookup = Lookup()
+        resolver = PortalResolver(lookup)
+        hub_ids = await asyncio.gather(*(resolver.resolve("token") for _ in range(5)))
+        return hub_ids + [await resolver.resolve("token")], lookup.calls
+
+    assert run(scenario()) == (["42"] * 6, 1)
+
+
+def test_rejected_tokens_are_refused_without_asking_again():
+    async def scenario():
+        lookup = Lookup(HubSpotError(401, "bad token"))
+        resolver = PortalResolver(lookup)
+        for _ in range(3):
+            with pytest.raises(HubSpotError):
+                await resolver.resolve("bogus")
+        return lookup.calls
+
+    assert run(scenario()) == 1
+
+
+def test_transient_failures_are_not_cached():
+    async def scenario():
+        lookup = Lookup(HubSpotError(503, "unavailable"))
+        resolver = PortalResolver(lookup)
+        for _ in range(2):
+            with pytest.raises(HubSpotError):
+                await resolver.resolve("token")
+        return lookup.calls
+
+    assert run(scenario()) == 2
+
+
+def test_requests_without_a_token_get_401_without_calling_hubspot(serve, hubspot):
+    async def scenario():
+        async with serve(cookies={}) as (app, client):
+            responses = [await client.get("/get-all-contacts?format=json"),
+                         await client.get("/get-contact/5?format=json"),
+                         await client.get("/jobs")]
+            return [response.status_code for response in responses]
+
+    assert run(scenario()) == [401, 401, 401]
+    assert hubspot.stats()["total"] == 0
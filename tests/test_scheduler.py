@@ -0,0 +1,106 @@
+import asyncio
+
+from portals import Limits
+from scheduler import FairShare, Priority, TokenBucket
+
+
+def test_token_bucket_releases_interactive_callers_first():
+    async def scenario():
+        bucket = TokenBucket(rate=1, per=0.05)
+        await bucket.acquire(Priority.BULK)
+        order = []
+
+        async def call(name, priority):
+            await bucket.acquire(priority)
+            order.append(name)
+
+        await asyncio.wait_for(asyncio.gather(
+            call("bulk-1", Priority.BULK),
+            call("bulk-2", Priority.BULK),
+            call("interactive", Priority.INTERACTIVE),
+        ), timeout=2)
+        bucket.close()
+        return order
+
+    assert asyncio.run(scenario()) == ["interactive", "bulk-1", "bulk-2"]
+
+
+def test_token_bucket_pause_holds_callers_back():
+    async def scenario():
+        bucket = TokenBucket(rate=100, per=1)
+        bucket.pause(0.1)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.wait_for(bucket.acquire(Priority.INTERACTIVE), timeout=2)
+        bucket.close()
+        return loop.time() - started
+
+    assert asyncio.run(scenario()) >= 0.09
+
+
+def test_fair_share_splits_slots_by_weight():
+    async def scenario():
+        fair = FairShare(capacity=1)
+        light, heavy = Limits(rate=100, per=10, concurrency=10), Limits(rate=100, per=10, concurrency=10, weight=3)
+        await fair.acquire("holder", light, Priority.INTERACTIVE)
+        order = []
+
+        async def call(portal, limits):
+            await fair.acquire(portal, limits, Priority.BULK)
+            order.append(portal)
+
+        tasks = [asyncio.create_task(call("light", light)) for _ in range(8)]
+        tasks += [asyncio.create_task(call("heavy", heavy)) for _ in range(8)]
+        await asyncio.sleep(0)
+        fair.release("holder")
+        for _ in range(7):
+            await asyncio.sleep(0)
+            fair.release(order[-1])
+        await asyncio.sleep(0)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return order
+
+    order = asyncio.run(scenario())
+    assert len(order) == 8
+    assert order.count("heavy") == 6
+
+
+def test_fair_share_caps_each_portal_concurrency():
+    async def scenario():
+        fair = FairShare(capacity=10)
+        limits = Limits(rate=100, per=10, concurrency=1)
+        await fair.acquire("a", limits, Priority.INTERACTIVE)
+        second = asyncio.create_task(fair.acquire("a", limits, Priority.INTERACTIVE))
+        await fair.acquire("b", limits, Priority.INTERACTIVE)
+        await asyncio.sleep(0)
+        blocked = not second.done()
+        fair.release("a")
+        await asyncio.wait_for(second, timeout=1)
+        return blocked, fair.in_flight
+
+    assert asyncio.run(scenario()) == (True, 2)
+
+
+def test_fair_share_serves_interactive_before_bulk_within_a_portal():
+    async def scenario():
+        fair = FairShare(capacity=1)
+        limits = Limits(rate=100, per=10, concurrency=1)
+        await fair.acquire("a", limits, Priority.INTERACTIVE)
+        order = []
+
+        async def call(name, priority):
+            await fair.acquire("a", limits, priority)
+            order.append(name)
+
+        tasks = [asyncio.create_task(call("bulk", Priority.BULK)),
+                 asyncio.create_task(call("interactive", Priority.INTERACTIVE))]
+        await asyncio.sleep(0)
+        fair.release("a")
+        await asyncio.sleep(0)
+        fair.release("a")
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["interactive", "bulk"]
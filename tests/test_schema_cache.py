@@ -0,0 +1,27 @@
+import pytest
+
+from schema_cache import DISPLAY_PROPERTIES, MAX_REQUESTED_PROPERTIES, requested_properties
+
+
+def test_defaults_to_display_properties():
+    assert requested_properties() == DISPLAY_PROPERTIES
+    assert requested_properties(" , ") == DISPLAY_PROPERTIES
+
+
+def test_names_are_normalised_and_deduplicated():
+    assert requested_properties(" Email ,phone,email") == ["email", "phone"]
+
+
+def test_always_properties_come_first():
+    assert requested_properties("phone,email", always=("email", "hs_object_id")) == ["email", "hs_object_id", "phone"]
+
+
+def test_malformed_names_are_rejected():
+    with pytest.raises(ValueError, match="first-name"):
+        requested_properties("email,first-name")
+
+
+def test_too_many_properties_are_rejected():
+    spec = ",".join(f"p{i}" for i in range(MAX_REQUESTED_PROPERTIES + 1))
+    with pytest.raises(ValueError, match="At most"):
+        requested_properties(spec)
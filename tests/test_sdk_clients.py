@@ -0,0 +1,19 @@
+from sdk_clients import SDKClientPool
+
+
+def test_clients_are_cached_per_token():
+    pool = SDKClientPool(maxsize=2, ttl=1800, max_workers=1)
+    try:
+        assert pool.client_for("a") is pool.client_for("a")
+        assert pool.client_for("a") is not pool.client_for("b")
+    finally:
+        pool.shutdown()
+
+
+def test_tokenless_clients_are_not_cached():
+    pool = SDKClientPool(maxsize=2, ttl=1800, max_workers=1)
+    try:
+        assert pool.client_for(None) is not pool.client_for(None)
+        assert pool.stats()["client_cache"]["size"] == 0
+    finally:
+        pool.shutdown()
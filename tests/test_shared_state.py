@@ -0,0 +1,134 @@
+import asyncio
+import os
+import stat
+
+import pytest
+
+import shared_state
+from shared_state import MemoryState, SqliteState, shared_state_from_env
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(shared_state.time, "time", lambda: now[0])
+    return now
+
+
+def test_memory_values_expire_and_are_swept(clock):
+    async def scenario():
+        state = MemoryState(sweep_every=3)
+        await state.set("a", 1, ttl=10)
+        await state.set("b", 2, ttl=100)
+        clock[0] += 50
+        assert await state.get("b") == 2
+        assert state.stats()["keys"] == 2
+        await state.set("c", 3, ttl=10)
+        assert state.stats()["keys"] == 2
+        assert await state.get("a") is None
+
+    run(scenario())
+
+
+def test_memory_add_only_sets_missing_or_expired_keys(clock):
+    async def scenario():
+        state = MemoryState()
+        assert await state.add("lease", "one", ttl=10)
+        assert not await state.add("lease", "two", ttl=10)
+        clock[0] += 11
+        assert await state.add("lease", "two", ttl=10)
+        assert await state.get("lease") == "two"
+
+    run(scenario())
+
+
+def test_memory_take_refills_and_pause_blocks(clock):
+    async def scenario():
+        state = MemoryState()
+        assert [await state.take("portal:1", rate=2, per=10) for _ in range(2)] == [0.0, 0.0]
+        assert await state.take("portal:1", rate=2, per=10) == pytest.approx(5.0)
+        clock[0] += 5
+        assert await state.take("portal:1", rate=2, per=10) == 0.0
+        await state.pause("portal:1", 30)
+        assert await state.take("portal:1", rate=2, per=10) == pytest.approx(30.0)
+
+    run(scenario())
+
+
+def test_sqlite_file_is_private_and_shared_between_instances(tmp_path):
+    path = str(tmp_path / "state.db")
+
+    async def scenario():
+        first, second = SqliteState(path, poll_interval=0.01), SqliteState(path, poll_interval=0.01)
+        await first.start()
+        await second.start()
+        try:
+            await first.set("session:abc", {"access_token": "a-1"}, ttl=60)
+            assert await second.get("session:abc") == {"access_token": "a-1"}
+            assert await first.add("lease:job", "first", ttl=60)
+            assert not await second.add("lease:job", "second", ttl=60)
+            await second.delete("session:abc")
+            assert await first.get("session:abc") is None
+        finally:
+            await first.close()
+            await second.close()
+
+    run(scenario())
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_sqlite_bucket_is_one_budget_across_instances(tmp_path):
+    path = str(tmp_path / "state.db")
+
+    async def scenario():
+        first, second = SqliteState(path, poll_interval=0.01), SqliteState(path, poll_interval=0.01)
+        await first.start()
+        await second.start()
+        try:
+            waits = [await state.take("portal:1", rate=3, per=60) for state in (first, second, first, second)]
+        finally:
+            await first.close()
+            await second.close()
+        return waits
+
+    waits = run(scenario())
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert waits[3] > 0
+
+
+def test_sqlite_delivers_other_workers_invalidations(tmp_path, monkeypatch):
+    path = str(tmp_path / "state.db")
+    received = []
+
+    async def scenario():
+        listener, publisher = SqliteState(path, poll_interval=0.01), SqliteState(path, poll_interval=0.01)
+        await listener.start()
+        await publisher.start()
+        listener.subscribe("contact", received.append)
+        try:
+            await publisher.publish("contact", {"own": True})
+            with monkeypatch.context() as patch:
+                patch.setattr(shared_state, "WORKER_ID", "other-worker")
+                await publisher.publish("contact", {"portal": 1, "id": "5"})
+            for _ in range(100):
+                if received:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await publisher.close()
+            await listener.close()
+
+    run(scenario())
+    assert received == [{"portal": 1, "id": "5"}]
+
+
+def test_from_env_rejects_unknown_backends(monkeypatch):
+    monkeypatch.setenv("SHARED_STATE", "memcached")
+    with pytest.raises(ValueError, match="Unknown SHARED_STATE"):
+        shared_state_from_env()
+    monkeypatch.setenv("SHARED_STATE", "memory")
+    assert isinstance(shared_state_from_env(), MemoryState)
@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+from gateway import HubSpotError
+from shared_state import MemoryState
+from tokens import SESSION_COOKIE, TokenManager
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class Exchange:
+    """Stands in for HubSpot's token endpoint; `rejected` refresh tokens get a 400."""
+
+    def __init__(self, rejected=()):
+        self.rejected = set(rejected)
+        self.forms = []
+
+    async def __call__(self, form):
+        self.forms.append(form)
+        if form.get("refresh_token") in self.rejected:
+            raise HubSpotError(400, "missing or invalid refresh token")
+        return {"access_token": f"access-{len(self.forms)}", "refresh_token": form.get("refresh_token"),
+                "expires_in": 1800}
+
+
+def manager(exchange, **settings):
+    options = {"refresh_margin": 300, "check_interval": 0.01, "session_ttl": 86400, "active_window": 3600}
+    return TokenManager(exchange, **{**options, **settings}, state=MemoryState())
+
+
+def test_background_refresh_skips_idle_sessions():
+    async def scenario():
+        exchange = Exchange()
+        tokens = manager(exchange)
+        active = await tokens.store({"access_token": "a", "refresh_token": "r-active", "expires_in": 60})
+        idle = await tokens.store({"access_token": "b", "refresh_token": "r-idle", "expires_in": 60})
+        tokens.get(idle).last_used = time.time() - 7200
+        tokens.start()
+        await asyncio.sleep(0.1)
+        await tokens.close()
+        return [form["refresh_token"] for form in exchange.forms], tokens.get(active).access_token
+
+    refreshed, token = run(scenario())
+    assert refreshed == ["r-active"]
+    assert token == "access-1"
+
+
+def test_idle_session_refreshes_when_next_used():
+    async def scenario():
+        tokens = manager(Exchange())
+        session_id = await tokens.store({"access_token": "old", "refresh_token": "r", "expires_in": 0})
+        return await tokens.access_token(session_id)
+
+    assert run(scenario()) == "access-1"
+
+
+def test_rejected_refresh_token_drops_the_session():
+    async def scenario():
+        exchange = Exchange(rejected={"revoked"})
+        tokens = manager(exchange)
+        session_id = await tokens.store({"access_token": "old", "refresh_token": "revoked", "expires_in": 0})
+        token = await tokens.access_token(session_id)
+        again = await tokens.access_token(session_id)
+        return token, again, await tokens.load(session_id), len(exchange.forms), tokens.stats()["dropped"]
+
+    assert run(scenario()) == (None, None, None, 1, 1)
+
+
+def test_transient_refresh_failures_keep_the_session():
+    async def failing(form):
+        raise HubSpotError(503, "unavailable")
+
+    async def scenario():
+        tokens = manager(failing)
+        session_id = await tokens.store({"access_token": "old", "refresh_token": "r", "expires_in": 0})
+        try:
+            await tokens.access_token(session_id)
+        except HubSpotError:
+            pass
+        return await tokens.load(session_id)
+
+    assert run(scenario()) is not None
+
+
+def test_dropped_session_cookie_is_cleared(serve):
+    async def scenario():
+        async with serve(cookies={}) as (app, client):
+            tokens = app.state.tokens
+            tokens._exchange = Exchange(rejected={"revoked"})
+            session_id = await tokens.store({"access_token": "old", "refresh_token": "revoked", "expires_in": 0})
+            client.cookies.set(SESSION_COOKIE, session_id)
+            response = await client.get("/get-all-contacts?format=json")
+            return response.headers.get_list("set-cookie")
+
+    cookies = run(scenario())
+    assert any(cookie.startswith(f'{SESSION_COOKIE}=""') and "Max-Age=0" in cookie for cookie in cookies)
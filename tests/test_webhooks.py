@@ -0,0 +1,100 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import time
+
+from webhooks import SIGNATURE_HEADER, TIMESTAMP_HEADER, WebhookProcessor, contact_changes, verify_signature
+
+SECRET = "client-secret"
+URI = "https://app.example.com/hubspot/webhooks"
+
+
+def sign(method, uri, body, timestamp, secret=SECRET):
+    message = f"{method}{uri}".encode() + body + timestamp.encode()
+    return base64.b64encode(hmac.new(secret.encode(), message, hashlib.sha256).digest()).decode()
+
+
+def now_ms():
+    return str(int(time.time() * 1000))
+
+
+def test_valid_signature_is_accepted():
+    body, timestamp = b'[{"eventId": 1}]', now_ms()
+    assert verify_signature(SECRET, "POST", URI, body, timestamp, sign("POST", URI, body, timestamp), max_age=300)
+
+
+def test_tampered_body_or_wrong_secret_is_rejected():
+    body, timestamp = b'[{"eventId": 1}]', now_ms()
+    signature = sign("POST", URI, body, timestamp)
+    assert not verify_signature(SECRET, "POST", URI, b'[{"eventId": 2}]', timestamp, signature, max_age=300)
+    assert not verify_signature("other", "POST", URI, body, timestamp, signature, max_age=300)
+
+
+def test_stale_timestamp_is_rejected():
+    body = b"[]"
+    timestamp = str(int((time.time() - 600) * 1000))
+    assert not verify_signature(SECRET, "POST", URI, body, timestamp, sign("POST", URI, body, timestamp), max_age=300)
+
+
+def test_missing_or_malformed_headers_are_rejected():
+    body, timestamp = b"[]", now_ms()
+    signature = sign("POST", URI, body, timestamp)
+    assert not verify_signature(None, "POST", URI, body, timestamp, signature, max_age=300)
+    assert not verify_signature(SECRET, "POST", URI, body, None, signature, max_age=300)
+    assert not verify_signature(SECRET, "POST", URI, body, "soon", signature, max_age=300)
+    assert not verify_signature(SECRET, "POST", URI, body, timestamp, None, max_age=300)
+
+
+def test_uri_escapes_are_decoded_before_signing():
+    body, timestamp = b"[]", now_ms()
+    signature = sign("POST", f"{URI}?portal=1:2", body, timestamp)
+    assert verify_signature(SECRET, "POST", f"{URI}?portal=1%3A2", body, timestamp, signature, max_age=300)
+    assert verify_signature(SECRET, "POST", f"{URI}?portal=1%3a2", body, timestamp, signature, max_age=300)
+
+
+def test_contact_changes_skips_malformed_events():
+    changes = contact_changes([
+        {"subscriptionType": "contact.propertyChange", "objectId": 1, "propertyName": "email"},
+        {"subscriptionType": "contact.propertyChange", "portalId": 7, "objectId": 1},
+        {"subscriptionType": "contact.propertyChange", "portalId": 7, "objectId": 2,
+         "propertyName": "email", "propertyValue": "a@example.com"},
+    ])
+    assert list(changes) == ["7"]
+    assert changes["7"].patched == {"2": {"email": "a@example.com"}}
+
+
+def test_contact_changes_latest_event_wins():
+    changes = contact_changes([
+        {"subscriptionType": "contact.deletion", "portalId": 7, "objectId": 3, "occurredAt": 2},
+        {"subscriptionType": "contact.propertyChange", "portalId": 7, "objectId": 3, "occurredAt": 1,
+         "propertyName": "phone", "propertyValue": "1"},
+    ])
+    assert changes["7"].deleted == {"3"}
+    assert changes["7"].patched == {}
+
+
+def test_submit_skips_elements_that_are_not_events():
+    async def scenario():
+        processor = WebhookProcessor(lambda batch: None, workers=2, batch_size=10, batch_wait=0.01, queue_size=10)
+        accepted = processor.submit([1, None, "event", {"eventId": [1]}, {"eventId": 5, "portalId": 7, "objectId": 1}])
+        return accepted, processor.stats()
+
+    accepted, stats = asyncio.run(scenario())
+    assert accepted == 1
+    assert (stats["received"], stats["malformed"], stats["queued"]) == (5, 4, 1)
+
+
+def test_signed_delivery_of_non_events_is_acknowledged(serve, monkeypatch):
+    monkeypatch.setenv("CLIENT_SECRET", SECRET)
+    body, timestamp = b"[1, null]", now_ms()
+    headers = {TIMESTAMP_HEADER: timestamp,
+               SIGNATURE_HEADER: sign("POST", "http://app.test/hubspot/webhooks", body, timestamp)}
+
+    async def scenario():
+        async with serve() as (app, client):
+            return await client.post("/hubspot/webhooks", content=body, headers=headers)
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 200
+    assert response.json() == {"accepted": 0}
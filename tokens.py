@@ -0,0 +1,229 @@
+from dataclasses import asdict, dataclass
+from os import getenv
+import asyncio
+import secrets
+import logging
+import time
+from coalescing import SingleFlight
+from gateway import HubSpotError
+
+logger = logging.getLogger(__name__)
+
+SESSION_COOKIE = "hubspot_session"
+
+
+@dataclass
+class TokenRecord:
+    access_token: str
+    refresh_token: str
+    expires_at: float
+    last_used: float
+
+
+class TokenManager:
+    """Server-side OAuth tokens per browser session, refreshed before they expire.
+
+    `exchange` is an async callable that POSTs a form to HubSpot's
+    `/oauth/v1/token` (client credentials are added by the caller) and
+    returns the token JSON as a dict, raising on failure.
+
+    Sessions are looked up by id in a dict, so the hot path is O(1). A
+    background task refreshes tokens `refresh_margin` seconds ahead of
+    expiry for sessions used within the last `active_window` seconds; a
+    request that still finds its token expired (say, on a session that sat
+    idle) refreshes it inline, and concurrent requests for the same session
+    share that one refresh. A session whose refresh token HubSpot rejects
+    (the app was uninstalled, the token revoked) is dropped, and
+    `clear_dropped_session` removes its cookie on the browser's next request.
+
+    Sessions are also written to `state` (see `shared_state`), so with
+    several worker processes a session made by one is found by the others,
+    and a worker about to refresh first checks whether another already has.
+    Two workers refreshing at once is harmless: HubSpot keeps the refresh
+    token valid and both access tokens work until they expire.
+    """
+
+    def __init__(self, exchange, refresh_margin: float, check_interval: float, session_ttl: float,
+                 active_window: float = 3600, state=None):
+        self._exchange = exchange
+        self._state = state
+        self.refresh_margin = refresh_margin
+        self.check_interval = check_interval
+        self.session_ttl = session_ttl
+        self.active_window = active_window
+        self._sessions = {}
+        self._refreshes = SingleFlight()
+        self._task = None
+        self.refreshed = 0
+        self.refresh_failures = 0
+        self.dropped = 0
+
+    @classmethod
+    def from_env(cls, exchange, state=None) -> "TokenManager":
+        return cls(
+            exchange,
+            refresh_margin=float(getenv("HUBSPOT_TOKEN_REFRESH_MARGIN", "300")),
+            check_interval=float(getenv("HUBSPOT_TOKEN_CHECK_INTERVAL", "30")),
+            session_ttl=float(getenv("HUBSPOT_SESSION_TTL", str(30 * 24 * 3600))),
+            active_window=float(getenv("HUBSPOT_TOKEN_ACTIVE_WINDOW", "3600")),
+            state=state,
+        )
+
+    def start(self):
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def store(self, tokens: dict, session_id: str = None) -> str:
+        """Keep the tokens from a HubSpot token response; returns the session id."""
+        session_id = session_id or secrets.token_urlsafe(32)
+        now = time.time()
+        record = self._sessions[session_id] = TokenRecord(
+            access_token=tokens["access_token"],
+            refresh_token=tokens.get("refresh_token"),
+            expires_at=now + float(tokens.get("expires_in", 1800)),
+            last_used=now,
+        )
+        if self._state is not None:
+            await self._state.set(f"session:{session_id}", asdict(record), self.session_ttl)
+        return session_id
+
+    def get(self, session_id: str):
+        return self._sessions.get(session_id) if session_id else None
+
+    async def _shared(self, session_id: str):
+        """The session as last stored by any worker, or None."""
+        data = await self._state.get(f"session:{session_id}") if self._state is not None else None
+        return TokenRecord(**data) if data else None
+
+    async def load(self, session_id: str):
+        """Like `get`, but also finds sessions another worker made."""
+        record = self.get(session_id)
+        if record is None and session_id:
+            record = await self._shared(session_id)
+            if record is not None:
+                self._sessions[session_id] = record
+        return record
+
+    async def authorize(self, code: str) -> tuple:
+        """Exchange an OAuth callback code; returns `(session_id, tokens)`."""
+        tokens = await self._exchange({
+            "grant_type": "authorization_code",
+            "redirect_uri": getenv('REDIRECT_URI'),
+            "code": code,
+        })
+        return await self.store(tokens), tokens
+
+    async def adopt(self, refresh_token: str) -> tuple:
+        """Start a session from a refresh token the user already holds; returns `(session_id, tokens)`."""
+        tokens = await self._exchange({"grant_type": "refresh_token", "refresh_token": refresh_token})
+        return await self.store(tokens), tokens
+
+    async def access_token(self, session_id: str):
+        """The session's access token, refreshed if it has expired; None for an unknown or dropped session."""
+        record = await self.load(session_id)
+        if record is None:
+            return None
+        record.last_used = time.time()
+        if record.expires_at <= record.last_used:
+            try:
+                record = await self.refresh(session_id)
+            except HubSpotError as e:
+                if not _rejected(e):
+                    raise
+                return None
+        return record.access_token
+
+    async def access_token_for(self, request):
+        """The caller's access token: from its session, else the legacy cookie."""
+        session_id = request.cookies.get(SESSION_COOKIE)
+        token = await self.access_token(session_id)
+        if session_id and token is None:
+            request.state.session_gone = True
+        return token or request.cookies.get("access_token")
+
+    async def drop(self, session_id: str):
+        """Forget a session in this worker and the shared state."""
+        self._sessions.pop(session_id, None)
+        if self._state is not None:
+            await self._state.delete(f"session:{session_id}")
+
+    async def refresh(self, session_id: str) -> TokenRecord:
+        return await self._refreshes.do(session_id, self._refresh, session_id)
+
+    async def _refresh(self, session_id: str) -> TokenRecord:
+        record = self._sessions[session_id]
+        shared = await self._shared(session_id)
+        if shared is not None and shared.expires_at - time.time() > self.refresh_margin:
+            # Another worker refreshed it already.
+            shared.last_used = record.last_used
+            self._sessions[session_id] = shared
+            return shared
+        try:
+            tokens = await self._exchange({"grant_type": "refresh_token", "refresh_token": record.refresh_token})
+        except Exception as e:
+            self.refresh_failures += 1
+            if _rejected(e):
+                # Retrying can't help; the user has to sign in again.
+                self.dropped += 1
+                logger.warning("Refresh token rejected; session dropped", extra={"fields": {"status": e.status}})
+                await self.drop(session_id)
+            raise
+        tokens.setdefault("refresh_token", record.refresh_token)
+        await self.store(tokens, session_id)
+        self._sessions[session_id].last_used = record.last_used
+        self.refreshed += 1
+        return self._sessions[session_id]
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            now = time.time()
+            due = []
+            for session_id, record in list(self._sessions.items()):
+                # Only this worker's copy goes; the shared one lapses on its own TTL unless refreshed.
+                if now - record.last_used > self.session_ttl:
+                    del self._sessions[session_id]
+                # Idle sessions are left to refresh inline when next used.
+                elif (record.refresh_token and record.expires_at - now <= self.refresh_margin
+                      and now - record.last_used <= self.active_window):
+                    due.append(self.refresh(session_id))
+            # Failures are counted; transient ones are retried on the next pass or by the next request.
+            await asyncio.gather(*due, return_exceptions=True)
+
+    def set_cookies(self, response, session_id: str):
+        """Point the browser at its session, dropping any legacy cookie that held the raw access token."""
+        response.set_cookie(
+            key=SESSION_COOKIE,
+            value=session_id,
+            httponly=True,
+            secure=True,
+            samesite="lax",
+            max_age=int(self.session_ttl)
+        )
+        response.delete_cookie(key="access_token", httponly=True, secure=True, samesite="lax")
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "refreshing": len(self._refreshes),
+            "refreshed": self.refreshed,
+            "refresh_failures": self.refresh_failures,
+            "dropped": self.dropped,
+        }
+
+
+def _rejected(e: Exception) -> bool:
+    """Whether HubSpot turned the refresh token down for good (a 4xx other than 429)."""
+    return isinstance(e, HubSpotError) and 400 <= e.status < 500 and e.status != 429
+
+
+async def clear_dropped_session(request, call_next):
+    """HTTP middleware: expire the session cookie when `access_token_for` found its session gone."""
+    response = await call_next(request)
+    if getattr(request.state, "session_gone", False):
+        response.delete_cookie(key=SESSION_COOKIE, httponly=True, secure=True, samesite="lax")
+    return response
@@ -0,0 +1,261 @@
+from dataclasses import dataclass, field
+from os import getenv
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import time
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = "X-HubSpot-Signature-v3"
+TIMESTAMP_HEADER = "X-HubSpot-Request-Timestamp"
+
+# HubSpot signs the URI with these escapes decoded.
+_URI_DECODES = {
+    "%3A": ":", "%2F": "/", "%3F": "?", "%40": "@", "%21": "!", "%24": "$",
+    "%27": "'", "%28": "(", "%29": ")", "%2A": "*", "%2C": ",", "%3B": ";",
+}
+
+
+def _signed_uri(uri: str) -> str:
+    for escaped, char in _URI_DECODES.items():
+        uri = uri.replace(escaped, char).replace(escaped.lower(), char)
+    return uri
+
+
+def verify_signature(secret: str, method: str, uri: str, body: bytes, timestamp: str, signature: str,
+                     max_age: float) -> bool:
+    """Check a v3 webhook signature: base64 HMAC-SHA256 of method, URI, body and timestamp."""
+    if not (secret and timestamp and signature):
+        return False
+    try:
+        sent_at = int(timestamp) / 1000
+    except ValueError:
+        return False
+    # Stale timestamps are rejected so captured requests can't be replayed.
+    if abs(time.time() - sent_at) > max_age:
+        return False
+    message = f"{method}{_signed_uri(uri)}".encode() + body + timestamp.encode()
+    expected = base64.b64encode(hmac.new(secret.encode(), message, hashlib.sha256).digest()).decode()
+    return hmac.compare_digest(expected, signature)
+
+
+def signature_valid(request, body: bytes) -> bool:
+    """Verify a webhook request against CLIENT_SECRET.
+
+    HubSpot signs the public URL it called; set WEBHOOK_URL when the app
+    sits behind a proxy that changes the scheme or host.
+    """
+    uri = str(request.url)
+    public_url = getenv("WEBHOOK_URL")
+    if public_url:
+        uri = f"{public_url}?{request.url.query}" if request.url.query else public_url
+    return verify_signature(
+        getenv("CLIENT_SECRET"),
+        request.method,
+        uri,
+        body,
+        request.headers.get(TIMESTAMP_HEADER),
+        request.headers.get(SIGNATURE_HEADER),
+        max_age=float(getenv("WEBHOOK_MAX_AGE", "300")),
+    )
+
+
+@dataclass
+class ContactChanges:
+    """What a batch of events means for one portal's contacts."""
+    deleted: set = field(default_factory=set)
+    patched: dict = field(default_factory=dict)
+    fetch: set = field(default_factory=set)
+
+
+def _malformed(event, kind: str) -> bool:
+    if event.get("portalId") is None or event.get("objectId") is None:
+        return True
+    return kind == "contact.propertyChange" and not event.get("propertyName")
+
+
+def contact_changes(events) -> dict:
+    """Fold contact events into one `ContactChanges` per portal, latest event winning.
+
+    Events missing the fields they need are logged and skipped.
+    """
+    changes = {}
+    for event in sorted(events, key=lambda e: e.get("occurredAt") or 0):
+        kind = event.get("subscriptionType") or ""
+        if not kind.startswith("contact."):
+            continue
+        if _malformed(event, kind):
+            logger.warning("Skipping malformed webhook event",
+                           extra={"fields": {"event": event.get("eventId"), "type": kind}})
+            continue
+        portal_changes = changes.setdefault(str(event["portalId"]), ContactChanges())
+        contact_id = str(event.get("objectId"))
+        if kind in ("contact.deletion", "contact.privacyDeletion"):
+            gone = [contact_id]
+        elif kind == "contact.merge":
+            gone = [str(merged) for merged in event.get("mergedObjectIds", [])]
+            portal_changes.fetch.add(str(event.get("primaryObjectId", contact_id)))
+        else:
+            gone = []
+            if kind in ("contact.creation", "contact.restore"):
+                portal_changes.fetch.add(contact_id)
+                portal_changes.deleted.discard(contact_id)
+            elif kind == "contact.propertyChange" and contact_id not in portal_changes.deleted:
+                portal_changes.patched.setdefault(contact_id, {})[event["propertyName"]] = event.get("propertyValue")
+        for removed in gone:
+            portal_changes.deleted.add(removed)
+            portal_changes.patched.pop(removed, None)
+            portal_changes.fetch.discard(removed)
+    return changes
+
+
+async def apply_contact_events(events, *, contacts, mirror, sync, emails, read_batch, batch_size: int = 100):
+    """Push a batch of contact events into the contact cache, the local mirror and the email index.
+
+    Property changes are patched in place; only created, restored or merged
+    contacts (and changes to rows the mirror doesn't have yet) are read back
+    from HubSpot, in batches, through `read_batch(portal, token, ids)`.
+    """
+    for portal, changes in contact_changes(events).items():
+        sync.mark_pushed(portal)
+        for contact_id in changes.deleted:
+            await contacts.invalidate(portal, contact_id)
+            emails.forget_contact(portal, contact_id)
+        if changes.deleted:
+            await mirror.delete(portal, changes.deleted)
+
+        for contact_id, properties in changes.patched.items():
+            await contacts.patch(portal, contact_id, properties)
+            if "email" in properties:
+                emails.add(portal, contact_id, properties["email"])
+            if not await mirror.patch(portal, contact_id, properties) and mirror.ready(portal):
+                changes.fetch.add(contact_id)
+
+        token = sync.token_for(portal)
+        if not changes.fetch or token is None:
+            continue
+        ids = sorted(changes.fetch)
+        for start in range(0, len(ids), batch_size):
+            await mirror.upsert(portal, await read_batch(portal, token, ids[start:start + batch_size]))
+        # Reads fall through to the refreshed mirror row.
+        for contact_id in ids:
+            await contacts.invalidate(portal, contact_id)
+
+
+class WebhookProcessor:
+    """Queues webhook events and applies them in batches on a pool of workers.
+
+    Events are partitioned across workers by portal and object id, so
+    changes to one contact are always applied in order. HubSpot retries
+    deliveries, so event ids already queued or applied recently are dropped
+    as duplicates; an event only counts as applied once its batch is, so a
+    failed batch's events are taken again if they are redelivered. Each
+    worker waits up to `batch_wait` seconds to fill a batch before handing
+    it to `apply`.
+    """
+
+    def __init__(self, apply, workers: int, batch_size: int, batch_wait: float, queue_size: int,
+                 dedup_ttl: float = 3600):
+        self._apply = apply
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._queues = [asyncio.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)]
+        self._seen = TTLCache(maxsize=max(queue_size, 10000), ttl=dedup_ttl)
+        self._pending = set()
+        self._workers = []
+        self.received = 0
+        self.duplicates = 0
+        self.malformed = 0
+        self.rejected = 0
+        self.batches = 0
+        self.applied = 0
+        self.failures = 0
+
+    @classmethod
+    def from_env(cls, apply) -> "WebhookProcessor":
+        return cls(
+            apply,
+            workers=int(getenv("WEBHOOK_WORKERS", "4")),
+            batch_size=int(getenv("WEBHOOK_BATCH_SIZE", "100")),
+            batch_wait=float(getenv("WEBHOOK_BATCH_WAIT", "0.5")),
+            queue_size=int(getenv("WEBHOOK_QUEUE_SIZE", "10000")),
+        )
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._work(queue)) for queue in self._queues]
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    def submit(self, events) -> int:
+        """Queue new events without waiting; raises `asyncio.QueueFull` when a partition is full.
+
+        Events queued before the overflow stay queued and are recognised as
+        duplicates when HubSpot retries the delivery. Elements that aren't
+        event objects are logged, counted as `malformed` and skipped.
+        """
+        accepted = 0
+        for event in events:
+            self.received += 1
+            if not isinstance(event, dict) or not isinstance(event.get("eventId"), (int, str, type(None))):
+                self.malformed += 1
+                logger.warning("Skipping malformed webhook event", extra={"fields": {"type": type(event).__name__}})
+                continue
+            event_id = event.get("eventId")
+            if event_id is not None and (event_id in self._pending or event_id in self._seen):
+                self.duplicates += 1
+                continue
+            partition = hash((str(event.get("portalId")), str(event.get("objectId")))) % len(self._queues)
+            try:
+                self._queues[partition].put_nowait(event)
+            except asyncio.QueueFull:
+                self.rejected += 1
+                raise
+            if event_id is not None:
+                self._pending.add(event_id)
+            accepted += 1
+        return accepted
+
+    async def _work(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            self.batches += 1
+            try:
+                await self._apply(batch)
+                self.applied += len(batch)
+                for event in batch:
+                    if event.get("eventId") is not None:
+                        self._seen.set(event["eventId"], True)
+            except Exception as e:
+                self.failures += 1
+                logger.warning("Webhook batch failed", extra={"fields": {"events": len(batch), "error": str(e)}})
+            finally:
+                self._pending.difference_update(event.get("eventId") for event in batch)
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "malformed": self.malformed,
+            "rejected": self.rejected,
+            "queued": sum(queue.qsize() for queue in self._queues),
+            "batches": self.batches,
+            "applied": self.applied,
+            "failures": self.failures,
+        }